@@ -0,0 +1,53 @@
+"""
+Latency of a dashboard search (first page of 20 plus the total) as the table
+grows to 1M messages, next to the old LIKE '%term%' scan: a rare term, one in
+1% of messages, a Chinese one, the 1% term within one API key, and a term in
+nearly every message (the worst case for the index).
+
+    python -m benchmarks.chat_search
+"""
+import asyncio
+import time
+from typing import Any, Dict
+
+from benchmarks.seeding import (chat_message_rows, insert_rows,
+                                temporary_database)
+from prompt_agent.models.chat_search import (TABLE, _search_like,
+                                             search_chat_messages)
+
+SIZES = (100_000, 1_000_000)
+MARKERS = (("zanzibar", 10_000, 0), ("kubernetes", 100, 1), ("向量检索", 1_000, 2))
+SEARCHES = (
+    ("zanzibar", {}),
+    ("kubernetes", {}),
+    ("向量检索", {}),
+    ("kubernetes", {"api_key": "sj-bench-1"}),
+    ("latency", {}),
+)
+
+
+async def measure(fn, term: str, filters: Dict[str, Any]):
+    started_at = time.perf_counter()
+    _, total = await fn(term, 0, 20, **filters)
+    return (time.perf_counter() - started_at) * 1000, total
+
+
+async def main():
+    async with temporary_database():
+        seeded = 0
+        for rows in SIZES:
+            await insert_rows(TABLE, chat_message_rows(seeded, rows, markers=MARKERS))
+            seeded = rows
+            for term, filters in SEARCHES:
+                index_ms, total = await measure(search_chat_messages, term, filters)
+                like_ms, like_total = await measure(_search_like, term, filters)
+                print(
+                    f"{rows:>9} rows  {term + (' +key' if filters else ''):16} "
+                    f"index {index_ms:8.1f} ms  LIKE {like_ms:8.1f} ms  "
+                    f"total {total}"
+                    + ("" if total == like_total else f" != {like_total}")
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+Per-request inserts as fast as 32 writers go, next to dashboard-style page
+reads arriving at a fixed rate; the rollback journal with one shared
+connection versus the tuned profile (WAL + pragmas, one write connection and
+a read pool). Reads are open-loop so that faster reads don't just steal CPU
+from the writers.
+
+    python -m benchmarks.db_load
+"""
+import asyncio
+import itertools
+import time
+from typing import Any, Dict, List
+
+from tortoise import timezone
+from tortoise.backends.base.config_generator import expand_db_url
+
+from benchmarks.seeding import temporary_database
+from prompt_agent.db import build_tortoise_config
+from prompt_agent.models.chat_message import UsageRecord
+
+WRITERS, READS_PER_SECOND, SECONDS = 32, 20, 5.0
+
+
+def baseline_config(db_url: str) -> Dict[str, Any]:
+    """One shared connection on the rollback journal, as before"""
+    return {
+        "connections": {"default": expand_db_url(f"{db_url}?journal_mode=DELETE")},
+        "apps": {"models": {"models": ["prompt_agent.models"]}},
+    }
+
+
+async def run() -> Dict[str, float]:
+    counter = itertools.count()
+    inserts = 0
+    read_latencies: List[float] = []
+    deadline = time.perf_counter() + SECONDS
+
+    async def writer():
+        nonlocal inserts
+        while time.perf_counter() < deadline:
+            now = timezone.now()
+            await UsageRecord.create(
+                request_id=f"bench-{next(counter)}",
+                api_key="sj-bench",
+                model="bench",
+                request_start_time=now,
+                request_end_time=now,
+                input_tokens=100,
+                output_tokens=200,
+                total_tokens=300,
+            )
+            inserts += 1
+
+    async def read_page():
+        started_at = time.perf_counter()
+        await UsageRecord.filter(api_key="sj-bench").count()
+        await UsageRecord.all().order_by("-timestamp").limit(50)
+        read_latencies.append((time.perf_counter() - started_at) * 1000)
+
+    async def reads():
+        pending = []
+        while time.perf_counter() < deadline:
+            pending.append(asyncio.create_task(read_page()))
+            await asyncio.sleep(1 / READS_PER_SECOND)
+        await asyncio.gather(*pending)
+
+    await asyncio.gather(*(writer() for _ in range(WRITERS)), reads())
+    read_latencies.sort()
+    return {
+        "inserts": inserts / SECONDS,
+        "read_p50": read_latencies[len(read_latencies) // 2],
+        "read_p99": read_latencies[int(len(read_latencies) * 0.99)],
+    }
+
+
+async def main():
+    for name, config_factory in (
+        ("baseline", baseline_config),
+        ("tuned", build_tortoise_config),
+    ):
+        async with temporary_database(config_factory):
+            result = await run()
+        print(
+            f"{name:<9} {result['inserts']:6.0f} inserts/s  read p50 "
+            f"{result['read_p50']:7.1f} ms  p99 {result['read_p99']:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+"""
+Shared helpers for the benchmarks: a throwaway SQLite database with the
+production Tortoise config, and bulk inserts of synthetic usage records and
+chat messages with raw ``executemany`` (the ORM is far too slow for 1M rows).
+"""
+import random
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Optional
+
+from tortoise import Tortoise, connections, timezone
+
+from prompt_agent.db import build_tortoise_config
+from prompt_agent.models.chat_message import RequestStatus, RequestType
+from prompt_agent.models.chat_search import ensure_search_index
+
+BATCH = 50_000
+
+WORDS = (
+    "prompt optimize answer context token model python rust query cache "
+    "latency index search vector embedding 提示词 优化 检索 向量 模型"
+).split()
+
+
+@asynccontextmanager
+async def temporary_database(
+    config_factory: Callable[[str], Dict[str, Any]] = build_tortoise_config,
+) -> AsyncIterator[Path]:
+    """Tortoise initialised on a SQLite file in a temporary directory"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.sqlite3"
+        await Tortoise.init(config=config_factory(f"sqlite://{path}"))
+        try:
+            await Tortoise.generate_schemas()
+            await ensure_search_index()
+            yield path
+        finally:
+            await Tortoise.close_connections()
+
+
+async def insert_rows(table: str, rows: Iterable[Dict[str, Any]], batch: int = BATCH):
+    """Insert dicts (all with the same keys) in batches of ``batch`` rows"""
+    connection = connections.get("default")
+    sql, values = None, []
+    for row in rows:
+        if sql is None:
+            sql = (
+                f"INSERT INTO {table} ({', '.join(row)}) "
+                f"VALUES ({', '.join('?' * len(row))})"
+            )
+        values.append(tuple(row.values()))
+        if len(values) >= batch:
+            await connection.execute_many(sql, values)
+            values = []
+    if values:
+        await connection.execute_many(sql, values)
+
+
+def usage_record_rows(
+    start: int,
+    stop: int,
+    keys: int = 100,
+    seconds: int = 29 * 86400,
+    seed: Optional[int] = None,
+    now: Optional[datetime] = None,
+) -> Iterable[Dict[str, Any]]:
+    """
+    Usage records ``bench-{start}`` .. ``bench-{stop - 1}`` spread over the
+    last ``seconds``; one in ten failed. Without a seed, keys and times are
+    assigned round-robin; with one, times are random and key usage is skewed
+    (a few keys send most of the requests).
+    """
+    rnd = random.Random(seed)
+    now = now or timezone.now()
+    for i in range(start, stop):
+        if seed is None:
+            ts = now - timedelta(seconds=i % seconds)
+            api_key = f"sj-bench-{i % keys}"
+        else:
+            ts = now - timedelta(seconds=rnd.randrange(seconds))
+            api_key = f"sj-bench-{int(rnd.paretovariate(1.2)) % keys}"
+        yield {
+            "request_id": f"bench-{i}",
+            "api_key": api_key,
+            "timestamp": ts,
+            "request_type": RequestType.CHAT_COMPLETION.value,
+            "model": "model-a" if i % 3 else "model-b",
+            "status": (RequestStatus.SUCCESS if i % 10 else RequestStatus.ERROR).value,
+            "request_start_time": ts,
+            "response_time_ms": 100 + i % 900,
+            "input_tokens": 100,
+            "output_tokens": 200,
+            "total_tokens": 300,
+            "stream": False,
+            "enable_retrieval": False,
+            "metadata": "{}",
+            "created_at": ts,
+            "updated_at": ts,
+        }
+
+
+def chat_message_rows(
+    start: int,
+    stop: int,
+    keys: int = 100,
+    markers: Iterable[tuple] = (),
+    now: Optional[datetime] = None,
+) -> Iterable[Dict[str, Any]]:
+    """
+    Chat messages of random words, one per second going back from now.
+    ``markers`` are ``(term, every, offset)``: message ``i`` gets ``term``
+    appended to its prompt when ``i % every == offset``.
+    """
+    rnd = random.Random(start)
+    now = now or timezone.now()
+    markers = list(markers)
+    for i in range(start, stop):
+        ts = now - timedelta(seconds=i)
+        prompt = " ".join(rnd.choices(WORDS, k=12))
+        for term, every, offset in markers:
+            if i % every == offset:
+                prompt += f" {term}"
+        yield {
+            "request_id": f"bench-{i}",
+            "api_key": f"sj-bench-{i % keys}",
+            "timestamp": ts,
+            "model": "bench",
+            "user_prompt": prompt,
+            "assistant_response": " ".join(rnd.choices(WORDS, k=30)),
+            "stream": False,
+            "enable_retrieval": False,
+            "created_at": ts,
+            "updated_at": ts,
+        }
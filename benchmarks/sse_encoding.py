@@ -0,0 +1,58 @@
+"""
+Per-chunk CPU cost of the streaming response frames with 1k concurrent
+streams: dict + json.dumps + json.loads re-parse + string concatenation,
+versus ChatCompletionChunkEncoder templates + list join.
+
+    python -m benchmarks.sse_encoding
+"""
+import asyncio
+import json
+import time
+
+from prompt_agent.utils.sse_utils import ChatCompletionChunkEncoder
+
+STREAMS, CHUNKS = 1000, 50
+DELTAS = [f"token{i} " for i in range(CHUNKS)]
+
+
+async def legacy_stream():
+    response_text, tracked_text = "", ""
+    for i, data in enumerate(DELTAS):
+        response_text += data
+        chunk = {
+            "id": i,
+            "object": "chat.completion.chunk",
+            "created": time.time(),
+            "model": "gpt",
+            "choices": [{"delta": {"content": f"{data}"}}],
+        }
+        frame = f"data: {json.dumps(chunk)}\n\n"
+        chunk_data = json.loads(frame.replace("data: ", "").strip())
+        tracked_text += chunk_data["choices"][0]["delta"].get("content", "")
+        await asyncio.sleep(0)
+
+
+async def encoder_stream():
+    encoder = ChatCompletionChunkEncoder("gpt", "chatcmpl-1")
+    parts = []
+    for data in DELTAS:
+        encoder.encode(data)
+        parts.append(data)
+        await asyncio.sleep(0)
+    "".join(parts)
+
+
+async def run(stream):
+    await asyncio.gather(*(stream() for _ in range(STREAMS)))
+
+
+def main():
+    for name, stream in (("legacy", legacy_stream), ("encoder", encoder_stream)):
+        start = time.process_time()
+        asyncio.run(run(stream))
+        elapsed = time.process_time() - start
+        print(f"{name:<8} {elapsed / (STREAMS * CHUNKS) * 1e6:6.2f} us/chunk (CPU)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+StreamingTagExtractor against the accumulate/find/endswith filter it replaced.
+
+    python -m benchmarks.tag_extractor
+"""
+import time
+from typing import List
+
+from prompt_agent.configs import OUTPUT_PROMPT_END_TAG, OUTPUT_PROMPT_START_TAG
+from prompt_agent.utils.tag_extractor import StreamingTagExtractor
+
+
+def legacy_extract(chunks: List[str], start_tag: str, end_tag: str) -> str:
+    """The previous filter_prompt_generator loop."""
+    accumulated_text = ""
+    buffer = ""
+    hit_start_tag = False
+    output = []
+    for text in chunks:
+        if not hit_start_tag:
+            accumulated_text += text
+            if start_tag in accumulated_text:
+                start_pos = accumulated_text.find(start_tag)
+                output.append(accumulated_text[start_pos + len(start_tag) :])
+                hit_start_tag = True
+            continue
+        buffer += text
+        if end_tag in buffer:
+            output.append(buffer[: buffer.find(end_tag)])
+            break
+        max_prefix_len = 0
+        for i in range(1, min(len(buffer) + 1, len(end_tag))):
+            if buffer.endswith(end_tag[:i]):
+                max_prefix_len = i
+        if max_prefix_len:
+            output.append(buffer[:-max_prefix_len])
+            buffer = buffer[-max_prefix_len:]
+        else:
+            output.append(buffer)
+            buffer = ""
+    return "".join(output)
+
+
+def extract(chunks: List[str]) -> str:
+    extractor = StreamingTagExtractor(max_blocks=1)
+    output = []
+    for chunk in chunks:
+        output.extend(segment.text for segment in extractor.feed(chunk))
+        if extractor.finished:
+            break
+    output.extend(segment.text for segment in extractor.flush())
+    return "".join(output)
+
+
+def main():
+    # Synthetic model output: long reasoning before the tag, then the prompt
+    preamble = "Let me think about how to improve this prompt. <p>< / " * 400
+    body = "Rewrite the request so the goal, constraints and format are clear. <" * 200
+    text = f"{preamble}{OUTPUT_PROMPT_START_TAG}{body}{OUTPUT_PROMPT_END_TAG}trailing"
+
+    for chunk_size in (1, 4, 16, 64):
+        chunks = [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+        assert extract(chunks) == body
+        for name, func, args in (
+            ("legacy", legacy_extract, (OUTPUT_PROMPT_START_TAG, OUTPUT_PROMPT_END_TAG)),
+            ("extractor", extract, ()),
+        ):
+            start = time.perf_counter()
+            func(chunks, *args)
+            elapsed = time.perf_counter() - start
+            print(f"chunk_size={chunk_size:<3} {name:<10} {elapsed * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Peak Python memory and latency of UsageRecord.get_usage_stats as the 30-day
+window grows to 1M rows, next to the old approach of loading every record in
+the window and summing in Python (only run on the smallest table).
+
+    python -m benchmarks.usage_stats
+"""
+import asyncio
+import time
+import tracemalloc
+from datetime import timedelta
+from typing import Any, Dict
+
+from tortoise import timezone
+
+from benchmarks.seeding import (insert_rows, temporary_database,
+                                usage_record_rows)
+from prompt_agent.models.chat_message import UsageRecord
+
+SIZES = (10_000, 100_000, 1_000_000)
+
+
+async def load_all(days: int = 30) -> Dict[str, Any]:
+    records = await UsageRecord.filter(
+        timestamp__gte=timezone.now() - timedelta(days=days)
+    ).all()
+    return {"total_tokens": sum(r.total_tokens or 0 for r in records)}
+
+
+async def measure(fn) -> Dict[str, float]:
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    await fn()
+    elapsed = time.perf_counter() - started_at
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ms": elapsed * 1000, "peak_mb": peak / 2**20}
+
+
+async def main():
+    async with temporary_database():
+        seeded = 0
+        for rows in SIZES:
+            await insert_rows("usage_records", usage_record_rows(seeded, rows))
+            seeded = rows
+            result = await measure(UsageRecord.get_usage_stats)
+            line = (
+                f"{rows:>9} rows  aggregate {result['ms']:8.1f} ms "
+                f"{result['peak_mb']:8.2f} MB"
+            )
+            if rows <= 10_000:
+                result = await measure(load_all)
+                line += (
+                    f"  load all {result['ms']:8.1f} ms "
+                    f"{result['peak_mb']:8.2f} MB"
+                )
+            print(line)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,16 +1,20 @@
 import asyncio
+from contextlib import aclosing
 from functools import lru_cache, partial
 from http.client import responses
-from typing import AsyncGenerator, Dict, List, Union
+from typing import AsyncGenerator, Dict, List, Optional, Union
 
 from loguru import logger
 
 from prompt_agent.configs import (DEFAULT_MODEL, DEFAULT_RETRIVAL_COUNT,
-                                  ENABLE_VECTOR_DB_RETRIVAL,
+                                  ENABLE_VECTOR_DB_RETRIVAL, MAX_PROMPT_TOKENS,
                                   OUTPUT_PROMPT_END_TAG,
-                                  OUTPUT_PROMPT_START_TAG)
+                                  OUTPUT_PROMPT_START_TAG, USE_TOKEN_SHORTEN)
 from prompt_agent.prompts import OPTIMIZE_PROMPT, RAG_REFER_PROMPT
-from prompt_agent.provider import async_client
+from prompt_agent.provider import get_upstream_pool
+from prompt_agent.utils.tag_extractor import StreamingTagExtractor
+from prompt_agent.utils.token_utils import \
+    async_shorten_message_given_prompt_length
 from prompt_agent.vector_db.prompt_vector_db import get_prompt_vector_db
 
 # 不写设计模式了， 什么继承之类的
@@ -20,88 +24,64 @@ prompt_vector_db = get_prompt_vector_db()
 
 class PromptAgent(object):
     def __init__(self):
-        self.client = async_client
+        self.pool = get_upstream_pool()
+
+    @staticmethod
+    def _new_prompt_extractor() -> StreamingTagExtractor:
+        return StreamingTagExtractor(
+            [(OUTPUT_PROMPT_START_TAG, OUTPUT_PROMPT_END_TAG)], max_blocks=1
+        )
+
+    def filter_prompt_text(self, text: str, metadata: Optional[Dict] = None) -> str:
+        """非流式版本的 filter_prompt_generator, 作用于完整的上游响应文本"""
+        if metadata is None:
+            metadata = {}
+        extractor = self._new_prompt_extractor()
+        segments = extractor.feed(text)
+        if extractor.finished:
+            metadata["upstream_stop_reason"] = "end_tag"
+        else:
+            metadata["upstream_stop_reason"] = "upstream_finished"
+            segments += extractor.flush()
+        return "".join(segment.text for segment in segments)
 
     async def filter_prompt_generator(
-        self, raw_llm_stream: AsyncGenerator
+        self,
+        raw_llm_stream: AsyncGenerator,
+        metadata: Optional[Dict] = None,
     ) -> AsyncGenerator:
-        # TODO: still has bug, I need to check and fix this yet.
-        accumulated_text = ""
-        hit_start_tag = False
-        hit_end_tag = False
-        yielded_length = 0
-        potential_end_tag_buffer = ""  # 缓存可能的结束标签部分
-
+        # 只输出第一对 <prompt></prompt> 之间的内容, 命中结束标签后立即返回
+        if metadata is None:
+            metadata = {}
+        metadata["upstream_chunks"] = 0
+        extractor = self._new_prompt_extractor()
         async for chunk in raw_llm_stream:
-            text = chunk.choices[0].delta.content
-            text = text or ""
-
-            if not hit_start_tag:
-                # 还未找到开始标签，继续累积
-                accumulated_text += text
-                if OUTPUT_PROMPT_START_TAG in accumulated_text:
-                    # 首次命中开始标签
-                    start_pos = accumulated_text.find(OUTPUT_PROMPT_START_TAG)
-                    content_start = start_pos + len(OUTPUT_PROMPT_START_TAG)
-                    remaining = accumulated_text[content_start:]
-                    if remaining:
-                        yield remaining
-                    yielded_length = len(accumulated_text)
-                    hit_start_tag = True
-
-            elif hit_start_tag and not hit_end_tag:
-                # 已找到开始标签，正在查找结束标签
-                # 将新文本添加到缓冲区
-                potential_end_tag_buffer += text
-
-                # 检查缓冲区中是否包含完整的结束标签
-                if OUTPUT_PROMPT_END_TAG in potential_end_tag_buffer:
-                    # 找到完整的结束标签
-                    end_pos = potential_end_tag_buffer.find(OUTPUT_PROMPT_END_TAG)
-                    # 输出结束标签之前的内容
-                    content_before_end = potential_end_tag_buffer[:end_pos]
-                    if content_before_end:
-                        yield content_before_end
-                    hit_end_tag = True
-                    return
-                # 检查缓冲区是否可能包含结束标签的前缀
-                # 找出最长的可能前缀
-                max_prefix_len = 0
-                for i in range(
-                    1,
-                    min(len(potential_end_tag_buffer) + 1, len(OUTPUT_PROMPT_END_TAG)),
-                ):
-                    if potential_end_tag_buffer.endswith(OUTPUT_PROMPT_END_TAG[:i]):
-                        max_prefix_len = i
-
-                if max_prefix_len > 0:
-                    # 缓冲区末尾可能是结束标签的开始
-                    # 保留可能的前缀，输出其他内容
-                    safe_to_yield = potential_end_tag_buffer[:-max_prefix_len]
-                    if safe_to_yield:
-                        yield safe_to_yield
-                        accumulated_text += safe_to_yield
-                        yielded_length = len(accumulated_text)
-                    # 保留可能的前缀在缓冲区中
-                    potential_end_tag_buffer = potential_end_tag_buffer[
-                        -max_prefix_len:
-                    ]
-                else:
-                    # 缓冲区中没有结束标签的前缀，可以安全输出所有内容
-                    if potential_end_tag_buffer:
-                        yield potential_end_tag_buffer
-                        accumulated_text += potential_end_tag_buffer
-                        yielded_length = len(accumulated_text)
-                    potential_end_tag_buffer = ""
-
-    async def optimize_prompt(
+            metadata["upstream_chunks"] += 1
+            if not chunk.choices:
+                continue
+            if chunk.choices[0].finish_reason:
+                metadata["upstream_finish_reason"] = chunk.choices[0].finish_reason
+            text = chunk.choices[0].delta.content or ""
+            for segment in extractor.feed(text):
+                yield segment.text
+            if extractor.finished:
+                metadata["upstream_stop_reason"] = "end_tag"
+                return
+
+        metadata["upstream_stop_reason"] = "upstream_finished"
+
+        # 上游在结束标签之前断开, 输出被暂存的结尾
+        for segment in extractor.flush():
+            yield segment.text
+
+    async def _build_messages(
         self,
-        original_prompt: str | None = None,
-        messages: List[Dict[str, str]] | None = None,
-        stream: bool = True,
-        enable_vector_db_retrival: bool = False,
-        collection_name: str = "",
-    ) -> AsyncGenerator | str:
+        original_prompt: str | None,
+        messages: List[Dict[str, str]] | None,
+        enable_vector_db_retrival: bool,
+        collection_name: str,
+    ) -> List[Dict[str, str]]:
+        """流式与非流式共用: 检索模板、套用优化提示词并裁剪超长对话"""
         if messages:
             # Use the provided messages directly
             _messages = [
@@ -140,6 +120,11 @@ class PromptAgent(object):
                 "role": _messages[-1]["role"],
                 "content": last_content,
             }
+            if USE_TOKEN_SHORTEN:
+                # 超长的多轮对话在发往上游前裁剪掉最早的消息
+                _messages = await async_shorten_message_given_prompt_length(
+                    _messages, MAX_PROMPT_TOKENS
+                )
         else:
             raise NotImplementedError
             # # Fallback to original_prompt if no messages provided
@@ -152,24 +137,77 @@ class PromptAgent(object):
             #     }
             # ]
 
-        # Ensure DEFAULT_MODEL is not None
-        model = DEFAULT_MODEL
+        return _messages
 
-        _stream = await self.client.chat.completions.create(
-            model=model, messages=_messages, stream=stream
+    async def optimize_prompt(
+        self,
+        original_prompt: str | None = None,
+        messages: List[Dict[str, str]] | None = None,
+        stream: bool = True,
+        enable_vector_db_retrival: bool = False,
+        collection_name: str = "",
+        metadata: Optional[Dict] = None,
+        priority: int = 0,
+    ) -> AsyncGenerator | str:
+        """
+        stream=False 时只产出一次完整结果, 与流式共用消息构建与标签提取。
+
+        metadata: 可选, 记录上游流的停止原因 (end_tag / upstream_finished /
+        client_disconnect / error)、上游返回的 finish_reason 与已接收的 chunk 数,
+        非流式时还记录上游返回的 usage, 以及排队与对冲请求的结果
+        (见 UpstreamPool.open_hedged); 通常传入 UsageTracker.metadata
+
+        priority: 上游并发已满时的排队优先级, 越小越先; 队列已满时抛出 QueueFullError
+        """
+        if metadata is None:
+            metadata = {}
+        _messages = await self._build_messages(
+            original_prompt, messages, enable_vector_db_retrival, collection_name
+        )
+
+        # 按路由策略选择上游 (上游可以覆盖模型); 首 token 超过截止时间时发出对冲请求
+        attempt = await self.pool.open_hedged(
+            _messages, stream, DEFAULT_MODEL, metadata, priority=priority
         )
 
         if stream:
-            response_text = ""
-            async for chunk in self.filter_prompt_generator(_stream):
-                yield chunk
-                response_text += chunk
+            response_parts = []
+            error = None
+            try:
+                async with aclosing(
+                    self.filter_prompt_generator(attempt.chunks(), metadata)
+                ) as filtered:
+                    async for chunk in filtered:
+                        yield chunk
+                        response_parts.append(chunk)
+            except (GeneratorExit, asyncio.CancelledError) as e:
+                metadata["upstream_stop_reason"] = "client_disconnect"
+                error = e
+                raise
+            except Exception as e:
+                metadata["upstream_stop_reason"] = "error"
+                error = e
+                raise
+            finally:
+                # 命中结束标签或下游断开后立即关闭上游 HTTP 流, 不再为后续 token 付费,
+                # 连接也能尽早归还
+                metadata["upstream_closed_early"] = (
+                    metadata.get("upstream_stop_reason") != "upstream_finished"
+                )
+                await attempt.close(error)
 
-            logger.debug(f"response_text:\n{response_text}")
+            logger.debug(f"response_text:\n{''.join(response_parts)}")
         else:
-            raise NotImplementedError
-            # Handle non-streaming response
-            # return _stream.choices[0].message.content or ""
+            # 非流式: 对单次完整的上游响应做同样的标签提取
+            response = attempt.response
+            await attempt.close()
+            choice = response.choices[0] if response.choices else None
+            if choice is not None:
+                metadata["upstream_finish_reason"] = choice.finish_reason
+            if response.usage is not None:
+                metadata["upstream_usage"] = response.usage.model_dump()
+            content = (choice.message.content if choice is not None else None) or ""
+            yield self.filter_prompt_text(content, metadata)
 
 
 @lru_cache
@@ -1,13 +1,16 @@
-import asyncio
 from functools import lru_cache
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-# from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from loguru import logger
 from pydantic import BaseModel, Field
 
-from prompt_agent.redis_manager.api_key_manager import APIKeyManager
+from prompt_agent.redis_manager.api_key_manager import (APIKeyManager,
+                                                       APIKeyStatus,
+                                                       QuotaUnit,
+                                                       RateLimitStrategy)
+from prompt_agent.schemas import APIKeyType
 
 router = APIRouter()
 
@@ -18,13 +21,40 @@ class CreateAPIKeyRequest(BaseModel):
     hours: Optional[int] = Field(default=0, description="过期小时数")
     minutes: Optional[int] = Field(default=0, description="过期分钟数")
     seconds: Optional[int] = Field(default=0, description="过期秒数")
-    usage_limit: Optional[int] = Field(default=100, description="使用次数限制")
-    numbers: int = Field(default=1, description="要创建的API key数量")
+    usage_limit: Optional[int] = Field(
+        default=100, description="每个周期的额度 (次数或 token 数, 取决于 quota_unit)"
+    )
+    rate_limit_strategy: Optional[RateLimitStrategy] = Field(
+        default=None, description="限流策略: fixed_window/sliding_window/token_bucket"
+    )
+    burst_limit: Optional[int] = Field(
+        default=None, ge=0, description="每秒最多请求次数, 0 表示不限制"
+    )
+    quota_unit: Optional[QuotaUnit] = Field(
+        default=None, description="额度计量单位: requests/tokens"
+    )
+    key_type: Optional[APIKeyType] = Field(
+        default=None, description="key 类型: plus/basic, plus 在上游排队时优先"
+    )
+    numbers: int = Field(default=1, ge=1, description="要创建的API key数量")
+    stream: bool = Field(default=False, description="是否逐行流式返回生成的API key")
 
 
 class UpdateAPIKeyRequest(BaseModel):
     expiration_seconds: Optional[int] = Field(default=None, description="过期秒数")
     usage_limit: Optional[int] = Field(default=None, description="使用次数限制")
+    rate_limit_strategy: Optional[RateLimitStrategy] = Field(
+        default=None, description="限流策略: fixed_window/sliding_window/token_bucket"
+    )
+    burst_limit: Optional[int] = Field(
+        default=None, ge=0, description="每秒最多请求次数, 0 表示不限制"
+    )
+    quota_unit: Optional[QuotaUnit] = Field(
+        default=None, description="额度计量单位: requests/tokens"
+    )
+    key_type: Optional[APIKeyType] = Field(
+        default=None, description="key 类型: plus/basic, plus 在上游排队时优先"
+    )
 
 
 class BatchAPIKeysDeleteRequest(BaseModel):
@@ -59,20 +89,40 @@ async def create_key(
             seconds=create_request.seconds or 0,
         )
         api_key_number = create_request.numbers
-        tasks = []
-        for _ in range(api_key_number):
-            task = asyncio.create_task(
-                manager.create_api_key(
-                    expiration_seconds=expiration_seconds,
-                    usage_limit=create_request.usage_limit,
-                )
+
+        if create_request.stream:
+            # 每批写入 Redis 后立即返回, 一行一个 key
+            async def api_key_lines():
+                try:
+                    async for batch in manager.iter_create_api_keys(
+                        count=api_key_number,
+                        expiration_seconds=expiration_seconds,
+                        usage_limit=create_request.usage_limit,
+                        rate_limit_strategy=create_request.rate_limit_strategy,
+                        burst_limit=create_request.burst_limit,
+                        quota_unit=create_request.quota_unit,
+                        key_type=create_request.key_type,
+                    ):
+                        yield "".join(f"{api_key}\n" for api_key in batch)
+                except Exception as e:
+                    logger.error(f"流式创建API key失败: {str(e)}")
+                    raise
+
+            return StreamingResponse(
+                api_key_lines(),
+                media_type="text/plain",
+                headers={"X-Expiration-Seconds": str(expiration_seconds)},
             )
-            tasks.append(task)
-        api_keys = await asyncio.gather(*tasks)
-        # api_key = await manager.create_api_key(
-        #     expiration_seconds=expiration_seconds,
-        #     usage_limit=create_request.usage_limit,
-        # )
+
+        api_keys = await manager.create_api_keys(
+            count=api_key_number,
+            expiration_seconds=expiration_seconds,
+            usage_limit=create_request.usage_limit,
+            rate_limit_strategy=create_request.rate_limit_strategy,
+            burst_limit=create_request.burst_limit,
+            quota_unit=create_request.quota_unit,
+            key_type=create_request.key_type,
+        )
 
         return {
             "success": True,
@@ -176,6 +226,14 @@ async def update_key(
             update_data["expiration_seconds"] = update_request.expiration_seconds
         if update_request.usage_limit is not None:
             update_data["usage_limit"] = update_request.usage_limit
+        if update_request.rate_limit_strategy is not None:
+            update_data["rate_limit_strategy"] = update_request.rate_limit_strategy
+        if update_request.burst_limit is not None:
+            update_data["burst_limit"] = update_request.burst_limit
+        if update_request.quota_unit is not None:
+            update_data["quota_unit"] = update_request.quota_unit
+        if update_request.key_type is not None:
+            update_data["key_type"] = update_request.key_type
 
         if not update_data:
             raise HTTPException(status_code=400, detail="没有提供要更新的字段")
@@ -217,10 +275,7 @@ async def delete_batch_keys(
 ):
     """批量删除API keys"""
     try:
-        results = []
-        for api_key in batch_request.api_keys:
-            result = await manager.delete_api_key(api_key)
-            results.append({"api_key": api_key, "result": result})
+        results = await manager.delete_api_keys(batch_request.api_keys)
 
         return {"batch_delete_results": results}
     except Exception as e:
@@ -230,12 +285,25 @@ async def delete_batch_keys(
 
 @router.get("/list_keys")
 async def list_keys(
-    include_deleted: bool = False, manager: APIKeyManager = Depends(get_api_key_manager)
+    include_deleted: bool = False,
+    status: Optional[APIKeyStatus] = Query(default=None, description="按状态过滤"),
+    cursor: int = Query(default=0, ge=0, description="上一页返回的 next_cursor"),
+    page_size: int = Query(default=100, ge=1, le=1000, description="每页数量(近似)"),
+    manager: APIKeyManager = Depends(get_api_key_manager),
 ):
-    """列出所有API keys"""
+    """分页列出API keys, next_cursor 为 0 表示没有更多数据"""
     try:
-        api_keys = await manager.list_api_keys(include_deleted=include_deleted)
-        return {"api_keys": api_keys, "count": len(api_keys)}
+        page = await manager.scan_api_keys(
+            cursor=cursor,
+            page_size=page_size,
+            status=status,
+            include_deleted=include_deleted,
+        )
+        return {
+            "api_keys": page["api_keys"],
+            "count": len(page["api_keys"]),
+            "next_cursor": page["next_cursor"],
+        }
     except Exception as e:
         logger.error(f"列出API keys失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"列出API keys失败: {str(e)}")
@@ -1,12 +1,100 @@
+import copy
+import itertools
+import re
+from typing import Any, Dict, List, Optional
+
 from loguru import logger
 from tortoise import Tortoise
+from tortoise.backends.base.config_generator import expand_db_url
 
-from prompt_agent.configs import DB_URL
+from prompt_agent.configs import (DB_POOL_MAX_SIZE, DB_POOL_MIN_SIZE, DB_URL,
+                                  SQLITE_PRAGMAS, SQLITE_READ_CONNECTIONS)
 
 # lifespan.py
 
+SQLITE_ENGINE = "tortoise.backends.sqlite"
+POSTGRES_ENGINES = ("tortoise.backends.asyncpg", "tortoise.backends.psycopg")
+READ_CONNECTIONS = [f"reader_{i}" for i in range(SQLITE_READ_CONNECTIONS)]
+
+
+class ReadWriteRouter:
+    """
+    写请求统一走 default (唯一的写连接), 读请求轮流分配到只读连接.
+    注意 Model.filter() 创建查询集时就绑定了读连接, 查询集上的 update()/delete()
+    需要 using_db 指定写连接 (如 in_transaction("default") 返回的连接)
+    """
+
+    def __init__(self):
+        self._readers = itertools.cycle(READ_CONNECTIONS)
+
+    def db_for_read(self, model) -> Optional[str]:
+        return next(self._readers, None)
+
+    def db_for_write(self, model) -> Optional[str]:
+        return "default"
+
+
+def build_tortoise_config(db_url: str = DB_URL) -> Dict[str, Any]:
+    default = expand_db_url(db_url)
+    connections = {"default": default}
+    routers: List[str] = []
+
+    file_path = default["credentials"].get("file_path")
+    if default["engine"] == SQLITE_ENGINE and file_path != ":memory:":
+        default["credentials"].update(SQLITE_PRAGMAS)
+        # 每个 aiosqlite 连接只有一个线程, 多个只读连接才能并发读;
+        # query_only 防止误把写请求路由到只读连接
+        for name in READ_CONNECTIONS:
+            reader = copy.deepcopy(default)
+            reader["credentials"]["query_only"] = "ON"
+            connections[name] = reader
+        if READ_CONNECTIONS:
+            routers.append(f"{__name__}.ReadWriteRouter")
+    elif default["engine"] in POSTGRES_ENGINES:
+        # Postgres 自带并发读写, 每个 worker 一个连接池即可
+        default["credentials"].setdefault("minsize", DB_POOL_MIN_SIZE)
+        default["credentials"].setdefault("maxsize", DB_POOL_MAX_SIZE)
+
+    return {
+        "connections": connections,
+        "apps": {
+            "models": {
+                "models": ["prompt_agent.models"],
+                "default_connection": "default",
+            }
+        },
+        "routers": routers,
+    }
+
+
+def is_postgres(connection) -> bool:
+    return connection.capabilities.dialect == "postgres"
+
+
+def format_placeholders(connection, sql: str) -> str:
+    """原生 SQL 统一用 ? 占位, 在 Postgres (asyncpg) 上换成 $1, $2 ..."""
+    if not is_postgres(connection):
+        return sql
+    counter = itertools.count(1)
+    return re.sub(r"\?", lambda _: f"${next(counter)}", sql)
+
+
+async def init_db(db_url: str = DB_URL):
+    await Tortoise.init(config=build_tortoise_config(db_url))
+    # 建表使用 IF NOT EXISTS, 新的 Postgres 库在首次启动时即完成建表
+    await Tortoise.generate_schemas(safe=True)
+    # 全文搜索索引不在模型里, 单独建 (依赖模型, 在此处导入避免循环引用)
+    from prompt_agent.models.chat_search import ensure_search_index
+
+    await ensure_search_index()
+    logger.info(f"Tortoise-ORM started, database connected: {_redact(db_url)}")
+
+
+def _redact(db_url: str) -> str:
+    """日志中隐藏连接串里的密码"""
+    scheme, sep, rest = db_url.partition("://")
+    userinfo, at, host = rest.rpartition("@")
+    if not at or ":" not in userinfo:
+        return db_url
+    return f"{scheme}{sep}{userinfo.split(':', 1)[0]}:***@{host}"
 
-async def init_db():
-    await Tortoise.init(db_url=DB_URL, modules={"models": ["prompt_agent.models"]})
-    await Tortoise.generate_schemas()
-    logger.info(f"Tortoise-ORM started, database connected: {DB_URL}")
@@ -5,7 +5,11 @@ from loguru import logger
 
 from prompt_agent.db import init_db
 from prompt_agent.periodic_checks.limit_sheduler import LimitScheduler
+from prompt_agent.provider import get_upstream_pool
+from prompt_agent.redis_manager.api_key_manager import get_api_key_manager
+from prompt_agent.utils.record_writer import get_record_writer
 from prompt_agent.utils.time_zone_utils import set_cn_time_zone
+from prompt_agent.utils.usage_tracking import get_usage_accounting
 
 # from rev_claude.client.client_manager import ClientManager
 
@@ -14,12 +18,21 @@ async def on_startup():
     logger.info("Lifespan Starting up")
     set_cn_time_zone()
     await init_db()  # Enable database initialization for our new models
+    await get_record_writer().start()
+    await get_usage_accounting().start()
     await LimitScheduler.start()
+    await get_api_key_manager().start_invalidation_listener()
 
 
 async def on_shutdown():
     logger.info("Lifespan Shutting down")
     await LimitScheduler.shutdown()
+    await get_api_key_manager().stop_invalidation_listener()
+    await get_upstream_pool().aclose()
+    # 先处理完待计费的请求, 它们的用量记录再由写入器落库
+    await get_usage_accounting().stop()
+    # 写入队列中剩余的用量/对话记录
+    await get_record_writer().stop()
 
 
 @asynccontextmanager
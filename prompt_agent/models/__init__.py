@@ -2,3 +2,4 @@ from prompt_agent.models.base import CRUDBase
 from prompt_agent.models.chat_message import (ChatMessage, RequestStatus,
                                               RequestType, UsageRecord)
 from prompt_agent.models.cookie_models import Cookie, CookieQueries, CookieType
+from prompt_agent.models.usage_rollup import UsageHourlyRollup
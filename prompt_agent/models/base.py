@@ -1,12 +1,53 @@
 # base.py
-from typing import Any, Dict, List, Optional, TypeVar
+import base64
+import binascii
+import json
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple, TypeVar
 
 from pydantic import BaseModel
 from tortoise import Model, fields
 from tortoise.expressions import Q
 
+from prompt_agent.configs import (PAGINATION_COUNT_CACHE_MAX_SIZE,
+                                  PAGINATION_COUNT_CACHE_TTL_SECONDS)
+from prompt_agent.utils.ttl_cache import TTLCache
+
 ModelType = TypeVar("ModelType", bound=Model)
 
+# 按 (模型, 过滤条件) 缓存的记录总数, 过期前的总数是近似值
+_count_cache = TTLCache(
+    maxsize=PAGINATION_COUNT_CACHE_MAX_SIZE, ttl=PAGINATION_COUNT_CACHE_TTL_SECONDS
+)
+
+
+class PaginationError(ValueError):
+    """分页参数无效: 游标无法解析、与排序字段不匹配, 或排序字段不存在"""
+
+
+def _encode_cursor(order_by: str, value: Any, id: int) -> str:
+    if isinstance(value, datetime):
+        value = {"$datetime": value.isoformat()}
+    elif isinstance(value, Enum):
+        value = value.value
+    payload = json.dumps({"o": order_by, "v": value, "id": id}, default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, order_by: str) -> Tuple[Any, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        value, id = payload["v"], int(payload["id"])
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["$datetime"])
+    except (binascii.Error, ValueError, KeyError, TypeError) as e:
+        raise PaginationError("Invalid cursor") from e
+    if payload.get("o") != order_by:
+        raise PaginationError("Cursor was created with a different order_by")
+    return value, id
+
 
 class CRUDBase(Model):
     id = fields.IntField(pk=True)
@@ -41,6 +82,67 @@ class CRUDBase(Model):
         """获取记录总数"""
         return await cls.filter(**filters).count()
 
+    @classmethod
+    async def get_count_cached(cls, **filters) -> int:
+        """获取记录总数, 相同过滤条件的结果缓存一段时间 (近似值)"""
+        key = (cls.__name__, frozenset(filters.items()))
+        total = _count_cache.get(key)
+        if total is None:
+            total = await cls.get_count(**filters)
+            _count_cache.set(key, total)
+        return total
+
+    @classmethod
+    async def get_page(
+        cls,
+        *,
+        cursor: Optional[str] = None,
+        skip: int = 0,
+        limit: int = 100,
+        order_by: str = "-id",
+        **filters,
+    ) -> Tuple[List[ModelType], Optional[str]]:
+        """
+        游标 (keyset) 分页: 按 (order_by 字段, id) 排序, 从游标所指记录之后开始取,
+        不论翻到第几页都只读取 limit 条记录. 没有游标时从 skip 处开始 (兼容页码).
+        返回 (记录列表, 下一页游标), 没有下一页时游标为 None
+        """
+        field = order_by.lstrip("-")
+        descending = order_by.startswith("-")
+        if field not in cls._meta.fields_map:
+            raise PaginationError(f"Unknown order_by field: {field}")
+        # 可为空的字段无法比较大小, 只能按页码翻页
+        keyset = not cls._meta.fields_map[field].null
+        op = "lt" if descending else "gt"
+        id_order = "-id" if descending else "id"
+
+        query = cls.filter(**filters)
+        if cursor:
+            if not keyset:
+                raise PaginationError(f"Can't use a cursor with order_by {field}")
+            value, last_id = _decode_cursor(cursor, order_by)
+            if field == "id":
+                query = query.filter(**{f"id__{op}": last_id})
+            else:
+                # (field, id) 在游标之后; 拆成 field <= v 的范围条件, 才能走索引
+                query = query.filter(
+                    Q(**{f"{field}__{op}e": value})
+                    & (Q(**{f"{field}__{op}": value}) | Q(**{f"id__{op}": last_id}))
+                )
+        else:
+            query = query.offset(skip)
+        orderings = [order_by] if field == "id" else [order_by, id_order]
+        # 多取一条用于判断是否还有下一页
+        items = await query.order_by(*orderings).limit(limit + 1)
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            last = items[-1]
+            if keyset:
+                next_cursor = _encode_cursor(order_by, getattr(last, field), last.id)
+        return items, next_cursor
+
     async def update_item(self, **kwargs) -> ModelType:
         """更新记录"""
         for key, value in kwargs.items():
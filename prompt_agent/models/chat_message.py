@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 import numpy as np
 from loguru import logger
@@ -98,6 +98,8 @@ class UsageRecord(CRUDBase):
     class Meta:
         table = "usage_records"
         ordering = ["-timestamp"]
+        # recent records of a key
+        indexes = (("api_key", "timestamp"),)
 
     @classmethod
     async def get_usage_stats(
@@ -106,7 +108,8 @@ class UsageRecord(CRUDBase):
         """Get usage statistics for a specific API key or overall"""
         from datetime import datetime, timedelta
 
-        from tortoise.functions import Avg, Sum
+        from tortoise.expressions import Q
+        from tortoise.functions import Avg, Coalesce, Count, Sum
 
         start_date = datetime.now() - timedelta(days=days)
         query = cls.filter(timestamp__gte=start_date)
@@ -114,24 +117,37 @@ class UsageRecord(CRUDBase):
         if api_key:
             query = query.filter(api_key=api_key)
 
-        # Basic counts
-        total_requests = await query.count()
-        successful_requests = await query.filter(status=RequestStatus.SUCCESS).count()
-        failed_requests = await query.filter(status=RequestStatus.ERROR).count()
-
-        # Token usage - calculate manually since Tortoise ORM aggregate behavior varies
-        records = await query.all()
-        total_input_tokens = sum(r.input_tokens or 0 for r in records)
-        total_output_tokens = sum(r.output_tokens or 0 for r in records)
-        total_tokens_sum = sum(r.total_tokens or 0 for r in records)
-
-        # Average response time
-        response_times = [
-            r.response_time_ms for r in records if r.response_time_ms is not None
-        ]
-        avg_response_time = (
-            sum(response_times) / len(response_times) if response_times else 0
+        # One aggregate query over the window; only the scalars come back
+        stats = await (
+            query.annotate(
+                total_requests=Count("id"),
+                successful_requests=Count(
+                    "id", _filter=Q(status=RequestStatus.SUCCESS)
+                ),
+                failed_requests=Count("id", _filter=Q(status=RequestStatus.ERROR)),
+                total_input_tokens=Coalesce(Sum("input_tokens"), 0),
+                total_output_tokens=Coalesce(Sum("output_tokens"), 0),
+                total_tokens_sum=Coalesce(Sum("total_tokens"), 0),
+                avg_response_time=Avg("response_time_ms"),
+            )
+            .first()
+            .values(
+                "total_requests",
+                "successful_requests",
+                "failed_requests",
+                "total_input_tokens",
+                "total_output_tokens",
+                "total_tokens_sum",
+                "avg_response_time",
+            )
         )
+        total_requests = stats["total_requests"]
+        successful_requests = stats["successful_requests"]
+        failed_requests = stats["failed_requests"]
+        total_input_tokens = int(stats["total_input_tokens"])
+        total_output_tokens = int(stats["total_output_tokens"])
+        total_tokens_sum = int(stats["total_tokens_sum"])
+        avg_response_time = float(stats["avg_response_time"] or 0)
 
         return {
             "period_days": days,
@@ -146,3 +162,34 @@ class UsageRecord(CRUDBase):
             "total_tokens": total_tokens_sum,
             "avg_response_time_ms": avg_response_time,
         }
+
+    @classmethod
+    async def get_recent_by_api_keys(
+        cls, api_keys: List[str], limit: int = 5
+    ) -> Dict[str, List["UsageRecord"]]:
+        """Latest ``limit`` records of each API key, newest first"""
+        from prompt_agent.db import format_placeholders
+
+        if not api_keys:
+            return {}
+        # One statement with a LIMIT subquery per key; each one reads only its
+        # newest rows off the (api_key, timestamp) index. ROW_NUMBER() OVER
+        # (PARTITION BY api_key) would have to number every row of those keys
+        db = cls._choose_db()
+        sql = " UNION ALL ".join(
+            f"SELECT id FROM (SELECT id FROM {cls._meta.db_table} WHERE api_key = ? "
+            f"ORDER BY timestamp DESC, id DESC LIMIT ?) AS recent_{i}"
+            for i in range(len(api_keys))
+        )
+        rows = await db.execute_query_dict(
+            format_placeholders(db, sql),
+            [value for api_key in api_keys for value in (api_key, limit)],
+        )
+        records = await cls.filter(id__in=[row["id"] for row in rows]).order_by(
+            "-timestamp", "-id"
+        )
+        recent: Dict[str, List[UsageRecord]] = {api_key: [] for api_key in api_keys}
+        for record in records:
+            recent[record.api_key].append(record)
+        return recent
+
@@ -0,0 +1,295 @@
+"""
+Full-text search over chat messages.
+
+SQLite: an FTS5 table with the trigram tokenizer over user_prompt and
+assistant_response. It uses the messages table as external content, so the
+text is not stored twice, and triggers keep it in sync on insert, update and
+delete. Trigrams index substrings, so a search matches the same messages as
+``LIKE '%term%'`` did (case-insensitive, and Chinese text needs no word
+segmentation). Terms shorter than three characters can't use the index and
+fall back to LIKE.
+
+Postgres: a generated tsvector column with a GIN index, matched with
+websearch_to_tsquery and ranked with ts_rank.
+"""
+from typing import Any, Dict, List, Tuple
+
+from loguru import logger
+from tortoise.expressions import Q
+
+from prompt_agent.db import format_placeholders, is_postgres
+from prompt_agent.models.chat_message import ChatMessage
+
+TABLE = ChatMessage._meta.db_table
+FTS_TABLE = f"{TABLE}_fts"
+SEARCH_FIELDS = ("user_prompt", "assistant_response")
+MIN_TRIGRAM_LENGTH = 3
+HIGHLIGHT_START, HIGHLIGHT_END = "<mark>", "</mark>"
+# trigram 分词下 snippet() 的每个 token 对应一个字符, 64 是 snippet() 允许的最大值
+SNIPPET_CHARS = 64
+# Postgres ts_headline 按词计数
+HEADLINE_WORDS = 16
+# 只对最新的这么多条匹配计算相关度排序, 更早的匹配按时间倒序排在其后
+RANK_WINDOW = 5000
+# 过滤条件 (如单个 API key) 只剩这么多条消息时直接 LIKE 扫描, 比遍历索引中的全部匹配快
+LIKE_SCAN_MAX_ROWS = 20000
+
+SQLITE_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    user_prompt, assistant_response,
+    content='{TABLE}', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {TABLE} BEGIN
+    INSERT INTO {FTS_TABLE}(rowid, user_prompt, assistant_response)
+    VALUES (new.id, new.user_prompt, new.assistant_response);
+END;
+CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {TABLE} BEGIN
+    INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, user_prompt, assistant_response)
+    VALUES ('delete', old.id, old.user_prompt, old.assistant_response);
+END;
+CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+AFTER UPDATE OF user_prompt, assistant_response ON {TABLE} BEGIN
+    INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, user_prompt, assistant_response)
+    VALUES ('delete', old.id, old.user_prompt, old.assistant_response);
+    INSERT INTO {FTS_TABLE}(rowid, user_prompt, assistant_response)
+    VALUES (new.id, new.user_prompt, new.assistant_response);
+END;
+"""
+
+POSTGRES_SCHEMA = f"""
+ALTER TABLE "{TABLE}" ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple',
+        coalesce(user_prompt, '') || ' ' || coalesce(assistant_response, ''))) STORED;
+CREATE INDEX IF NOT EXISTS idx_{TABLE}_search_vector
+    ON "{TABLE}" USING GIN (search_vector);
+"""
+
+_OPERATORS = {"": "=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+# 建索引失败 (如 SQLite 版本过低不支持 trigram) 时退回 LIKE 搜索
+_index_ready = False
+
+
+async def ensure_search_index() -> bool:
+    """Create the search index if missing; index existing rows on first creation"""
+    global _index_ready
+    connection = ChatMessage._choose_db(for_write=True)
+    try:
+        if is_postgres(connection):
+            await connection.execute_script(POSTGRES_SCHEMA)
+        else:
+            _, rows = await connection.execute_query(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                [FTS_TABLE],
+            )
+            await connection.execute_script(SQLITE_SCHEMA)
+            if not rows:
+                logger.info(f"Indexing existing chat messages into {FTS_TABLE}")
+                await connection.execute_script(
+                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild');"
+                )
+        _index_ready = True
+    except Exception as e:
+        _index_ready = False
+        logger.warning(f"Chat message search index unavailable, using LIKE: {str(e)}")
+    return _index_ready
+
+
+def _filter_sql(filters: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """Translate ORM-style filters (field, field__gte, ...) to SQL on alias m"""
+    clauses, values = [], []
+    for key, value in filters.items():
+        name, _, lookup = key.partition("__")
+        field = ChatMessage._meta.fields_map.get(name)
+        if field is None or lookup not in _OPERATORS:
+            raise ValueError(f"Unsupported search filter: {key}")
+        clauses.append(f"m.{field.source_field or name} {_OPERATORS[lookup]} ?")
+        values.append(field.to_db_value(value, ChatMessage))
+    return "".join(f" AND {clause}" for clause in clauses), values
+
+
+def _highlight(text: str, term: str) -> str:
+    """Snippet around the first case-insensitive occurrence of term, for LIKE results"""
+    position = text.lower().find(term.lower())
+    if position < 0:
+        return ""
+    context = max(0, SNIPPET_CHARS - len(term)) // 2
+    start = max(0, position - context)
+    end = min(len(text), position + len(term) + context)
+    return (
+        ("..." if start > 0 else "")
+        + text[start:position]
+        + HIGHLIGHT_START
+        + text[position : position + len(term)]
+        + HIGHLIGHT_END
+        + text[position + len(term) : end]
+        + ("..." if end < len(text) else "")
+    )
+
+
+def _search_sql(connection) -> Tuple[str, str, str]:
+    """(FROM ... WHERE clause taking the match value, score, row key) for the backend"""
+    if is_postgres(connection):
+        source = (
+            f'FROM "{TABLE}" m, websearch_to_tsquery(\'simple\', ?) q '
+            f"WHERE m.search_vector @@ q"
+        )
+        return source, "ts_rank(m.search_vector, q)", "m.id"
+    # CROSS JOIN keeps the FTS table as the outer loop; otherwise SQLite may
+    # walk a filter's index and run the MATCH once per row.
+    source = (
+        f"FROM {FTS_TABLE} CROSS JOIN {TABLE} m ON m.id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH ?"
+    )
+    # bm25 is lower for better matches; negated so that higher is better.
+    # Ordering by the FTS rowid (= message id) is served by the index itself.
+    return source, f"-bm25({FTS_TABLE})", f"{FTS_TABLE}.rowid"
+
+
+async def _snippets(connection, match_value: str, ids: List[int]) -> Dict[int, Dict]:
+    """Highlighted snippets of the given matches, computed for one page only"""
+    if not ids:
+        return {}
+    id_params = ", ".join("?" * len(ids))
+    if is_postgres(connection):
+        options = (
+            f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, "
+            f"MaxWords={HEADLINE_WORDS}, MinWords=5, MaxFragments=1"
+        )
+        columns = ", ".join(
+            f"ts_headline('simple', m.{name}, q, ?) AS {name}" for name in SEARCH_FIELDS
+        )
+        sql = (
+            f'SELECT m.id, {columns} FROM "{TABLE}" m, '
+            f"websearch_to_tsquery('simple', ?) q WHERE m.id IN ({id_params})"
+        )
+        values = [*[options] * len(SEARCH_FIELDS), match_value, *ids]
+    else:
+        columns = ", ".join(
+            f"snippet({FTS_TABLE}, {column}, ?, ?, '...', {SNIPPET_CHARS}) AS {name}"
+            for column, name in enumerate(SEARCH_FIELDS)
+        )
+        sql = (
+            f"SELECT rowid AS id, {columns} FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH ? AND rowid IN ({id_params})"
+        )
+        values = [
+            *[HIGHLIGHT_START, HIGHLIGHT_END] * len(SEARCH_FIELDS),
+            match_value,
+            *ids,
+        ]
+    rows = await connection.execute_query_dict(
+        format_placeholders(connection, sql), values
+    )
+    return {row["id"]: {name: row[name] for name in SEARCH_FIELDS} for row in rows}
+
+
+async def search_chat_messages(
+    term: str, skip: int = 0, limit: int = 20, **filters
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Search messages whose prompt or response contains ``term``, best match
+    first. Returns ([{"message", "rank", "snippets"}], total), where total
+    counts every match under the same filters.
+
+    Scoring every match of a very common term costs as much as the old table
+    scan, so only the newest RANK_WINDOW matches are ranked; older matches
+    follow them, newest first. Filters that leave at most LIKE_SCAN_MAX_ROWS
+    messages are searched by scanning those messages instead (unranked).
+    """
+    connection = ChatMessage._choose_db()
+    use_index = _index_ready and (
+        is_postgres(connection) or len(term) >= MIN_TRIGRAM_LENGTH
+    )
+    if use_index and filters:
+        candidates = await ChatMessage.filter(**filters).count()
+        use_index = candidates > LIKE_SCAN_MAX_ROWS
+    if not use_index:
+        return await _search_like(term, skip, limit, **filters)
+
+    where, filter_values = _filter_sql(filters)
+    source, score, key = _search_sql(connection)
+    source += where
+    if is_postgres(connection):
+        match_value = term
+    else:
+        # One quoted phrase: its trigrams must be consecutive, i.e. a substring
+        match_value = '"' + term.replace('"', '""') + '"'
+    params = [match_value, *filter_values]
+
+    async def query(sql: str, *values) -> List[Dict[str, Any]]:
+        return await connection.execute_query_dict(
+            format_placeholders(connection, sql), [*params, *values]
+        )
+
+    total = (await query(f"SELECT COUNT(*) AS total {source}"))[0]["total"]
+    boundary = None
+    if total > RANK_WINDOW:
+        # id of the oldest match inside the ranked window
+        boundary = (
+            await query(
+                f"SELECT {key} AS id {source} ORDER BY {key} DESC LIMIT 1 OFFSET ?",
+                RANK_WINDOW - 1,
+            )
+        )[0]["id"]
+
+    rows: List[Dict[str, Any]] = []
+    if skip < RANK_WINDOW:
+        ranked = f"SELECT {key} AS id, {score} AS score {source}"
+        values: List[Any] = []
+        if boundary is not None:
+            ranked += f" AND {key} >= ?"
+            values.append(boundary)
+        rows += await query(
+            f"{ranked} ORDER BY score DESC, {key} DESC LIMIT ? OFFSET ?",
+            *values,
+            limit,
+            skip,
+        )
+    if boundary is not None and len(rows) < limit:
+        rows += await query(
+            f"SELECT {key} AS id, {score} AS score {source} AND {key} < ? "
+            f"ORDER BY {key} DESC LIMIT ? OFFSET ?",
+            boundary,
+            limit - len(rows),
+            max(0, skip - RANK_WINDOW),
+        )
+
+    ids = [row["id"] for row in rows]
+    snippets = await _snippets(connection, match_value, ids)
+    messages = {
+        message.id: message for message in await ChatMessage.filter(id__in=ids)
+    }
+    results = [
+        {
+            "message": messages[row["id"]],
+            "rank": float(row["score"]),
+            "snippets": snippets.get(row["id"], {}),
+        }
+        for row in rows
+        if row["id"] in messages
+    ]
+    return results, total
+
+
+async def _search_like(
+    term: str, skip: int, limit: int, **filters
+) -> Tuple[List[Dict[str, Any]], int]:
+    q_filters = Q()
+    for name in SEARCH_FIELDS:
+        q_filters |= Q(**{f"{name}__icontains": term})
+    query = ChatMessage.filter(q_filters, **filters)
+    messages = await query.order_by("-timestamp", "-id").offset(skip).limit(limit)
+    results = [
+        {
+            "message": message,
+            "rank": 0.0,
+            "snippets": {
+                name: _highlight(getattr(message, name) or "", term)
+                for name in SEARCH_FIELDS
+            },
+        }
+        for message in messages
+    ]
+    return results, await query.count()
+
@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from tortoise import fields, timezone
+from tortoise.expressions import Q
+from tortoise.functions import Coalesce, Sum
+
+from prompt_agent.models.base import CRUDBase
+from prompt_agent.models.chat_message import RequestStatus
+
+# 响应时间直方图的桶上界 (毫秒), 每个桶只计 (上一个上界, 本上界] 内的请求, 不累计
+LATENCY_BUCKETS_MS = (250, 500, 1000, 2500, 5000, 10000)
+LATENCY_COLUMNS = [f"latency_le_{bound}ms" for bound in LATENCY_BUCKETS_MS] + [
+    f"latency_gt_{LATENCY_BUCKETS_MS[-1]}ms"
+]
+ROLLUP_SUM_COLUMNS = [
+    "request_count",
+    "input_tokens",
+    "output_tokens",
+    "total_tokens",
+    "response_time_sum_ms",
+    "response_time_count",
+    *LATENCY_COLUMNS,
+]
+
+
+def floor_hour(value: datetime) -> datetime:
+    """取所在整点, 统一转换到 Tortoise 的时区, 保证同一小时的 bucket_hour 取值一致"""
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    else:
+        value = timezone.make_aware(value)
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+class UsageHourlyRollup(CRUDBase):
+    """
+    Usage totals per (hour, api_key, model, status). The record writer adds
+    every flushed batch of usage records to these rows, and a scheduled job
+    rebuilds settled hours from usage_records, so dashboard statistics read a
+    few rows per hour instead of scanning the raw records.
+    """
+
+    bucket_hour = fields.DatetimeField(db_index=True)
+    api_key = fields.CharField(max_length=100, db_index=True)
+    model = fields.CharField(max_length=100)
+    status = fields.CharEnumField(RequestStatus)
+
+    request_count = fields.IntField(default=0)
+    input_tokens = fields.BigIntField(default=0)
+    output_tokens = fields.BigIntField(default=0)
+    total_tokens = fields.BigIntField(default=0)
+
+    # 平均响应时间 = response_time_sum_ms / response_time_count
+    response_time_sum_ms = fields.BigIntField(default=0)
+    response_time_count = fields.IntField(default=0)
+
+    latency_le_250ms = fields.IntField(default=0)
+    latency_le_500ms = fields.IntField(default=0)
+    latency_le_1000ms = fields.IntField(default=0)
+    latency_le_2500ms = fields.IntField(default=0)
+    latency_le_5000ms = fields.IntField(default=0)
+    latency_le_10000ms = fields.IntField(default=0)
+    latency_gt_10000ms = fields.IntField(default=0)
+
+    class Meta:
+        table = "usage_hourly_rollups"
+        unique_together = (("bucket_hour", "api_key", "model", "status"),)
+
+    @classmethod
+    def in_window(cls, days: int):
+        """
+        Rollups of the last ``days`` days. The window starts at the top of the
+        hour, so it may include up to one hour more than the raw records would.
+        """
+        return cls.filter(
+            bucket_hour__gte=floor_hour(timezone.now() - timedelta(days=days))
+        )
+
+    @staticmethod
+    def stats_annotations() -> Dict[str, Any]:
+        return {
+            "total_requests": Coalesce(Sum("request_count"), 0),
+            "successful_requests": Coalesce(
+                Sum("request_count", _filter=Q(status=RequestStatus.SUCCESS)), 0
+            ),
+            "failed_requests": Coalesce(
+                Sum("request_count", _filter=Q(status=RequestStatus.ERROR)), 0
+            ),
+            "total_input_tokens": Coalesce(Sum("input_tokens"), 0),
+            "total_output_tokens": Coalesce(Sum("output_tokens"), 0),
+            "total_tokens_sum": Coalesce(Sum("total_tokens"), 0),
+            "response_time_sum": Coalesce(Sum("response_time_sum_ms"), 0),
+            "response_time_count": Coalesce(Sum("response_time_count"), 0),
+        }
+
+    @staticmethod
+    def stats_response(row: Dict[str, Any], days: int) -> Dict[str, Any]:
+        """Shape an aggregated row like UsageRecord.get_usage_stats"""
+        total_requests = int(row["total_requests"])
+        successful_requests = int(row["successful_requests"])
+        response_time_count = int(row["response_time_count"])
+        return {
+            "period_days": days,
+            "total_requests": total_requests,
+            "successful_requests": successful_requests,
+            "failed_requests": int(row["failed_requests"]),
+            "success_rate": (successful_requests / total_requests * 100)
+            if total_requests > 0
+            else 0,
+            "total_input_tokens": int(row["total_input_tokens"]),
+            "total_output_tokens": int(row["total_output_tokens"]),
+            "total_tokens": int(row["total_tokens_sum"]),
+            "avg_response_time_ms": (
+                int(row["response_time_sum"]) / response_time_count
+            )
+            if response_time_count
+            else 0,
+        }
+
+    @classmethod
+    async def get_usage_stats(
+        cls, api_key: Optional[str] = None, days: int = 30
+    ) -> Dict[str, Any]:
+        """Get usage statistics for a specific API key or overall"""
+        query = cls.in_window(days)
+        if api_key:
+            query = query.filter(api_key=api_key)
+        annotations = cls.stats_annotations()
+        row = await query.annotate(**annotations).first().values(*annotations)
+        return cls.stats_response(row, days)
+
+    @classmethod
+    async def get_top_api_keys(
+        cls, days: int = 30, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        """Per-key statistics of the keys with the most requests, most first"""
+        annotations = cls.stats_annotations()
+        rows = (
+            await cls.in_window(days)
+            .annotate(**annotations)
+            .group_by("api_key")
+            .order_by("-total_requests", "api_key")
+            .limit(limit)
+            .values("api_key", *annotations)
+        )
+        return [
+            {"api_key": row["api_key"], "usage_stats": cls.stats_response(row, days)}
+            for row in rows
+        ]
+
+    @classmethod
+    async def count_by(
+        cls, field: str, days: int = 30, limit: Optional[int] = None, **filters
+    ) -> List[Dict[str, Any]]:
+        """Requests and tokens grouped by one column, most requests first"""
+        query = (
+            cls.in_window(days)
+            .filter(**filters)
+            .annotate(
+                requests=Coalesce(Sum("request_count"), 0),
+                tokens=Coalesce(Sum("total_tokens"), 0),
+            )
+            .group_by(field)
+            .order_by("-requests", field)
+        )
+        if limit:
+            query = query.limit(limit)
+        return await query.values(field, "requests", "tokens")
+
+    @classmethod
+    async def get_hourly_activity(cls, hours: int = 24) -> List[Dict[str, Any]]:
+        """Requests per hour of day over the last ``hours`` hours"""
+        rows = (
+            await cls.filter(
+                bucket_hour__gte=floor_hour(timezone.now() - timedelta(hours=hours))
+            )
+            .annotate(requests=Coalesce(Sum("request_count"), 0))
+            .group_by("bucket_hour")
+            .values("bucket_hour", "requests")
+        )
+        hourly_activity: Dict[str, int] = {}
+        for row in rows:
+            hour = timezone.localtime(row["bucket_hour"]).strftime("%H:00")
+            hourly_activity[hour] = hourly_activity.get(hour, 0) + int(row["requests"])
+        return [
+            {"hour": hour, "requests": count}
+            for hour, count in sorted(hourly_activity.items())
+        ]
@@ -1,9 +1,11 @@
 import asyncio
-import json
+import re
 import time
 import uuid
+from contextlib import aclosing
 from datetime import datetime
 from functools import partial
+from typing import AsyncGenerator, Dict, Optional, Tuple
 from uuid import uuid4
 
 from fastapi import APIRouter, Depends, Header, HTTPException, Request
@@ -12,28 +14,55 @@ from loguru import logger
 
 from prompt_agent.agent import get_prompt_agent
 from prompt_agent.configs import (DEFAULT_RETRIVAL_COUNT,
-                                  POE_OPENAI_LIKE_API_KEY)
+                                  POE_OPENAI_LIKE_API_KEY,
+                                  RESPONSE_CACHE_ENABLED,
+                                  SINGLE_FLIGHT_ENABLED)
 from prompt_agent.models.chat_message import RequestType
 from prompt_agent.openai_api.schemas import ChatCompletionRequest, ChatMessage
 from prompt_agent.prompts import OPTIMIZE_PROMPT, RAG_REFER_PROMPT
-from prompt_agent.redis_manager.api_key_manager import get_api_key_manager
+from prompt_agent.redis_manager.api_key_manager import (AdmissionStatus,
+                                                       QuotaUnit,
+                                                       get_api_key_manager)
+from prompt_agent.redis_manager.response_cache_manager import \
+    get_response_cache_manager
+from prompt_agent.schemas import APIKeyType
+from prompt_agent.utils.priority_limiter import QueueFullError
+from prompt_agent.utils.token_utils import (async_get_messages_token_length,
+                                            async_get_token_length)
+from prompt_agent.utils.single_flight import get_single_flight
+from prompt_agent.utils.sse_utils import SSE_DONE, ChatCompletionChunkEncoder
 from prompt_agent.utils.usage_tracking import (UsageTracker,
                                                create_background_task,
                                                create_chat_message_record,
-                                               estimate_tokens)
+                                               get_usage_accounting)
 from prompt_agent.vector_db.prompt_vector_db import get_prompt_vector_db
 
 # Add this constant at the top of the file after the imports
 VALID_API_KEY = POE_OPENAI_LIKE_API_KEY
+# A word with its trailing whitespace, or a run of leading whitespace
+_REPLAY_CHUNK_PATTERN = re.compile(r"\S+\s*|\s+")
+# Upstream queue priority per key tier, lower is served first
+_KEY_TYPE_PRIORITY = {APIKeyType.PLUS.value: 0, APIKeyType.BASIC.value: 1}
 
 router = APIRouter()
 
 
 # API Key validation dependency
-async def validate_api_key(authorization: str = Header(None)) -> str:
+async def validate_api_key(
+    request_body: ChatCompletionRequest,
+    fastapi_request: Request,
+    authorization: str = Header(None),
+) -> str:
     """
     API key validation dependency
     Returns the validated API key or raises HTTPException
+
+    The key is admitted before the prompt is tokenized, so rejected callers
+    cost no tokenizer work. Keys metered in tokens are then charged for the
+    input tokens with a follow-up debit. The input token count (when already
+    counted), quota unit and key type are stored on ``request.state`` so the
+    endpoint doesn't tokenize the prompt again and queues the request by key
+    tier.
     """
     # Extract API key from Authorization header
     api_key = None
@@ -47,6 +76,10 @@ async def validate_api_key(authorization: str = Header(None)) -> str:
             detail="Invalid Authorization header. Format should be 'Bearer YOUR_API_KEY'",
         )
 
+    fastapi_request.state.input_tokens = None
+    fastapi_request.state.quota_unit = QuotaUnit.REQUESTS.value
+    fastapi_request.state.key_type = APIKeyType.PLUS.value
+
     # Check if it's the fallback API key
     if api_key == VALID_API_KEY:
         # Allow the original fallback key to pass through
@@ -56,16 +89,19 @@ async def validate_api_key(authorization: str = Header(None)) -> str:
     # Use APIKeyManager for validation and usage tracking
     api_key_manager = get_api_key_manager()
 
-    # Validate API key exists and is not deleted/expired
-    is_valid = await api_key_manager.is_api_key_valid(api_key)
-    if not is_valid:
-        raise HTTPException(status_code=401, detail="Invalid or expired API key")
-
-    # Increment usage (this also handles activation on first use)
-    usage_result = await api_key_manager.increment_usage(api_key)
+    # Validate, activate and count usage in a single atomic round trip
+    usage_result = await api_key_manager.admit_api_key(api_key)
     if not usage_result["success"]:
-        # Get detailed usage info for better error message
-        usage_info = await api_key_manager.get_usage_info(api_key)
+        if usage_result["status"] == AdmissionStatus.BURST_LIMITED:
+            raise HTTPException(
+                status_code=429,
+                detail=usage_result["message"],
+                headers={"Retry-After": "1"},
+            )
+        if usage_result["status"] != AdmissionStatus.USAGE_LIMITED:
+            raise HTTPException(status_code=401, detail="Invalid or expired API key")
+
+        usage_info = usage_result.get("usage_info", {})
 
         # Calculate wait time information
         time_until_reset = usage_info.get("time_until_reset", 0)
@@ -83,9 +119,14 @@ async def validate_api_key(authorization: str = Header(None)) -> str:
 
             current_usage = usage_info.get("current_period_usage", 0)
             usage_limit = usage_info.get("usage_limit", 0)
+            quota_name = (
+                "Token 用量"
+                if usage_info.get("quota_unit") == QuotaUnit.TOKENS.value
+                else "使用次数"
+            )
 
             detail_message = (
-                f"使用次数已达限制 ({current_usage}/{usage_limit})。" f"请等待 {wait_time_str} 后重试。"
+                f"{quota_name}已达限制 ({current_usage}/{usage_limit})。" f"请等待 {wait_time_str} 后重试。"
             )
         else:
             detail_message = usage_result["message"]
@@ -99,46 +140,92 @@ async def validate_api_key(authorization: str = Header(None)) -> str:
     logger.info(
         f"API key {api_key[:10]}... used. Usage info: {usage_result.get('usage_info', {})}"
     )
+    quota_unit = usage_result["usage_info"]["quota_unit"]
+    fastapi_request.state.quota_unit = quota_unit
+    fastapi_request.state.key_type = usage_result["usage_info"]["key_type"]
+
+    if quota_unit == QuotaUnit.TOKENS.value:
+        # Count prompt tokens with the real tokenizer, off the event loop
+        input_tokens = await async_get_messages_token_length(
+            [
+                {"role": msg.role, "content": msg.content}
+                for msg in request_body.messages
+            ]
+        )
+        fastapi_request.state.input_tokens = input_tokens
+        try:
+            await api_key_manager.debit_usage(api_key, input_tokens)
+        except Exception as e:
+            logger.error(f"Failed to debit input tokens for {api_key[:10]}...: {str(e)}")
 
     return api_key
 
 
-async def _async_resp_generator(original_generator, model: str):
-    i = 0
-    response_text = ""
-    first_chunk = True
-    async for data in original_generator:
-        response_text += data
-        chunk = {
-            "id": i,
-            "object": "chat.completion.chunk",
-            "created": time.time(),
-            "model": model,
-            "choices": [
-                {
-                    "delta": {
-                        "content": f"{data}",
-                        **(
-                            {"role": "assistant"} if first_chunk else {}
-                        ),  # 只在第一个chunk添加role
-                    }
-                }
-            ],
-        }
-        first_chunk = False
+async def _record_output_usage(
+    tracker: UsageTracker,
+    api_key: str,
+    response_text: str,
+    quota_unit: str,
+    output_tokens: Optional[int] = None,
+):
+    """
+    Count output tokens with the real tokenizer (unless already counted),
+    debit them from token quotas, then persist the usage record
+    """
+    if output_tokens is None:
+        output_tokens = await async_get_token_length(response_text)
+    tracker.set_tokens(output_tokens=output_tokens)
+    if quota_unit == QuotaUnit.TOKENS.value and api_key != VALID_API_KEY:
+        try:
+            await get_api_key_manager().debit_usage(api_key, output_tokens)
+        except Exception as e:
+            logger.error(f"Failed to debit output tokens for {api_key[:10]}...: {str(e)}")
+    tracker.record_usage()
+
+
+def _finish_reason(metadata: Dict) -> str:
+    """
+    OpenAI finish_reason of a completed response: "stop" once the prompt's end
+    tag was reached, otherwise what the upstream reported, e.g. "length" when
+    it was cut off before the end tag
+    """
+    if metadata.get("upstream_stop_reason") == "end_tag":
+        return "stop"
+    return metadata.get("upstream_finish_reason") or "stop"
 
-        yield f"data: {json.dumps(chunk)}\n\n"
-        i += 1
 
-    yield f"data: {json.dumps({'choices':[{'index': 0, 'delta': {}, 'logprobs': None, 'finish_reason': 'stop'}]})}\n\n"
-    yield "data: [DONE]\n\n"
+async def _async_resp_generator(
+    original_generator, model: str, completion_id: str, metadata: Dict
+) -> AsyncGenerator[Tuple[str, str], None]:
+    """
+    Yield ``(delta, frame)`` pairs: the raw text delta travels next to its
+    encoded SSE frame so consumers never re-parse the JSON they just produced.
+    The final stop and [DONE] frames carry an empty delta; the stop frame's
+    finish_reason comes from the upstream stats the agent left in ``metadata``.
+    """
+    encoder = ChatCompletionChunkEncoder(model, completion_id)
+    async with aclosing(original_generator):
+        async for data in original_generator:
+            yield data, encoder.encode(data)
 
+    yield "", encoder.finish(_finish_reason(metadata))
+    yield "", SSE_DONE
 
-async def streaming_message(request: ChatCompletionRequest, api_key: str):
+
+async def streaming_message(
+    request: ChatCompletionRequest,
+    api_key: str,
+    metadata: Optional[Dict] = None,
+    priority: int = 0,
+):
     """
     Process streaming message request with validated API key
     Note: API key validation and usage tracking is now handled by the dependency
+    Upstream stream statistics are written into ``metadata`` when given
+    ``priority`` orders the request in the upstream queue (lower goes first)
     """
+    if metadata is None:
+        metadata = {}
     model = request.model
     messages = request.messages
     _prompt_agent = get_prompt_agent()
@@ -147,14 +234,74 @@ async def streaming_message(request: ChatCompletionRequest, api_key: str):
     messages_dict = [
         {"role": msg.role, "content": str(msg.content)} for msg in messages
     ]
-
-    return _prompt_agent.optimize_prompt(
+    cache_params = dict(
         messages=messages_dict,
-        stream=request.stream or False,
-        enable_vector_db_retrival=request.enable_retrival or False,
+        model=model,
         collection_name=request.collection_name or "",
+        enable_retrival=request.enable_retrival or False,
     )
 
+    cache_key = None
+    if RESPONSE_CACHE_ENABLED:
+        try:
+            cache_key, cached, level = await get_response_cache_manager().lookup(
+                **cache_params
+            )
+        except Exception as e:
+            logger.warning(f"Response cache lookup failed: {str(e)}")
+        else:
+            metadata["response_cache"] = level or "miss"
+            if cached is not None:
+                return _replay_cached_response(cached)
+
+    def produce(produce_metadata: Dict):
+        generator = _prompt_agent.optimize_prompt(
+            messages=messages_dict,
+            stream=request.stream or False,
+            enable_vector_db_retrival=request.enable_retrival or False,
+            collection_name=request.collection_name or "",
+            metadata=produce_metadata,
+            priority=priority,
+        )
+        if cache_key is None:
+            return generator
+        return _cache_completed_response(
+            generator, cache_key, cache_params, produce_metadata
+        )
+
+    if SINGLE_FLIGHT_ENABLED:
+        # Concurrent identical requests share one upstream stream
+        flight_key = cache_key or get_response_cache_manager().build_key(
+            **cache_params
+        )
+        return get_single_flight().stream(flight_key, produce, metadata)
+    return produce(metadata)
+
+
+async def _replay_cached_response(content: str):
+    """Replay a cached result in word-sized deltas, like an upstream stream"""
+    for match in _REPLAY_CHUNK_PATTERN.finditer(content):
+        yield match.group()
+
+
+async def _cache_completed_response(
+    generator, cache_key: str, cache_params: Dict, metadata: Dict
+):
+    """Pass chunks through and cache the result once the end tag was reached"""
+    parts = []
+    async with aclosing(generator):
+        async for text in generator:
+            parts.append(text)
+            yield text
+
+    if metadata.get("upstream_stop_reason") == "end_tag" and parts:
+        create_background_task(
+            get_response_cache_manager().store(
+                cache_key, "".join(parts), **cache_params
+            ),
+            f"response_cache_{cache_key[:12]}",
+        )
+
 
 @router.post("/chat/completions")
 async def chat_completions(
@@ -186,49 +333,47 @@ async def chat_completions(
         request=fastapi_request,
     )
 
+    quota_unit = getattr(fastapi_request.state, "quota_unit", QuotaUnit.REQUESTS.value)
+    priority = _KEY_TYPE_PRIORITY.get(
+        getattr(fastapi_request.state, "key_type", None), 0
+    )
+
     try:
-        # Extract user prompt from messages for token estimation
-        # user_prompt = ""
-        # for msg in request_body.messages:
-        #     if msg.role == "user":
-        #         user_prompt += str(msg.content) + "\n"
-        # user_prompt = user_prompt.strip()
         user_prompt = request_body.messages[-1].content
 
-        # For token estimation, we'll estimate based on the user prompt
-        # The actual optimization is handled by streaming_message function
-        # This is a reasonable approximation for billing purposes
-
-        # Estimate input tokens based on user prompt (approximation for billing)
-        input_tokens = estimate_tokens(user_prompt)
+        # Input tokens of token-metered keys were counted during admission
+        input_tokens = getattr(fastapi_request.state, "input_tokens", None)
+        if input_tokens is None:
+            input_tokens = await async_get_messages_token_length(
+                [{"role": m.role, "content": m.content} for m in request_body.messages]
+            )
         tracker.set_tokens(input_tokens=input_tokens)
 
         # Get response from agent
-        resp_content = await streaming_message(request_body, api_key)
+        resp_content = await streaming_message(
+            request_body, api_key, metadata=tracker.metadata, priority=priority
+        )
 
         if request_body.stream:
+            # Pull the first frame before the response starts, so queue
+            # rejection and upstream errors still get a proper status code
+            resp_generator = _async_resp_generator(
+                resp_content, request_body.model, tracker.request_id, tracker.metadata
+            )
+            first_delta, first_frame = await anext(resp_generator)
+
             # For streaming responses, we need to collect the response text
             async def tracked_stream_generator():
-                response_text = ""
+                response_parts = [first_delta] if first_delta else []
                 try:
-                    async for chunk in _async_resp_generator(
-                        resp_content, request_body.model
-                    ):
-                        # Extract content from chunk to build response text
-                        try:
-                            chunk_data = json.loads(chunk.replace("data: ", "").strip())
-                            if (
-                                "choices" in chunk_data
-                                and len(chunk_data["choices"]) > 0
-                            ):
-                                delta = chunk_data["choices"][0].get("delta", {})
-                                content = delta.get("content", "")
-                                if content:
-                                    response_text += content
-                        except (json.JSONDecodeError, KeyError):
-                            pass
-
-                        yield chunk
+                    # aclosing propagates a client disconnect down to the agent,
+                    # which then closes the upstream stream right away
+                    async with aclosing(resp_generator):
+                        yield first_frame
+                        async for delta, frame in resp_generator:
+                            if delta:
+                                response_parts.append(delta)
+                            yield frame
 
                     # Streaming completed successfully
                     tracker.request_end_time = (
@@ -244,39 +389,35 @@ async def chat_completions(
                     raise
                 finally:
                     # Record final response data and set chat details in tracker
-                    output_tokens = estimate_tokens(response_text)
-                    tracker.set_tokens(output_tokens=output_tokens)
+                    response_text = "".join(response_parts)
                     tracker.set_chat_details(
                         user_prompt=user_prompt,
                         optimized_prompt=user_prompt,  # Simplified: using user_prompt as approximation
                         assistant_response=response_text,
                     )
 
-                    # Explicitly create background task to record usage
-                    logger.info(
-                        f"Creating background task to record usage for request {tracker.request_id}"
-                    )
-                    create_background_task(
-                        tracker.record_usage(), f"usage_record_{tracker.request_id}"
+                    # Count output tokens, debit quotas and record usage in the
+                    # bounded accounting pool
+                    await get_usage_accounting().submit(
+                        _record_output_usage,
+                        tracker,
+                        api_key,
+                        response_text,
+                        quota_unit,
+                        name=f"usage_record_{tracker.request_id}",
                     )
 
-                    # Explicitly create background task to record chat message
-                    logger.info(
-                        f"Creating background task to record chat message for request {tracker.request_id}"
-                    )
-                    create_background_task(
-                        create_chat_message_record(
-                            request_id=tracker.request_id,
-                            api_key=api_key,
-                            model=request_body.model,
-                            user_prompt=user_prompt,
-                            assistant_response=response_text,
-                            optimized_prompt=user_prompt,  # Simplified: using user_prompt as approximation
-                            request_params=request_params,
-                            client_ip=tracker.client_ip,
-                            user_agent=tracker.user_agent,
-                        ),
-                        f"chat_message_{tracker.request_id}",
+                    # Queue the chat message for the batched record writer
+                    create_chat_message_record(
+                        request_id=tracker.request_id,
+                        api_key=api_key,
+                        model=request_body.model,
+                        user_prompt=user_prompt,
+                        assistant_response=response_text,
+                        optimized_prompt=user_prompt,  # Simplified: using user_prompt as approximation
+                        request_params=request_params,
+                        client_ip=tracker.client_ip,
+                        user_agent=tracker.user_agent,
                     )
 
             return StreamingResponse(
@@ -284,10 +425,10 @@ async def chat_completions(
                 media_type="text/event-stream",
             )
         else:
-            # Non-streaming response (not implemented in original code)
-            response_content = "not implemented"
-            output_tokens = estimate_tokens(response_content)
-            tracker.set_tokens(output_tokens=output_tokens)
+            # Non-streaming response: the agent yields the extracted prompt once
+            async with aclosing(resp_content) as completion:
+                response_content = "".join([text async for text in completion])
+            output_tokens = await async_get_token_length(response_content)
             tracker.set_chat_details(
                 user_prompt=user_prompt,
                 optimized_prompt=user_prompt,  # Simplified: using user_prompt as approximation
@@ -297,41 +438,50 @@ async def chat_completions(
             # Set end time for non-streaming response
             tracker.request_end_time = datetime.now()
 
-            # Explicitly create background task to record usage
-            logger.info(
-                f"Creating background task to record usage for request {tracker.request_id}"
-            )
-            create_background_task(
-                tracker.record_usage(), f"usage_record_{tracker.request_id}"
+            # Debit quotas and record usage in the bounded accounting pool
+            await get_usage_accounting().submit(
+                _record_output_usage,
+                tracker,
+                api_key,
+                response_content,
+                quota_unit,
+                output_tokens,
+                name=f"usage_record_{tracker.request_id}",
             )
 
-            # Explicitly create background task to record chat message
-            logger.info(
-                f"Creating background task to record chat message for request {tracker.request_id}"
-            )
-            create_background_task(
-                create_chat_message_record(
-                    request_id=tracker.request_id,
-                    api_key=api_key,
-                    model=request_body.model,
-                    user_prompt=user_prompt,
-                    assistant_response=response_content,
-                    optimized_prompt=user_prompt,  # Simplified: using user_prompt as approximation
-                    request_params=request_params,
-                    client_ip=tracker.client_ip,
-                    user_agent=tracker.user_agent,
-                ),
-                f"chat_message_{tracker.request_id}",
+            # Queue the chat message for the batched record writer
+            create_chat_message_record(
+                request_id=tracker.request_id,
+                api_key=api_key,
+                model=request_body.model,
+                user_prompt=user_prompt,
+                assistant_response=response_content,
+                optimized_prompt=user_prompt,  # Simplified: using user_prompt as approximation
+                request_params=request_params,
+                client_ip=tracker.client_ip,
+                user_agent=tracker.user_agent,
             )
 
             return {
                 "id": tracker.request_id,
                 "object": "chat.completion",
-                "created": time.time(),
+                "created": int(time.time()),
                 "model": request_body.model,
                 "choices": [
-                    {"message": ChatMessage(role="assistant", content=response_content)}
+                    {
+                        "index": 0,
+                        "message": ChatMessage(
+                            role="assistant", content=response_content
+                        ),
+                        "logprobs": None,
+                        "finish_reason": _finish_reason(tracker.metadata),
+                    }
                 ],
+                "usage": {
+                    "prompt_tokens": input_tokens,
+                    "completion_tokens": output_tokens,
+                    "total_tokens": input_tokens + output_tokens,
+                },
             }
 
     except Exception as e:
@@ -339,12 +489,14 @@ async def chat_completions(
         tracker.set_error(str(e), getattr(e, "status_code", None))
         tracker.request_end_time = datetime.now()
 
-        # Explicitly create background task to record the error
+        # Queue the failed request's usage record
         logger.error(f"Request {tracker.request_id} failed with error: {str(e)}")
-        logger.info(
-            f"Creating background task to record failed usage for request {tracker.request_id}"
-        )
-        create_background_task(
-            tracker.record_usage(), f"usage_record_error_{tracker.request_id}"
-        )
+        tracker.record_usage()
+        if isinstance(e, QueueFullError):
+            # Every upstream slot is busy and the wait queue is full: shed load
+            raise HTTPException(
+                status_code=503,
+                detail="Service is busy, please retry later",
+                headers={"Retry-After": str(e.retry_after)},
+            ) from e
         raise
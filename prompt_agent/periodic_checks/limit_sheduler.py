@@ -3,9 +3,15 @@ from datetime import datetime
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
-from prompt_agent.configs import GROK_CLIENT_LIMIT_CHECKS_INTERVAL_MINUTES
+from prompt_agent.configs import (GROK_CLIENT_LIMIT_CHECKS_INTERVAL_MINUTES,
+                                  RESPONSE_CACHE_SEMANTIC_ENABLED,
+                                  RESPONSE_CACHE_SEMANTIC_PRUNE_INTERVAL_MINUTES,
+                                  USAGE_ROLLUP_RECONCILE_INTERVAL_MINUTES)
 from prompt_agent.periodic_checks.clients_limit_checks import \
     check_grok_clients_limits
+from prompt_agent.redis_manager.response_cache_manager import \
+    prune_semantic_response_cache
+from prompt_agent.utils.usage_rollup import reconcile_usage_rollups
 
 limit_check_scheduler = AsyncIOScheduler()
 
@@ -17,6 +23,21 @@ limit_check_scheduler.add_job(
     name=f"Check API usage limits every {GROK_CLIENT_LIMIT_CHECKS_INTERVAL_MINUTES} minutes",
     replace_existing=True,
 )
+limit_check_scheduler.add_job(
+    reconcile_usage_rollups,
+    trigger=IntervalTrigger(minutes=USAGE_ROLLUP_RECONCILE_INTERVAL_MINUTES),
+    id="reconcile_usage_rollups",
+    name=f"Rebuild settled usage rollups every {USAGE_ROLLUP_RECONCILE_INTERVAL_MINUTES} minutes",
+    replace_existing=True,
+)
+if RESPONSE_CACHE_SEMANTIC_ENABLED:
+    limit_check_scheduler.add_job(
+        prune_semantic_response_cache,
+        trigger=IntervalTrigger(minutes=RESPONSE_CACHE_SEMANTIC_PRUNE_INTERVAL_MINUTES),
+        id="prune_semantic_response_cache",
+        name=f"Prune expired semantic cache entries every {RESPONSE_CACHE_SEMANTIC_PRUNE_INTERVAL_MINUTES} minutes",
+        replace_existing=True,
+    )
 
 
 class LimitScheduler:
@@ -26,6 +47,11 @@ class LimitScheduler:
     async def start():
         await check_grok_clients_limits()
         limit_check_scheduler.start()
+        # 启动后立即在后台对账一次, 尚未回填过时回填历史用量, 不阻塞启动;
+        # 多个 worker 同时启动时由对账任务内的 Redis 锁保证只执行一次
+        limit_check_scheduler.add_job(
+            reconcile_usage_rollups, id="backfill_usage_rollups", replace_existing=True
+        )
 
     @staticmethod
     async def shutdown():
@@ -1,8 +1,464 @@
+import asyncio
+import json
+import random
+import time
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+import httpx
+import openai
 from loguru import logger
 from openai import AsyncOpenAI, OpenAI
 
-from prompt_agent.configs import API_KEY, BASE_URL
+from prompt_agent.configs import (API_KEY, BASE_URL, UPSTREAM_CONNECT_TIMEOUT,
+                                  UPSTREAM_EJECTION_FAILURES,
+                                  UPSTREAM_EJECTION_SECONDS, UPSTREAM_ENDPOINTS,
+                                  UPSTREAM_EWMA_ALPHA, UPSTREAM_HEDGE_MODEL,
+                                  UPSTREAM_HTTP2,
+                                  UPSTREAM_KEEPALIVE_EXPIRY,
+                                  UPSTREAM_MAX_CONNECTIONS,
+                                  UPSTREAM_MAX_IN_FLIGHT,
+                                  UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+                                  UPSTREAM_MAX_QUEUE,
+                                  UPSTREAM_QUEUE_RETRY_AFTER,
+                                  UPSTREAM_READ_TIMEOUT, UPSTREAM_ROUTING,
+                                  UPSTREAM_TTFT_DEADLINE_SECONDS)
+from prompt_agent.utils.priority_limiter import PriorityLimiter
 
 # sync_client = OpenAI(base_url=BASE_URL, api_key=API_KEY)
 
-async_client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY)
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_http_client() -> httpx.AsyncClient:
+    """httpx client with explicit pool sizes, keep-alive and timeouts"""
+    http2 = UPSTREAM_HTTP2
+    if http2 and not _http2_available():
+        logger.warning(
+            "UPSTREAM_HTTP2 is set but h2 is not installed, using HTTP/1.1"
+        )
+        http2 = False
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+    )
+
+
+def is_endpoint_failure(error: BaseException) -> bool:
+    """Errors that say something about the upstream's health (not the request's)"""
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code == 429
+    return False
+
+
+class UpstreamEndpoint:
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        name: Optional[str] = None,
+        weight: float = 1.0,
+        model: Optional[str] = None,
+        max_in_flight: int = UPSTREAM_MAX_IN_FLIGHT,
+    ):
+        self.name = name or base_url
+        self.base_url = base_url
+        self.weight = max(float(weight), 0.01)
+        self.model = model
+        self.client = AsyncOpenAI(
+            base_url=base_url, api_key=api_key, http_client=build_http_client()
+        )
+        self.limiter = PriorityLimiter(
+            max_in_flight, UPSTREAM_MAX_QUEUE, UPSTREAM_QUEUE_RETRY_AFTER
+        )
+
+        self.outstanding = 0
+        self.ewma_latency_ms: Optional[float] = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.total_requests = 0
+        self.total_failures = 0
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def record_success(self, latency_ms: float):
+        self.consecutive_failures = 0
+        self.record_latency(latency_ms)
+
+    def record_latency(self, latency_ms: float):
+        if self.ewma_latency_ms is None:
+            self.ewma_latency_ms = latency_ms
+        else:
+            self.ewma_latency_ms += UPSTREAM_EWMA_ALPHA * (
+                latency_ms - self.ewma_latency_ms
+            )
+
+    def record_failure(self):
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= UPSTREAM_EJECTION_FAILURES:
+            self.ejected_until = time.monotonic() + UPSTREAM_EJECTION_SECONDS
+            # 恢复后处于半开状态, 再失败一次就重新摘除
+            self.consecutive_failures = UPSTREAM_EJECTION_FAILURES - 1
+            logger.warning(
+                f"Upstream {self.name} ejected for {UPSTREAM_EJECTION_SECONDS}s"
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "weight": self.weight,
+            "model": self.model,
+            "outstanding": self.outstanding,
+            "ewma_latency_ms": self.ewma_latency_ms,
+            "consecutive_failures": self.consecutive_failures,
+            "ejected": not self.is_available(time.monotonic()),
+            "total_requests": self.total_requests,
+            "total_failures": self.total_failures,
+            "limiter": self.limiter.stats(),
+        }
+
+
+class UpstreamCall:
+    """
+    Tracks one request on an endpoint: in-flight count, time to first token
+    and failures. Use as a context manager around the whole upstream stream.
+    """
+
+    def __init__(self, endpoint: UpstreamEndpoint):
+        self.endpoint = endpoint
+        self.started_at = time.perf_counter()
+        self.first_token_ms: Optional[float] = None
+
+    def __enter__(self) -> "UpstreamCall":
+        self.started_at = time.perf_counter()
+        self.endpoint.outstanding += 1
+        self.endpoint.total_requests += 1
+        return self
+
+    def mark_first_token(self):
+        if self.first_token_ms is None:
+            self.first_token_ms = (time.perf_counter() - self.started_at) * 1000
+            self.endpoint.record_success(self.first_token_ms)
+
+    def __exit__(self, exc_type, exc, tb):
+        self.endpoint.outstanding -= 1
+        if exc is not None:
+            if is_endpoint_failure(exc):
+                self.endpoint.record_failure()
+        elif self.first_token_ms is None:
+            # non-streaming call: the whole response is the first token
+            self.mark_first_token()
+        return False
+
+
+class UpstreamAttempt:
+    """
+    One upstream request, opened up to its first content token. Chunks read
+    while waiting for it are kept and replayed by ``chunks()``. The attempt
+    holds a slot of the endpoint's limiter and its UpstreamCall, and must be
+    released with ``close()``.
+    """
+
+    def __init__(self, endpoint: UpstreamEndpoint, model: str, stream: bool):
+        self.endpoint = endpoint
+        self.model = model
+        self.stream = stream
+        self.call = UpstreamCall(endpoint)
+        self.response = None
+        self.slot_acquired = False
+        self.queue_wait_ms = 0.0
+        self._entered = False
+        self._iterator: Optional[AsyncIterator] = None
+        self._pending: List[Any] = []
+        self._closed = False
+
+    async def open(
+        self, messages: List[Dict[str, str]], priority: int = 0
+    ) -> "UpstreamAttempt":
+        try:
+            if not self.slot_acquired:
+                # 超出并发上限时按优先级排队, 队列满则抛出 QueueFullError
+                waited = await self.endpoint.limiter.acquire(priority)
+                self.slot_acquired = True
+                self.queue_wait_ms = waited * 1000
+            self.call.__enter__()
+            self._entered = True
+            self.response = await self.endpoint.client.chat.completions.create(
+                model=self.model, messages=messages, stream=self.stream
+            )
+            if self.stream:
+                self._iterator = self.response.__aiter__()
+                while True:
+                    try:
+                        chunk = await self._iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    self._pending.append(chunk)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        break
+        except BaseException as e:
+            await self.close(e)
+            raise
+        self.call.mark_first_token()
+        return self
+
+    async def chunks(self) -> AsyncIterator:
+        pending, self._pending = self._pending, []
+        for chunk in pending:
+            yield chunk
+        if self._iterator is not None:
+            async for chunk in self._iterator:
+                yield chunk
+
+    async def close(self, error: Optional[BaseException] = None):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self.stream and self.response is not None:
+                # shield: 取消时也要把上游 HTTP 流关掉
+                await asyncio.shield(self.response.close())
+        finally:
+            if self._entered:
+                if isinstance(error, asyncio.CancelledError):
+                    # 输掉对冲而被取消: 至少等了这么久, 作为延迟样本
+                    self.endpoint.record_latency(
+                        (time.perf_counter() - self.call.started_at) * 1000
+                    )
+                self.call.__exit__(type(error) if error else None, error, None)
+            if self.slot_acquired:
+                self.endpoint.limiter.release()
+
+
+class UpstreamPool:
+    """Weighted upstream endpoints, least-outstanding or EWMA routing, ejection"""
+
+    def __init__(
+        self, endpoints: List[UpstreamEndpoint], routing: str = "least_outstanding"
+    ):
+        if not endpoints:
+            raise ValueError("At least one upstream endpoint is required")
+        if routing not in ("least_outstanding", "ewma"):
+            raise ValueError(f"Unknown upstream routing: {routing}")
+        self.endpoints = endpoints
+        self.routing = routing
+
+    def _score(self, endpoint: UpstreamEndpoint) -> float:
+        load = (endpoint.outstanding + endpoint.limiter.queued + 1) / endpoint.weight
+        if self.routing == "ewma":
+            # 尚无延迟样本的上游按当前最快的处理, 让它尽快获得样本
+            latency = endpoint.ewma_latency_ms
+            if latency is None:
+                latency = min(
+                    (e.ewma_latency_ms for e in self.endpoints if e.ewma_latency_ms),
+                    default=1.0,
+                )
+            return load * latency
+        return load
+
+    def select(self, exclude: Iterable[UpstreamEndpoint] = ()) -> UpstreamEndpoint:
+        excluded = set(map(id, exclude))
+        candidates = [e for e in self.endpoints if id(e) not in excluded] or list(
+            self.endpoints
+        )
+        now = time.monotonic()
+        available = [e for e in candidates if e.is_available(now)]
+        if not available:
+            # 全部被摘除时放行最早恢复的一个, 而不是直接失败
+            return min(candidates, key=lambda e: e.ejected_until)
+        best = min(self._score(e) for e in available)
+        return random.choice([e for e in available if self._score(e) == best])
+
+    def _hedge_attempt(
+        self,
+        primary: UpstreamAttempt,
+        default_model: str,
+        hedge_model: str,
+    ) -> Optional[UpstreamAttempt]:
+        """
+        对冲请求优先发往另一个上游; 只有一个上游时换用 hedge_model。
+        对冲请求不排队: 目标上游没有空闲并发时放弃对冲
+        """
+        endpoint = self.select(exclude=[primary.endpoint])
+        if endpoint is not primary.endpoint:
+            hedge = UpstreamAttempt(
+                endpoint, hedge_model or endpoint.model or default_model, primary.stream
+            )
+        elif hedge_model and hedge_model != primary.model:
+            hedge = UpstreamAttempt(primary.endpoint, hedge_model, primary.stream)
+        else:
+            return None
+        if not endpoint.limiter.try_acquire():
+            return None
+        hedge.slot_acquired = True
+        return hedge
+
+    async def open_hedged(
+        self,
+        messages: List[Dict[str, str]],
+        stream: bool,
+        default_model: str,
+        metadata: Dict,
+        priority: int = 0,
+        deadline: float = UPSTREAM_TTFT_DEADLINE_SECONDS,
+        hedge_model: str = UPSTREAM_HEDGE_MODEL,
+    ) -> UpstreamAttempt:
+        """
+        Open a request and wait up to ``deadline`` seconds for its first token.
+        After that (or if the primary fails with an endpoint error first) a
+        duplicate goes to another endpoint/model; whichever attempt produces a
+        token first wins and the other one is cancelled. Only slow requests are
+        duplicated, so the extra upstream cost is bounded by the tail.
+
+        The primary request waits for a slot of its endpoint's limiter with the
+        given ``priority`` (lower goes first) and raises QueueFullError when
+        the queue is full; the deadline includes that wait.
+
+        Records ``hedge`` (disabled / not_needed / fired / failover /
+        unavailable), ``hedge_endpoint``, ``hedge_winner``, ``upstream_endpoint``,
+        ``queue_wait_ms`` and ``upstream_ttft_ms`` (measured from the primary
+        request) in metadata.
+        """
+        started_at = time.perf_counter()
+        endpoint = self.select()
+        primary = UpstreamAttempt(endpoint, endpoint.model or default_model, stream)
+        metadata["upstream_endpoint"] = endpoint.name
+
+        if deadline <= 0:
+            metadata["hedge"] = "disabled"
+            winner = await primary.open(messages, priority)
+        else:
+            winner = await self._race(
+                primary,
+                messages,
+                priority,
+                default_model,
+                hedge_model,
+                deadline,
+                metadata,
+            )
+
+        metadata["upstream_endpoint"] = winner.endpoint.name
+        metadata["queue_wait_ms"] = winner.queue_wait_ms
+        metadata["upstream_ttft_ms"] = (time.perf_counter() - started_at) * 1000
+        return winner
+
+    async def _race(
+        self,
+        primary: UpstreamAttempt,
+        messages: List[Dict[str, str]],
+        priority: int,
+        default_model: str,
+        hedge_model: str,
+        deadline: float,
+        metadata: Dict,
+    ) -> UpstreamAttempt:
+        tasks: Dict[asyncio.Task, UpstreamAttempt] = {
+            asyncio.create_task(primary.open(messages, priority)): primary
+        }
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=deadline)
+            if done:
+                task = done.pop()
+                del tasks[task]
+                error = task.exception()
+                if error is None:
+                    metadata["hedge"] = "not_needed"
+                    return task.result()
+                if not is_endpoint_failure(error):
+                    raise error
+                reason = "failover"
+            else:
+                reason = "fired"
+
+            hedge = self._hedge_attempt(primary, default_model, hedge_model)
+            if hedge is None:
+                metadata["hedge"] = "unavailable"
+                if reason == "failover":
+                    raise error
+                # 取消会经由 await 传给 primary 任务
+                return await tasks.popitem()[0]
+
+            metadata["hedge"] = reason
+            metadata["hedge_endpoint"] = hedge.endpoint.name
+            logger.info(
+                f"Hedging upstream request on {hedge.endpoint.name} ({hedge.model}), "
+                f"primary {primary.endpoint.name}: {reason}"
+            )
+            tasks[asyncio.create_task(hedge.open(messages))] = hedge
+
+            winner, errors = None, []
+            while tasks and winner is None:
+                done, _ = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    attempt = tasks.pop(task)
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                    elif winner is None:
+                        winner = attempt
+                    else:
+                        # 两个同时完成, 后一个直接释放
+                        await attempt.close()
+            if winner is None:
+                raise errors[-1]
+            metadata["hedge_winner"] = "hedge" if winner is hedge else "primary"
+            return winner
+        finally:
+            # 输家 (以及外部取消时的所有请求) 取消后在 open() 中自行关闭
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+                # 尚未开始运行就被取消的任务不会执行 open(), 在这里归还并发名额
+                for attempt in tasks.values():
+                    await attempt.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "routing": self.routing,
+            "endpoints": [endpoint.stats() for endpoint in self.endpoints],
+        }
+
+    async def aclose(self):
+        for endpoint in self.endpoints:
+            await endpoint.client.close()
+
+
+def load_endpoints() -> List[UpstreamEndpoint]:
+    if not UPSTREAM_ENDPOINTS:
+        return [UpstreamEndpoint(base_url=BASE_URL, api_key=API_KEY, name="default")]
+    configs = json.loads(UPSTREAM_ENDPOINTS)
+    return [
+        UpstreamEndpoint(
+            base_url=config["base_url"],
+            api_key=config.get("api_key") or API_KEY,
+            name=config.get("name"),
+            weight=config.get("weight", 1.0),
+            model=config.get("model"),
+            max_in_flight=config.get("max_in_flight", UPSTREAM_MAX_IN_FLIGHT),
+        )
+        for config in configs
+    ]
+
+
+@lru_cache
+def get_upstream_pool() -> UpstreamPool:
+    return UpstreamPool(load_endpoints(), routing=UPSTREAM_ROUTING)
@@ -1,11 +1,87 @@
-import json
+import asyncio
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
+from enum import Enum, IntEnum
 from functools import lru_cache
-from typing import Any, Dict, List, Optional
+from typing import (Any, AsyncGenerator, Awaitable, Callable, Dict, List,
+                    Optional)
 from uuid import uuid4
 
+from loguru import logger
+from redis.exceptions import ResponseError
+
+from prompt_agent.configs import (API_KEY_CACHE_MAX_SIZE,
+                                  API_KEY_CACHE_TTL_SECONDS,
+                                  API_KEY_INVALIDATION_CHANNEL)
 from prompt_agent.redis_manager.base_redis_manager import BaseRedisManager
+from prompt_agent.redis_manager.lua_scripts import (ADMIT_API_KEY_SCRIPT,
+                                                    DEBIT_USAGE_SCRIPT,
+                                                    DELETE_API_KEY_SCRIPT,
+                                                    MIGRATE_API_KEY_SCRIPT)
+from prompt_agent.schemas import APIKeyType
+from prompt_agent.utils.ttl_cache import TTLCache
+
+# apikey:{key}:info 是一个 hash, 计数器也保存在其中, 通过 HINCRBY 更新
+KEY_INFO_INT_FIELDS = (
+    "created_at",
+    "expiration_seconds",
+    "usage_limit",
+    "activated_at",
+    "deleted_at",
+    "total_usage",
+    "current_period_usage",
+    "last_refresh_time",
+    "burst_limit",
+)
+KEY_INFO_BOOL_FIELDS = ("activated", "deleted")
+KEY_INFO_STR_FIELDS = ("rate_limit_strategy", "quota_unit", "key_type")
+# 对外暴露的基本信息字段 (计数器由 usage_info 提供)
+KEY_INFO_BASE_FIELDS = (
+    "created_at",
+    "expiration_seconds",
+    "usage_limit",
+    "activated",
+    "activated_at",
+    "deleted",
+    "deleted_at",
+    "rate_limit_strategy",
+    "burst_limit",
+    "quota_unit",
+    "key_type",
+)
+
+
+class AdmissionStatus(IntEnum):
+    """准入脚本的返回状态"""
+
+    NOT_FOUND = 0
+    DELETED = -1
+    EXPIRED = -2
+    USAGE_LIMITED = -3
+    BURST_LIMITED = -4
+    OK = 1
+
+
+class RateLimitStrategy(str, Enum):
+    """限流策略, 按 key 配置"""
+
+    FIXED_WINDOW = "fixed_window"
+    SLIDING_WINDOW = "sliding_window"
+    TOKEN_BUCKET = "token_bucket"
+
+
+class QuotaUnit(str, Enum):
+    """额度计量单位: 按请求次数或按 token 数 (输入 + 输出)"""
+
+    REQUESTS = "requests"
+    TOKENS = "tokens"
+
+
+class APIKeyStatus(str, Enum):
+    ACTIVE = "active"
+    INACTIVE = "inactive"
+    EXPIRED = "expired"
+    DELETED = "deleted"
 
 
 class APIKeyManager(BaseRedisManager):
@@ -16,39 +92,153 @@ class APIKeyManager(BaseRedisManager):
         self.REFRESH_INTERVAL_SECONDS = self.REFRESH_INTERVAL_HOURS * 3600
         # 默认使用次数限制
         self.DEFAULT_USAGE_LIMIT = 100
+        # 默认限流策略与每秒突发上限 (0 表示不限制)
+        self.DEFAULT_RATE_LIMIT_STRATEGY = RateLimitStrategy.FIXED_WINDOW
+        self.DEFAULT_BURST_LIMIT = 0
+        # 默认按请求次数计量
+        self.DEFAULT_QUOTA_UNIT = QuotaUnit.REQUESTS
+        # key 类型决定上游排队时的优先级, 与 CreateAPIKeyRequest 的默认值一致
+        self.DEFAULT_KEY_TYPE = APIKeyType.PLUS
+        if not hasattr(self, "_admit_script"):
+            self._admit_script = None
+            self._debit_script = None
+            self._migrate_script = None
+            self._delete_script = None
+            # 进程内缓存 key 的不可变部分: 是否存在/删除、激活时间、过期时长、限额
+            self._validity_cache = TTLCache(
+                maxsize=API_KEY_CACHE_MAX_SIZE, ttl=API_KEY_CACHE_TTL_SECONDS
+            )
+            self._invalidation_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _info_key(api_key: str) -> str:
+        return f"apikey:{api_key}:info"
 
     async def create_api_key(
-        self, expiration_seconds: int, usage_limit: Optional[int] = None
+        self,
+        expiration_seconds: int,
+        usage_limit: Optional[int] = None,
+        rate_limit_strategy: Optional[RateLimitStrategy] = None,
+        burst_limit: Optional[int] = None,
+        quota_unit: Optional[QuotaUnit] = None,
+        key_type: Optional[APIKeyType] = None,
     ) -> str:
         """创建新的API key"""
-        api_key = f"sj-{str(uuid4()).replace('-', '')}"
+        api_key = self._generate_api_key()
+        key_info = self._new_key_info(
+            expiration_seconds,
+            usage_limit,
+            rate_limit_strategy,
+            burst_limit,
+            quota_unit,
+            key_type,
+        )
+
+        redis_client = await self.get_aioredis()
+        await redis_client.hset(self._info_key(api_key), mapping=key_info)
+
+        return api_key
 
+    async def create_api_keys(
+        self,
+        count: int,
+        expiration_seconds: int,
+        usage_limit: Optional[int] = None,
+        rate_limit_strategy: Optional[RateLimitStrategy] = None,
+        burst_limit: Optional[int] = None,
+        quota_unit: Optional[QuotaUnit] = None,
+        key_type: Optional[APIKeyType] = None,
+        batch_size: int = 1000,
+    ) -> List[str]:
+        """批量创建API key"""
+        api_keys = []
+        async for batch in self.iter_create_api_keys(
+            count,
+            expiration_seconds,
+            usage_limit,
+            rate_limit_strategy,
+            burst_limit,
+            quota_unit,
+            key_type,
+            batch_size,
+        ):
+            api_keys.extend(batch)
+        return api_keys
+
+    async def iter_create_api_keys(
+        self,
+        count: int,
+        expiration_seconds: int,
+        usage_limit: Optional[int] = None,
+        rate_limit_strategy: Optional[RateLimitStrategy] = None,
+        burst_limit: Optional[int] = None,
+        quota_unit: Optional[QuotaUnit] = None,
+        key_type: Optional[APIKeyType] = None,
+        batch_size: int = 1000,
+    ) -> AsyncGenerator[List[str], None]:
+        """分批创建API key, 每批通过一个 MULTI pipeline 写入, 写入后立即产出该批的 key"""
+        redis_client = await self.get_aioredis()
+        key_info = self._new_key_info(
+            expiration_seconds,
+            usage_limit,
+            rate_limit_strategy,
+            burst_limit,
+            quota_unit,
+            key_type,
+        )
+
+        remaining = count
+        while remaining > 0:
+            batch = [self._generate_api_key() for _ in range(min(batch_size, remaining))]
+            async with redis_client.pipeline(transaction=True) as pipe:
+                for api_key in batch:
+                    pipe.hset(self._info_key(api_key), mapping=key_info)
+                await pipe.execute()
+            remaining -= len(batch)
+            yield batch
+
+    @staticmethod
+    def _generate_api_key() -> str:
+        return f"sj-{str(uuid4()).replace('-', '')}"
+
+    def _new_key_info(
+        self,
+        expiration_seconds: int,
+        usage_limit: Optional[int] = None,
+        rate_limit_strategy: Optional[RateLimitStrategy] = None,
+        burst_limit: Optional[int] = None,
+        quota_unit: Optional[QuotaUnit] = None,
+        key_type: Optional[APIKeyType] = None,
+    ) -> Dict[str, Any]:
         if usage_limit is None:
             usage_limit = self.DEFAULT_USAGE_LIMIT
+        if rate_limit_strategy is None:
+            rate_limit_strategy = self.DEFAULT_RATE_LIMIT_STRATEGY
+        if burst_limit is None:
+            burst_limit = self.DEFAULT_BURST_LIMIT
+        if quota_unit is None:
+            quota_unit = self.DEFAULT_QUOTA_UNIT
+        if key_type is None:
+            key_type = self.DEFAULT_KEY_TYPE
 
         current_timestamp = int(time.time())
 
-        # 存储API key的基本信息
-        key_info = {
+        # 基本信息与计数器存储在同一个 hash 中, 一条 HSET 完成创建
+        return {
             "created_at": current_timestamp,
             "expiration_seconds": expiration_seconds,
             "usage_limit": usage_limit,
-            "activated": False,  # 懒激活标志
-            "activated_at": None,
-            "deleted": False,  # 逻辑删除标志
-            "deleted_at": None,
+            "rate_limit_strategy": RateLimitStrategy(rate_limit_strategy).value,
+            "burst_limit": burst_limit,
+            "quota_unit": QuotaUnit(quota_unit).value,
+            "key_type": APIKeyType(key_type).value,
+            "activated": 0,  # 懒激活标志
+            "deleted": 0,  # 逻辑删除标志
+            "total_usage": 0,
+            "current_period_usage": 0,
+            "last_refresh_time": current_timestamp,
         }
 
-        # 存储API key信息
-        await self.set_async(f"apikey:{api_key}:info", json.dumps(key_info))
-
-        # 初始化使用次数
-        await self.set_async(f"apikey:{api_key}:total_usage", 0)
-        await self.set_async(f"apikey:{api_key}:current_period_usage", 0)
-        await self.set_async(f"apikey:{api_key}:last_refresh_time", current_timestamp)
-
-        return api_key
-
     async def activate_api_key(self, api_key: str) -> Dict[str, Any]:
         """激活API key（懒激活）"""
         key_info = await self._get_key_info(api_key)
@@ -70,12 +260,15 @@ class APIKeyManager(BaseRedisManager):
                 "expires_at": (activated_at or 0) + (expiration_seconds or 0),
             }
 
-        # 激活API key
+        # 激活API key, HSETNX 保证并发激活时 activated_at 只写入一次
         current_timestamp = int(time.time())
-        key_info["activated"] = True
-        key_info["activated_at"] = current_timestamp
-
-        await self.set_async(f"apikey:{api_key}:info", json.dumps(key_info))
+        redis_client = await self.get_aioredis()
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.hsetnx(self._info_key(api_key), "activated_at", current_timestamp)
+            pipe.hset(self._info_key(api_key), "activated", 1)
+            await pipe.execute()
+        # 缓存中可能是激活前的信息 (没有 activated_at), 不会检查过期
+        self._validity_cache.pop(api_key)
 
         expires_at = current_timestamp + key_info["expiration_seconds"]
         return {
@@ -87,66 +280,258 @@ class APIKeyManager(BaseRedisManager):
 
     async def is_api_key_valid(self, api_key: str) -> bool:
         """检查API key是否有效"""
-        key_info = await self._get_key_info(api_key)
-        if not key_info or key_info.get("deleted"):
+        key_info = self._validity_cache.get(api_key)
+        if key_info is None:
+            key_info = await self._get_key_info(api_key) or {"exists": False}
+            self._cache_validity(api_key, key_info)
+        if key_info.get("exists") is False or key_info.get("deleted"):
             return False
 
-        if not key_info.get("activated"):
+        # 以 activated_at 判断是否已激活: 准入时写入的缓存项没有 activated 标志
+        activated_at = key_info.get("activated_at")
+        if not activated_at:
             return True  # 未激活但存在的key是有效的
 
         # 检查是否过期
-        activated_at = key_info.get("activated_at")
-        expiration_seconds = key_info.get("expiration_seconds")
-        if activated_at and int(time.time()) > activated_at + expiration_seconds:
+        expiration_seconds = key_info.get("expiration_seconds") or 0
+        if int(time.time()) > activated_at + expiration_seconds:
             return False
 
         return True
 
     async def increment_usage(self, api_key: str) -> Dict[str, Any]:
         """增加使用次数"""
-        # 首先激活API key（如果未激活）
-        activation_result = await self.activate_api_key(api_key)
-        if not activation_result["success"]:
-            return activation_result
-
-        # 检查使用次数限制
-        limit_check = await self._check_usage_limit(api_key)
-        if not limit_check["can_use"]:
+        return await self.admit_api_key(api_key)
+
+    async def admit_api_key(
+        self, api_key: str, input_tokens: int = 0
+    ) -> Dict[str, Any]:
+        """
+        原子准入: 校验、懒激活、限流策略、突发上限检查与计数在一个 Lua 脚本中完成,
+        只需一次往返, 并发请求也不会突破 usage_limit。
+
+        按 token 计量的 key 在准入时扣减 input_tokens, 输出部分由 debit_usage 事后扣减。
+        """
+        now = time.time()
+        current_timestamp = int(now)
+
+        # 本地缓存已知不可用的 key 直接拒绝, 不访问 Redis
+        rejection = self._cached_rejection(api_key, current_timestamp)
+        if rejection is not None:
+            return rejection
+
+        redis_client = await self.get_aioredis()
+        if self._admit_script is None:
+            self._admit_script = redis_client.register_script(ADMIT_API_KEY_SCRIPT)
+
+        result = await self._with_legacy_migration(
+            api_key,
+            lambda: self._admit_script(
+                keys=[self._info_key(api_key)],
+                args=[
+                    repr(now),
+                    self.REFRESH_INTERVAL_SECONDS,
+                    self.DEFAULT_USAGE_LIMIT,
+                    RateLimitStrategy(self.DEFAULT_RATE_LIMIT_STRATEGY).value,
+                    self.DEFAULT_BURST_LIMIT,
+                    max(0, int(input_tokens)),
+                    self.DEFAULT_KEY_TYPE.value,
+                ],
+            ),
+        )
+        status = AdmissionStatus(int(result[0]))
+
+        if status == AdmissionStatus.NOT_FOUND:
+            self._cache_validity(api_key, {"exists": False})
+            return self._rejection(status)
+        if status == AdmissionStatus.DELETED:
+            self._cache_validity(api_key, {"deleted": True})
+            return self._rejection(status)
+
+        (
+            total_usage,
+            current_period_usage,
+            usage_limit,
+            last_refresh_time,
+            activated_at,
+            expiration_seconds,
+            next_reset_time,
+        ) = (int(value) for value in result[1:8])
+        quota_unit = result[8] if len(result) > 8 else QuotaUnit.REQUESTS.value
+        key_type = result[9] if len(result) > 9 else self.DEFAULT_KEY_TYPE.value
+        self._cache_validity(
+            api_key,
+            {
+                "activated_at": activated_at,
+                "expiration_seconds": expiration_seconds,
+                "usage_limit": usage_limit,
+            },
+        )
+
+        if status == AdmissionStatus.EXPIRED:
+            return self._rejection(status, expires_at=activated_at + expiration_seconds)
+
+        usage_info = {
+            "total_usage": total_usage,
+            "current_period_usage": current_period_usage,
+            "usage_limit": usage_limit,
+            "last_refresh_time": last_refresh_time,
+            "next_reset_time": next_reset_time,
+            "time_until_reset": max(0, next_reset_time - current_timestamp),
+            "quota_unit": quota_unit,
+            "key_type": key_type,
+        }
+
+        if status == AdmissionStatus.USAGE_LIMITED:
+            reset_time_str = datetime.fromtimestamp(next_reset_time).strftime(
+                "%Y-%m-%d %H:%M:%S"
+            )
+            quota_name = "Token 用量" if quota_unit == QuotaUnit.TOKENS.value else "使用次数"
             return {
                 "success": False,
-                "message": f"使用次数已达限制，请等待重置。{limit_check.get('message', '')}",
+                "status": status,
+                "message": f"{quota_name}已达限制({current_period_usage}/{usage_limit})，将在 {reset_time_str} 重置",
+                "usage_info": usage_info,
             }
+        if status == AdmissionStatus.BURST_LIMITED:
+            return {
+                "success": False,
+                "status": status,
+                "message": "请求过于频繁，请稍后重试",
+                "usage_info": usage_info,
+            }
+
+        return {
+            "success": True,
+            "status": status,
+            "message": "使用次数已更新",
+            "usage_info": usage_info,
+        }
+
+    async def debit_usage(self, api_key: str, tokens: int) -> bool:
+        """
+        请求结束后扣减输出 token, 只对按 token 计量的 key 生效。
+        额度可能因此被透支, 透支部分会推迟下一次准入。
+        """
+        if tokens <= 0:
+            return False
+        redis_client = await self.get_aioredis()
+        if self._debit_script is None:
+            self._debit_script = redis_client.register_script(DEBIT_USAGE_SCRIPT)
+        result = await self._with_legacy_migration(
+            api_key,
+            lambda: self._debit_script(
+                keys=[self._info_key(api_key)], args=[int(tokens)]
+            ),
+        )
+        return int(result) == 1
+
+    @staticmethod
+    def _rejection(status: AdmissionStatus, **extra) -> Dict[str, Any]:
+        messages = {
+            AdmissionStatus.NOT_FOUND: "API key不存在",
+            AdmissionStatus.DELETED: "API key已被删除",
+            AdmissionStatus.EXPIRED: "API key已过期",
+        }
+        return {"success": False, "status": status, "message": messages[status], **extra}
+
+    def _cached_rejection(self, api_key: str, now: int) -> Optional[Dict[str, Any]]:
+        """根据本地缓存判断 key 是否一定不可用; 无法确定时返回 None"""
+        key_info = self._validity_cache.get(api_key)
+        if key_info is None:
+            return None
+        if key_info.get("exists") is False:
+            return self._rejection(AdmissionStatus.NOT_FOUND)
+        if key_info.get("deleted"):
+            return self._rejection(AdmissionStatus.DELETED)
+        activated_at = key_info.get("activated_at")
+        if activated_at:
+            expires_at = activated_at + (key_info.get("expiration_seconds") or 0)
+            if now > expires_at:
+                return self._rejection(AdmissionStatus.EXPIRED, expires_at=expires_at)
+        return None
+
+    def _cache_validity(self, api_key: str, key_info: Dict[str, Any]):
+        self._validity_cache.set(
+            api_key,
+            {
+                "exists": key_info.get("exists", True),
+                "deleted": key_info.get("deleted", False),
+                "activated": bool(
+                    key_info.get("activated") or key_info.get("activated_at")
+                ),
+                "activated_at": key_info.get("activated_at"),
+                "expiration_seconds": key_info.get("expiration_seconds"),
+                "usage_limit": key_info.get("usage_limit"),
+            },
+        )
+
+    async def invalidate_cached_api_key(self, api_key: str):
+        """本地失效并通知其他 worker"""
+        self._validity_cache.pop(api_key)
+        redis_client = await self.get_aioredis()
+        await redis_client.publish(API_KEY_INVALIDATION_CHANNEL, api_key)
 
-        # 增加使用次数
-        await self._increment_usage_counters(api_key)
+    async def start_invalidation_listener(self):
+        """启动 pub/sub 监听, 在其他 worker 更新/删除 key 时失效本地缓存"""
+        if self._invalidation_task is None or self._invalidation_task.done():
+            self._invalidation_task = asyncio.create_task(
+                self._listen_for_invalidations()
+            )
 
-        usage_info = await self.get_usage_info(api_key)
-        return {"success": True, "message": "使用次数已更新", "usage_info": usage_info}
+    async def stop_invalidation_listener(self):
+        if self._invalidation_task is not None:
+            self._invalidation_task.cancel()
+            try:
+                await self._invalidation_task
+            except asyncio.CancelledError:
+                pass
+            self._invalidation_task = None
+
+    async def _listen_for_invalidations(self):
+        while True:
+            pubsub = None
+            try:
+                redis_client = await self.get_aioredis()
+                pubsub = redis_client.pubsub()
+                await pubsub.subscribe(API_KEY_INVALIDATION_CHANNEL)
+                # 订阅建立之前的失效消息可能已经丢失
+                self._validity_cache.clear()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._validity_cache.pop(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"API key invalidation listener error: {str(e)}")
+                self._validity_cache.clear()
+                await asyncio.sleep(1)
+            finally:
+                if pubsub is not None:
+                    await pubsub.aclose()
 
     async def get_usage_info(self, api_key: str) -> Dict[str, Any]:
         """获取使用信息"""
         key_info = await self._get_key_info(api_key)
         if not key_info:
             return {}
+        return self._build_usage_info(key_info)
 
-        total_usage = int(await self.decoded_get(f"apikey:{api_key}:total_usage") or 0)
-        current_period_usage = int(
-            await self.decoded_get(f"apikey:{api_key}:current_period_usage") or 0
-        )
-        last_refresh_time = int(
-            await self.decoded_get(f"apikey:{api_key}:last_refresh_time") or 0
-        )
+    def _build_usage_info(self, key_info: Dict[str, Any]) -> Dict[str, Any]:
+        """由 hash 中的计数器构造使用信息"""
+        last_refresh_time = key_info.get("last_refresh_time") or 0
 
         # 计算下次重置时间
         next_reset_time = last_refresh_time + self.REFRESH_INTERVAL_SECONDS
 
         return {
-            "total_usage": total_usage,
-            "current_period_usage": current_period_usage,
+            "total_usage": key_info.get("total_usage") or 0,
+            "current_period_usage": key_info.get("current_period_usage") or 0,
             "usage_limit": key_info.get("usage_limit"),
             "last_refresh_time": last_refresh_time,
             "next_reset_time": next_reset_time,
             "time_until_reset": max(0, next_reset_time - int(time.time())),
+            "quota_unit": key_info.get("quota_unit"),
         }
 
     async def get_api_key_info(self, api_key: str) -> Dict[str, Any]:
@@ -155,24 +540,27 @@ class APIKeyManager(BaseRedisManager):
         if not key_info:
             return {}
 
-        usage_info = await self.get_usage_info(api_key)
-
-        result = {**key_info, **usage_info}
+        result = {field: key_info.get(field) for field in KEY_INFO_BASE_FIELDS}
+        result.update(self._build_usage_info(key_info))
 
         # 添加状态信息
-        if key_info.get("deleted"):
-            result["status"] = "deleted"
-        elif not key_info.get("activated"):
-            result["status"] = "inactive"
-        elif key_info.get("activated_at") and int(time.time()) > key_info.get(
-            "activated_at", 0
-        ) + key_info.get("expiration_seconds", 0):
-            result["status"] = "expired"
-        else:
-            result["status"] = "active"
+        result["status"] = self._compute_status(key_info, int(time.time())).value
 
         return result
 
+    @staticmethod
+    def _compute_status(key_info: Dict[str, Any], now: int) -> APIKeyStatus:
+        if key_info.get("deleted"):
+            return APIKeyStatus.DELETED
+        if not key_info.get("activated"):
+            return APIKeyStatus.INACTIVE
+        activated_at = key_info.get("activated_at")
+        if activated_at and now > activated_at + (
+            key_info.get("expiration_seconds") or 0
+        ):
+            return APIKeyStatus.EXPIRED
+        return APIKeyStatus.ACTIVE
+
     async def update_api_key(self, api_key: str, **kwargs) -> Dict[str, Any]:
         """更新API key信息"""
         key_info = await self._get_key_info(api_key)
@@ -183,112 +571,272 @@ class APIKeyManager(BaseRedisManager):
             return {"success": False, "message": "API key已被删除"}
 
         # 允许更新的字段
-        allowed_fields = ["expiration_seconds", "usage_limit"]
+        allowed_fields = [
+            "expiration_seconds",
+            "usage_limit",
+            "rate_limit_strategy",
+            "burst_limit",
+            "quota_unit",
+            "key_type",
+        ]
         updated = False
 
+        updates = {}
         for field, value in kwargs.items():
             if field in allowed_fields:
-                key_info[field] = value
+                if field == "rate_limit_strategy":
+                    value = RateLimitStrategy(value).value
+                elif field == "quota_unit":
+                    value = QuotaUnit(value).value
+                elif field == "key_type":
+                    value = APIKeyType(value).value
+                updates[field] = value
                 updated = True
 
         if updated:
-            await self.set_async(f"apikey:{api_key}:info", json.dumps(key_info))
+            redis_client = await self.get_aioredis()
+            await redis_client.hset(self._info_key(api_key), mapping=updates)
+            await self.invalidate_cached_api_key(api_key)
             return {"success": True, "message": "API key更新成功"}
         else:
             return {"success": False, "message": "没有有效的更新字段"}
 
     async def delete_api_key(self, api_key: str) -> Dict[str, Any]:
         """逻辑删除API key"""
-        key_info = await self._get_key_info(api_key)
-        if not key_info:
-            return {"success": False, "message": "API key不存在"}
+        redis_client = await self.get_aioredis()
+        script = self._get_delete_script(redis_client)
+        result = await self._with_legacy_migration(
+            api_key,
+            lambda: script(
+                keys=[self._info_key(api_key)],
+                args=self._delete_script_args(api_key),
+            ),
+        )
+        return self._delete_result(api_key, result)
 
-        if key_info.get("deleted"):
+    async def delete_api_keys(
+        self, api_keys: List[str], batch_size: int = 1000
+    ) -> List[Dict[str, Any]]:
+        """批量逻辑删除API key, 每批通过一个 pipeline 执行删除脚本"""
+        redis_client = await self.get_aioredis()
+        script = self._get_delete_script(redis_client)
+        results = []
+
+        for start in range(0, len(api_keys), batch_size):
+            batch = api_keys[start : start + batch_size]
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for api_key in batch:
+                    await script(
+                        keys=[self._info_key(api_key)],
+                        args=self._delete_script_args(api_key),
+                        client=pipe,
+                    )
+                batch_results = await pipe.execute(raise_on_error=False)
+
+            for api_key, result in zip(batch, batch_results):
+                if isinstance(result, Exception):
+                    # 旧布局的 key 等异常情况回退到单个删除
+                    result = await self.delete_api_key(api_key)
+                else:
+                    result = self._delete_result(api_key, result)
+                results.append({"api_key": api_key, "result": result})
+
+        return results
+
+    def _get_delete_script(self, redis_client):
+        if self._delete_script is None:
+            self._delete_script = redis_client.register_script(DELETE_API_KEY_SCRIPT)
+        return self._delete_script
+
+    @staticmethod
+    def _delete_script_args(api_key: str) -> List[Any]:
+        return [int(time.time()), API_KEY_INVALIDATION_CHANNEL, api_key]
+
+    def _delete_result(self, api_key: str, result: int) -> Dict[str, Any]:
+        result = int(result)
+        if result == 0:
+            return {"success": False, "message": "API key不存在"}
+        if result == -1:
             return {"success": False, "message": "API key已被删除"}
 
-        # 逻辑删除
-        key_info["deleted"] = True
-        key_info["deleted_at"] = int(time.time())
-
-        await self.set_async(f"apikey:{api_key}:info", json.dumps(key_info))
-
+        # 删除脚本已发布失效消息, 这里只需立即清理本地缓存
+        self._validity_cache.pop(api_key)
         return {"success": True, "message": "API key删除成功"}
 
     async def list_api_keys(
-        self, include_deleted: bool = False
+        self, include_deleted: bool = False, status: Optional[APIKeyStatus] = None
     ) -> List[Dict[str, Any]]:
-        """列出所有API keys"""
+        """列出所有API keys (逐页 SCAN, 不会阻塞 Redis)"""
+        result = []
+        cursor = 0
+        while True:
+            page = await self.scan_api_keys(
+                cursor=cursor, status=status, include_deleted=include_deleted
+            )
+            result.extend(page["api_keys"])
+            cursor = page["next_cursor"]
+            if cursor == 0:
+                return result
+
+    async def scan_api_keys(
+        self,
+        cursor: int = 0,
+        page_size: int = 100,
+        status: Optional[APIKeyStatus] = None,
+        include_deleted: bool = False,
+        max_batches: int = 10,
+    ) -> Dict[str, Any]:
+        """
+        基于 SCAN 游标的服务端分页, 每批 key 的信息通过一个 pipeline 取回。
+
+        SCAN 的批次不会被拆开, 所以一页的数量可能略多于 page_size;
+        过滤条件很少命中时, 一次调用最多执行 max_batches 次 SCAN, 之后带着
+        当前游标返回不足一页 (甚至为空) 的结果, 由调用方继续翻页。
+        返回的 next_cursor 为 0 时表示已遍历完成。
+        """
         redis_client = await self.get_aioredis()
-        keys = await redis_client.keys("apikey:*:info")
-
+        now = int(time.time())
         result = []
-        for key in keys:
-            api_key = key.split(":")[1]
-            key_info = await self.get_api_key_info(api_key)
-
-            if key_info and (include_deleted or not key_info.get("deleted")):
-                key_info["api_key"] = api_key
-                result.append(key_info)
-
-        return result
 
-    async def _get_key_info(self, api_key: str) -> Optional[Dict[str, Any]]:
-        """获取API key的基本信息"""
-        info_str = await self.decoded_get(f"apikey:{api_key}:info")
-        if not info_str:
-            return None
-
-        try:
-            return json.loads(info_str)
-        except json.JSONDecodeError:
-            return None
-
-    async def _check_usage_limit(self, api_key: str) -> Dict[str, Any]:
-        """检查使用次数限制"""
-        key_info = await self._get_key_info(api_key)
-        if not key_info:
-            return {"can_use": False, "message": "API key不存在"}
-
-        current_timestamp = int(time.time())
-        last_refresh_time = int(
-            await self.decoded_get(f"apikey:{api_key}:last_refresh_time") or 0
-        )
-
-        # 检查是否需要重置计数器
-        if current_timestamp >= last_refresh_time + self.REFRESH_INTERVAL_SECONDS:
-            await self._reset_period_usage(api_key, current_timestamp)
-            return {"can_use": True, "message": "使用次数已重置"}
-
-        # 检查当前周期使用次数
-        current_period_usage = int(
-            await self.decoded_get(f"apikey:{api_key}:current_period_usage") or 0
+        for _ in range(max(1, max_batches)):
+            cursor, keys = await redis_client.scan(
+                cursor=cursor, match="apikey:*:info", count=page_size
+            )
+            if keys:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.hgetall(key)
+                    raw_infos = await pipe.execute(raise_on_error=False)
+
+                for key, raw_info in zip(keys, raw_infos):
+                    if isinstance(raw_info, Exception):
+                        logger.warning(f"Skip unreadable API key entry {key}: {raw_info}")
+                        continue
+                    if not raw_info:
+                        continue
+
+                    key_info = self._decode_key_info(raw_info)
+                    key_status = self._compute_status(key_info, now)
+                    if status is not None:
+                        if key_status != status:
+                            continue
+                    elif key_status == APIKeyStatus.DELETED and not include_deleted:
+                        continue
+
+                    item = {field: key_info.get(field) for field in KEY_INFO_BASE_FIELDS}
+                    item.update(self._build_usage_info(key_info))
+                    item["status"] = key_status.value
+                    item["api_key"] = key.split(":")[1]
+                    result.append(item)
+
+            if cursor == 0 or len(result) >= page_size:
+                break
+
+        return {"api_keys": result, "next_cursor": int(cursor)}
+
+    async def migrate_legacy_api_keys(self, batch_size: int = 500) -> Dict[str, int]:
+        """将旧布局 (JSON 字符串 + 三个计数器字符串) 的 key 原地迁移为 hash"""
+        redis_client = await self.get_aioredis()
+        stats = {"migrated": 0, "skipped": 0, "corrupted": 0}
+
+        batch = []
+        async for key in redis_client.scan_iter(match="apikey:*:info", count=batch_size):
+            batch.append(key.split(":")[1])
+            if len(batch) >= batch_size:
+                await self._migrate_batch(batch, stats)
+                batch = []
+        if batch:
+            await self._migrate_batch(batch, stats)
+
+        logger.info(f"API key hash migration finished: {stats}")
+        return stats
+
+    async def migrate_api_key(self, api_key: str) -> int:
+        """迁移单个旧布局的 key, 返回 1 已迁移, 0 无需迁移, -1 数据损坏"""
+        redis_client = await self.get_aioredis()
+        return int(
+            await self._get_migrate_script(redis_client)(
+                keys=self._legacy_keys(api_key)
+            )
         )
-        usage_limit = key_info.get("usage_limit", self.DEFAULT_USAGE_LIMIT)
 
-        if current_period_usage >= usage_limit:
-            next_reset_time = last_refresh_time + self.REFRESH_INTERVAL_SECONDS
-            time_until_reset = next_reset_time - current_timestamp
-            reset_time_str = datetime.fromtimestamp(next_reset_time).strftime(
-                "%Y-%m-%d %H:%M:%S"
+    async def _migrate_batch(self, api_keys: List[str], stats: Dict[str, int]):
+        redis_client = await self.get_aioredis()
+        script = self._get_migrate_script(redis_client)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for api_key in api_keys:
+                await script(keys=self._legacy_keys(api_key), client=pipe)
+            results = await pipe.execute()
+
+        for result in results:
+            if result == 1:
+                stats["migrated"] += 1
+            elif result == 0:
+                stats["skipped"] += 1
+            else:
+                stats["corrupted"] += 1
+
+    def _get_migrate_script(self, redis_client):
+        if self._migrate_script is None:
+            self._migrate_script = redis_client.register_script(
+                MIGRATE_API_KEY_SCRIPT
             )
+        return self._migrate_script
+
+    def _legacy_keys(self, api_key: str) -> List[str]:
+        return [
+            self._info_key(api_key),
+            f"apikey:{api_key}:total_usage",
+            f"apikey:{api_key}:current_period_usage",
+            f"apikey:{api_key}:last_refresh_time",
+        ]
+
+    async def _with_legacy_migration(
+        self, api_key: str, operation: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """遇到尚未迁移的旧布局 key (WRONGTYPE) 时先就地迁移再重试一次"""
+        try:
+            return await operation()
+        except ResponseError as e:
+            if "WRONGTYPE" not in str(e):
+                raise
+            logger.warning(f"Migrating legacy API key layout for {api_key[:10]}...")
+            await self.migrate_api_key(api_key)
+            return await operation()
 
-            return {
-                "can_use": False,
-                "message": f"使用次数已达限制({current_period_usage}/{usage_limit})，将在 {reset_time_str} 重置",
-            }
-
-        return {"can_use": True}
-
-    async def _increment_usage_counters(self, api_key: str):
-        """增加使用计数器"""
+    async def _get_key_info(self, api_key: str) -> Optional[Dict[str, Any]]:
+        """获取API key的基本信息 (一次 HGETALL)"""
         redis_client = await self.get_aioredis()
-        await redis_client.incr(f"apikey:{api_key}:total_usage")
-        await redis_client.incr(f"apikey:{api_key}:current_period_usage")
-
-    async def _reset_period_usage(self, api_key: str, timestamp: int):
-        """重置周期使用次数"""
-        await self.set_async(f"apikey:{api_key}:current_period_usage", 0)
-        await self.set_async(f"apikey:{api_key}:last_refresh_time", timestamp)
+        raw_info = await self._with_legacy_migration(
+            api_key, lambda: redis_client.hgetall(self._info_key(api_key))
+        )
+        if not raw_info:
+            return None
+        return self._decode_key_info(raw_info)
+
+    def _decode_key_info(self, raw_info: Dict[str, str]) -> Dict[str, Any]:
+        """将 hash 中的字符串字段还原为对应类型"""
+        key_info: Dict[str, Any] = {}
+        for field in KEY_INFO_INT_FIELDS:
+            value = raw_info.get(field)
+            key_info[field] = int(value) if value not in (None, "") else None
+        for field in KEY_INFO_BOOL_FIELDS:
+            key_info[field] = raw_info.get(field) == "1"
+        for field in KEY_INFO_STR_FIELDS:
+            key_info[field] = raw_info.get(field)
+
+        # 早于限流策略字段创建的 key 使用默认配置
+        if key_info["rate_limit_strategy"] is None:
+            key_info["rate_limit_strategy"] = RateLimitStrategy(
+                self.DEFAULT_RATE_LIMIT_STRATEGY
+            ).value
+        if key_info["burst_limit"] is None:
+            key_info["burst_limit"] = self.DEFAULT_BURST_LIMIT
+        if key_info["quota_unit"] is None:
+            key_info["quota_unit"] = QuotaUnit.REQUESTS.value
+        if key_info["key_type"] is None:
+            key_info["key_type"] = self.DEFAULT_KEY_TYPE.value
+        return key_info
 
 
 @lru_cache()
@@ -0,0 +1,234 @@
+"""
+Lua scripts executed server side by the redis managers.
+
+All scripts are registered through ``redis.register_script`` so they are sent
+once and afterwards invoked by EVALSHA.
+"""
+
+# 准入脚本: 校验 + 懒激活 + 限流策略 + 每秒突发上限 + 计数, 一次往返且原子执行
+# 限流策略 (按 key 配置, 字段 rate_limit_strategy):
+#   fixed_window    固定窗口, 每个窗口最多 usage_limit 次
+#   sliding_window  滑动窗口计数器, 上一窗口的计数按剩余比例加权, 消除窗口边界的突发
+#   token_bucket    令牌桶, 容量 usage_limit, 每个窗口匀速补满
+# 计量单位 (字段 quota_unit): requests 每次请求计 1, tokens 按 ARGV[6] 扣减 (路由传 0,
+# 准入通过后再分词, 输入与输出 token 由 DEBIT_USAGE_SCRIPT 扣减); 只要额度未耗尽即可准入
+# KEYS[1] apikey:{key}:info (hash)
+# ARGV[1] 当前时间戳(秒, 可带小数)
+# ARGV[2] 窗口长度(秒)
+# ARGV[3] 默认使用次数限制
+# ARGV[4] 默认限流策略
+# ARGV[5] 默认每秒突发上限 (0 表示不限制)
+# ARGV[6] 本次请求的输入 token 数 (仅 quota_unit 为 tokens 时使用)
+# ARGV[7] 默认 key 类型 (决定上游排队优先级)
+# 返回 {status, total_usage, current_period_usage, usage_limit,
+#       last_refresh_time, activated_at, expiration_seconds, reset_at, quota_unit,
+#       key_type}
+ADMIT_API_KEY_SCRIPT = """
+local info = redis.call('HMGET', KEYS[1],
+    'created_at', 'deleted', 'activated', 'activated_at', 'expiration_seconds',
+    'usage_limit', 'total_usage', 'current_period_usage', 'last_refresh_time',
+    'rate_limit_strategy', 'burst_limit', 'burst_window', 'burst_count',
+    'previous_period_usage', 'bucket_tokens', 'bucket_updated_at', 'quota_unit',
+    'key_type')
+if not info[1] then
+    return {0}
+end
+if info[2] == '1' then
+    return {-1}
+end
+
+local now = tonumber(ARGV[1])
+local now_s = math.floor(now)
+local window = tonumber(ARGV[2])
+local expiration_seconds = tonumber(info[5]) or 0
+local usage_limit = tonumber(info[6]) or tonumber(ARGV[3])
+local strategy = info[10] or ARGV[4]
+local burst_limit = tonumber(info[11]) or tonumber(ARGV[5])
+local activated_at = tonumber(info[4])
+local total_usage = tonumber(info[7]) or 0
+local quota_unit = info[17] or 'requests'
+local key_type = info[18] or ARGV[7]
+local cost = 1
+if quota_unit == 'tokens' then
+    cost = math.max(0, tonumber(ARGV[6]) or 0)
+end
+
+if info[3] == '1' and activated_at then
+    if now_s > activated_at + expiration_seconds then
+        return {-2, total_usage, 0, usage_limit, 0, activated_at, expiration_seconds, 0,
+            quota_unit, key_type}
+    end
+else
+    activated_at = now_s
+    redis.call('HSET', KEYS[1], 'activated', 1, 'activated_at', now_s)
+end
+
+local period_usage = tonumber(info[8]) or 0
+local last_refresh = tonumber(info[9]) or now_s
+local available, reset_at, used, commit
+
+if strategy == 'token_bucket' then
+    local rate = usage_limit / window
+    local tokens = tonumber(info[15])
+    if tokens == nil then
+        tokens = usage_limit
+    else
+        local updated_at = tonumber(info[16]) or now
+        tokens = math.min(usage_limit, tokens + math.max(0, now - updated_at) * rate)
+    end
+    available = tokens
+    if tokens >= 1 then
+        tokens = tokens - cost
+        reset_at = now + (usage_limit - tokens) / rate
+    else
+        reset_at = now + (1 - tokens) / rate
+    end
+    last_refresh = now_s
+    used = usage_limit - tokens
+    if available < 1 then
+        used = used + cost
+    end
+    commit = function()
+        redis.call('HSET', KEYS[1], 'bucket_tokens', tokens, 'bucket_updated_at', now)
+    end
+elseif strategy == 'sliding_window' then
+    local previous = tonumber(info[14]) or 0
+    local elapsed = now_s - last_refresh
+    if elapsed >= window then
+        if elapsed >= 2 * window then
+            previous = 0
+        else
+            previous = period_usage
+        end
+        last_refresh = last_refresh + math.floor(elapsed / window) * window
+        period_usage = 0
+    end
+    local weight = 1 - (now - last_refresh) / window
+    local estimate = previous * weight + period_usage
+    available = usage_limit - estimate
+    reset_at = last_refresh + window
+    if available < 1 and previous > 0 then
+        -- 上一窗口的权重线性衰减, 估算可再次通过的时间
+        reset_at = math.min(reset_at, now + (1 - available) * window / previous)
+    end
+    used = estimate + cost
+    commit = function()
+        redis.call('HSET', KEYS[1], 'previous_period_usage', previous,
+            'current_period_usage', period_usage + cost, 'last_refresh_time', last_refresh)
+    end
+else
+    if now_s >= last_refresh + window then
+        period_usage = 0
+        last_refresh = now_s
+    end
+    available = usage_limit - period_usage
+    reset_at = last_refresh + window
+    used = period_usage + cost
+    commit = function()
+        redis.call('HSET', KEYS[1], 'current_period_usage', period_usage + cost,
+            'last_refresh_time', last_refresh)
+    end
+end
+
+local burst_count = tonumber(info[13]) or 0
+if tonumber(info[12]) ~= now_s then
+    burst_count = 0
+end
+if burst_limit > 0 and burst_count >= burst_limit then
+    return {-4, total_usage, math.ceil(used - cost), usage_limit, last_refresh,
+        activated_at, expiration_seconds, now_s + 1, quota_unit, key_type}
+end
+if available < 1 then
+    return {-3, total_usage, math.ceil(used - cost), usage_limit, last_refresh,
+        activated_at, expiration_seconds, math.ceil(reset_at), quota_unit, key_type}
+end
+
+commit()
+total_usage = redis.call('HINCRBY', KEYS[1], 'total_usage', cost)
+if burst_limit > 0 then
+    redis.call('HSET', KEYS[1], 'burst_window', now_s, 'burst_count', burst_count + 1)
+end
+return {1, total_usage, math.ceil(used), usage_limit, last_refresh,
+    activated_at, expiration_seconds, math.ceil(reset_at), quota_unit, key_type}
+"""
+
+# 事后扣减用量 (token 计量的输出部分), 只对 quota_unit 为 tokens 的 key 生效
+# KEYS[1] apikey:{key}:info (hash)
+# ARGV[1] 扣减的 token 数
+# 返回 1 已扣减, 0 无需扣减
+DEBIT_USAGE_SCRIPT = """
+local info = redis.call('HMGET', KEYS[1], 'created_at', 'quota_unit', 'rate_limit_strategy')
+if not info[1] or info[2] ~= 'tokens' then
+    return 0
+end
+local amount = math.max(0, tonumber(ARGV[1]) or 0)
+if info[3] == 'token_bucket' then
+    if redis.call('HEXISTS', KEYS[1], 'bucket_tokens') == 1 then
+        redis.call('HINCRBYFLOAT', KEYS[1], 'bucket_tokens', -amount)
+    end
+else
+    redis.call('HINCRBY', KEYS[1], 'current_period_usage', amount)
+end
+redis.call('HINCRBY', KEYS[1], 'total_usage', amount)
+return 1
+"""
+
+# 旧布局 (JSON 字符串 + 三个计数器字符串) 原地迁移为 hash
+# KEYS[1] apikey:{key}:info
+# KEYS[2] apikey:{key}:total_usage
+# KEYS[3] apikey:{key}:current_period_usage
+# KEYS[4] apikey:{key}:last_refresh_time
+# 返回 1 已迁移, 0 无需迁移, -1 数据损坏
+MIGRATE_API_KEY_SCRIPT = """
+if redis.call('TYPE', KEYS[1])['ok'] ~= 'string' then
+    return 0
+end
+local ok, info = pcall(cjson.decode, redis.call('GET', KEYS[1]))
+if not ok or type(info) ~= 'table' then
+    return -1
+end
+
+local mapping = {}
+local names = {'created_at', 'expiration_seconds', 'usage_limit', 'activated',
+               'activated_at', 'deleted', 'deleted_at'}
+for _, name in ipairs(names) do
+    local value = info[name]
+    if value == true then
+        value = 1
+    elseif value == false then
+        value = 0
+    end
+    if value ~= nil and value ~= cjson.null then
+        table.insert(mapping, name)
+        table.insert(mapping, string.format('%d', value))
+    end
+end
+table.insert(mapping, 'total_usage')
+table.insert(mapping, redis.call('GET', KEYS[2]) or '0')
+table.insert(mapping, 'current_period_usage')
+table.insert(mapping, redis.call('GET', KEYS[3]) or '0')
+table.insert(mapping, 'last_refresh_time')
+table.insert(mapping, redis.call('GET', KEYS[4]) or info['created_at'] or '0')
+
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3], KEYS[4])
+redis.call('HSET', KEYS[1], unpack(mapping))
+return 1
+"""
+
+# 逻辑删除: 检查 + 标记 + 通知缓存失效, 原子执行
+# KEYS[1] apikey:{key}:info (hash)
+# ARGV[1] 当前时间戳(秒)
+# ARGV[2] 缓存失效频道
+# ARGV[3] api key
+# 返回 1 删除成功, 0 不存在, -1 已被删除
+DELETE_API_KEY_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if redis.call('HGET', KEYS[1], 'deleted') == '1' then
+    return -1
+end
+redis.call('HSET', KEYS[1], 'deleted', 1, 'deleted_at', ARGV[1])
+redis.call('PUBLISH', ARGV[2], ARGV[3])
+return 1
+"""
@@ -0,0 +1,27 @@
+"""
+Convert API keys stored in the legacy layout (JSON ``apikey:{key}:info`` plus
+three counter strings) into a single hash per key, in place.
+
+Usage:
+    python -m prompt_agent.redis_manager.migrate_api_keys --batch_size=500
+"""
+import asyncio
+
+import fire
+from loguru import logger
+
+from prompt_agent.redis_manager.api_key_manager import get_api_key_manager
+
+
+async def migrate_api_keys(batch_size: int = 500):
+    stats = await get_api_key_manager().migrate_legacy_api_keys(batch_size=batch_size)
+    logger.info(f"Migrated API keys: {stats}")
+    return stats
+
+
+def main(batch_size: int = 500):
+    return asyncio.run(migrate_api_keys(batch_size=batch_size))
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
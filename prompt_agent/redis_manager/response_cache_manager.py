@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import json
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from prompt_agent.configs import (RESPONSE_CACHE_COLLECTION,
+                                  RESPONSE_CACHE_MAX_SIZE,
+                                  RESPONSE_CACHE_SEMANTIC_ENABLED,
+                                  RESPONSE_CACHE_SEMANTIC_THRESHOLD,
+                                  RESPONSE_CACHE_TTL_SECONDS)
+from prompt_agent.redis_manager.base_redis_manager import BaseRedisManager
+from prompt_agent.utils.ttl_cache import TTLCache
+
+RESPONSE_CACHE_STATS_KEY = "respcache:stats"
+
+
+def normalize_text(text: str) -> str:
+    """折叠空白, 只差空格/换行的 prompt 视为同一个"""
+    return " ".join(str(text).split())
+
+
+class ResponseCacheManager(BaseRedisManager):
+    """
+    优化结果的两级缓存。
+
+    一级为精确缓存: key 由规范化后的 (messages, model, collection, retrieval)
+    哈希得到, 进程内 LRU 在前, Redis (SET EX) 在后, 各 worker 共享。
+    Redis 侧的淘汰依赖 TTL, 以及服务端配置的 maxmemory-policy (建议 volatile-lru)。
+
+    二级为可选的语义缓存: 最后一条消息写入 Chroma (cosine), 上下文
+    (之前的消息与请求参数) 必须完全一致, 相似度达到阈值时复用对应的精确缓存条目。
+    Chroma 条目的 metadata 带有与 Redis TTL 一致的 expires_at, 查询时过滤掉
+    已过期的条目, 过期条目由定时任务清理; 命中的条目在 Redis 中已失效时立即删除。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ttl_seconds = RESPONSE_CACHE_TTL_SECONDS
+        self.semantic_enabled = RESPONSE_CACHE_SEMANTIC_ENABLED
+        self.semantic_threshold = RESPONSE_CACHE_SEMANTIC_THRESHOLD
+        if not hasattr(self, "_memory_cache"):
+            self._memory_cache = TTLCache(
+                maxsize=RESPONSE_CACHE_MAX_SIZE, ttl=RESPONSE_CACHE_TTL_SECONDS
+            )
+            self._semantic_collection = None
+
+    @staticmethod
+    def _cache_key(digest: str) -> str:
+        return f"respcache:{digest}"
+
+    @staticmethod
+    def _digest(payload: Any) -> str:
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def build_key(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        collection_name: str = "",
+        enable_retrival: bool = False,
+    ) -> str:
+        """精确缓存的 key"""
+        return self._digest(
+            {
+                "messages": [
+                    [message["role"], normalize_text(message["content"])]
+                    for message in messages
+                ],
+                "model": model,
+                "collection": collection_name or "",
+                "retrival": bool(enable_retrival),
+            }
+        )
+
+    def _context_key(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        collection_name: str,
+        enable_retrival: bool,
+    ) -> str:
+        """语义缓存只在除最后一条消息以外完全相同的上下文中匹配"""
+        return self.build_key(messages[:-1], model, collection_name, enable_retrival)
+
+    async def lookup(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        collection_name: str = "",
+        enable_retrival: bool = False,
+    ) -> Tuple[str, Optional[str], Optional[str]]:
+        """
+        返回 (key, 缓存内容, 命中级别 "exact"/"semantic"), 未命中时内容与级别为 None
+        """
+        key = self.build_key(messages, model, collection_name, enable_retrival)
+        content = await self._get(key)
+        level = "exact" if content is not None else None
+
+        if content is None and self.semantic_enabled:
+            similar_key = await self._semantic_lookup(
+                messages, model, collection_name, enable_retrival
+            )
+            if similar_key is not None:
+                content = await self._get(similar_key)
+                level = "semantic" if content is not None else None
+                if content is None:
+                    await self._semantic_delete([similar_key])
+
+        await self._incr_stat(
+            {"exact": "exact_hits", "semantic": "semantic_hits"}.get(level, "misses")
+        )
+        return key, content, level
+
+    async def store(
+        self,
+        key: str,
+        content: str,
+        messages: List[Dict[str, str]],
+        model: str,
+        collection_name: str = "",
+        enable_retrival: bool = False,
+    ):
+        self._memory_cache.set(key, content)
+        redis_client = await self.get_aioredis()
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.set(self._cache_key(key), content, ex=self.ttl_seconds)
+            pipe.hincrby(RESPONSE_CACHE_STATS_KEY, "stores", 1)
+            await pipe.execute()
+
+        if self.semantic_enabled:
+            await asyncio.to_thread(
+                self._semantic_add,
+                key,
+                normalize_text(messages[-1]["content"]),
+                self._context_key(messages, model, collection_name, enable_retrival),
+            )
+
+    async def _get(self, key: str) -> Optional[str]:
+        content = self._memory_cache.get(key)
+        if content is not None:
+            return content
+        redis_client = await self.get_aioredis()
+        content = await redis_client.get(self._cache_key(key))
+        if content is not None:
+            self._memory_cache.set(key, content)
+        return content
+
+    async def _incr_stat(self, field: str):
+        try:
+            redis_client = await self.get_aioredis()
+            await redis_client.hincrby(RESPONSE_CACHE_STATS_KEY, field, 1)
+        except Exception as e:
+            logger.warning(f"Failed to update response cache stats: {str(e)}")
+
+    def _get_semantic_collection(self):
+        if self._semantic_collection is None:
+            from prompt_agent.vector_db.prompt_vector_db import \
+                get_prompt_vector_db
+
+            self._semantic_collection = (
+                get_prompt_vector_db().client.get_or_create_collection(
+                    name=RESPONSE_CACHE_COLLECTION,
+                    metadata={"hnsw:space": "cosine"},
+                )
+            )
+        return self._semantic_collection
+
+    def _semantic_add(self, key: str, text: str, context_key: str):
+        self._get_semantic_collection().upsert(
+            ids=[key],
+            documents=[text],
+            metadatas=[
+                {
+                    "context_key": context_key,
+                    "expires_at": int(time.time()) + self.ttl_seconds,
+                }
+            ],
+        )
+
+    async def _semantic_delete(self, ids: List[str]):
+        try:
+            await asyncio.to_thread(self._get_semantic_collection().delete, ids=ids)
+        except Exception as e:
+            logger.warning(f"Failed to delete semantic response cache entries: {str(e)}")
+
+    async def prune_semantic_cache(self):
+        """删除 Chroma 中已过期的语义缓存条目"""
+        if not self.semantic_enabled:
+            return
+        try:
+            await asyncio.to_thread(
+                self._get_semantic_collection().delete,
+                where={"expires_at": {"$lte": int(time.time())}},
+            )
+        except Exception as e:
+            logger.warning(f"Failed to prune semantic response cache: {str(e)}")
+
+    async def _semantic_lookup(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        collection_name: str,
+        enable_retrival: bool,
+    ) -> Optional[str]:
+        context_key = self._context_key(
+            messages, model, collection_name, enable_retrival
+        )
+        try:
+            result = await asyncio.to_thread(
+                self._get_semantic_collection().query,
+                query_texts=[normalize_text(messages[-1]["content"])],
+                n_results=1,
+                where={
+                    "$and": [
+                        {"context_key": context_key},
+                        {"expires_at": {"$gt": int(time.time())}},
+                    ]
+                },
+            )
+        except Exception as e:
+            logger.warning(f"Semantic response cache lookup failed: {str(e)}")
+            return None
+
+        ids, distances = result["ids"][0], result["distances"][0]
+        # cosine 距离 = 1 - 相似度
+        if ids and 1 - distances[0] >= self.semantic_threshold:
+            return ids[0]
+        return None
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """命中率统计 (所有 worker 汇总)"""
+        redis_client = await self.get_aioredis()
+        raw = await redis_client.hgetall(RESPONSE_CACHE_STATS_KEY)
+        stats = {
+            field: int(raw.get(field, 0))
+            for field in ("exact_hits", "semantic_hits", "misses", "stores")
+        }
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["lookups"] = lookups
+        stats["hit_rate"] = (
+            (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        )
+        stats["memory_entries"] = len(self._memory_cache)
+        stats["semantic_enabled"] = self.semantic_enabled
+        return stats
+
+
+@lru_cache()
+def get_response_cache_manager():
+    return ResponseCacheManager()
+
+
+async def prune_semantic_response_cache():
+    await get_response_cache_manager().prune_semantic_cache()
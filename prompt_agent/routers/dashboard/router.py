@@ -12,8 +12,16 @@ from loguru import logger
 from pydantic import BaseModel, Field
 
 from prompt_agent.configs import DASHBOARD_PASSWORD, DASHBOARD_USERNAME
+from prompt_agent.models.base import PaginationError
 from prompt_agent.models.chat_message import (ChatMessage, RequestStatus,
                                               RequestType, UsageRecord)
+from prompt_agent.models.chat_search import search_chat_messages
+from prompt_agent.models.usage_rollup import UsageHourlyRollup
+from prompt_agent.provider import get_upstream_pool
+from prompt_agent.redis_manager.response_cache_manager import \
+    get_response_cache_manager
+from prompt_agent.utils.record_writer import get_record_writer
+from prompt_agent.utils.usage_tracking import get_usage_accounting
 
 router = APIRouter()
 
@@ -195,6 +203,8 @@ class PaginatedResponse(BaseModel):
     page: int
     page_size: int
     total_pages: int
+    # Pass as ``cursor`` to fetch the next page; None on the last page
+    next_cursor: Optional[str] = None
 
 
 class UsageStatsResponse(BaseModel):
@@ -223,6 +233,17 @@ class DashboardStatsResponse(BaseModel):
     error_breakdown: List[Dict[str, Any]]
 
 
+class ResponseCacheStatsResponse(BaseModel):
+    exact_hits: int
+    semantic_hits: int
+    misses: int
+    stores: int
+    lookups: int
+    hit_rate: float
+    memory_entries: int
+    semantic_enabled: bool
+
+
 # Chat Messages Endpoints
 @router.get("/chat-messages", response_model=PaginatedResponse)
 async def get_chat_messages(
@@ -235,6 +256,9 @@ async def get_chat_messages(
     page: int = Query(1, ge=1, description="Page number"),
     page_size: int = Query(20, ge=1, le=100, description="Items per page"),
     order_by: str = Query("-timestamp", description="Order by field"),
+    cursor: Optional[str] = Query(
+        None, description="next_cursor of the previous page (page is then ignored)"
+    ),
     current_user: str = Depends(require_auth),
 ):
     """Get chat messages with filtering and pagination"""
@@ -254,22 +278,23 @@ async def get_chat_messages(
         offset = (page - 1) * page_size
 
         # Get messages
+        results = []
         if search:
-            # Use search functionality
-            messages = await ChatMessage.search_items(
-                search_fields=["user_prompt", "assistant_response"],
-                search_term=search,
+            # Full-text search, ranked by relevance; total counts the matches
+            results, total = await search_chat_messages(
+                search, skip=offset, limit=page_size, **filters
+            )
+            messages = [result["message"] for result in results]
+            next_cursor = None
+        else:
+            messages, next_cursor = await ChatMessage.get_page(
+                cursor=cursor,
                 skip=offset,
                 limit=page_size,
                 order_by=order_by,
+                **filters,
             )
-            # For search, we need to count differently
-            total = await ChatMessage.get_count(**filters)
-        else:
-            messages = await ChatMessage.get_multi(
-                skip=offset, limit=page_size, order_by=order_by, **filters
-            )
-            total = await ChatMessage.get_count(**filters)
+            total = await ChatMessage.get_count_cached(**filters)
 
         # Convert to response format
         items = []
@@ -300,6 +325,9 @@ async def get_chat_messages(
                     "ip_address": msg.ip_address,
                 }
             )
+        for item, result in zip(items, results):
+            item["rank"] = result["rank"]
+            item["snippets"] = result["snippets"]
 
         total_pages = (total + page_size - 1) // page_size
 
@@ -309,8 +337,11 @@ async def get_chat_messages(
             page=page,
             page_size=page_size,
             total_pages=total_pages,
+            next_cursor=next_cursor,
         )
 
+    except PaginationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching chat messages: {str(e)}")
         raise HTTPException(
@@ -353,6 +384,9 @@ async def get_usage_records(
     page: int = Query(1, ge=1, description="Page number"),
     page_size: int = Query(20, ge=1, le=100, description="Items per page"),
     order_by: str = Query("-timestamp", description="Order by field"),
+    cursor: Optional[str] = Query(
+        None, description="next_cursor of the previous page (page is then ignored)"
+    ),
     current_user: str = Depends(require_auth),
 ):
     """Get usage records with filtering and pagination"""
@@ -376,10 +410,10 @@ async def get_usage_records(
         offset = (page - 1) * page_size
 
         # Get records
-        records = await UsageRecord.get_multi(
-            skip=offset, limit=page_size, order_by=order_by, **filters
+        records, next_cursor = await UsageRecord.get_page(
+            cursor=cursor, skip=offset, limit=page_size, order_by=order_by, **filters
         )
-        total = await UsageRecord.get_count(**filters)
+        total = await UsageRecord.get_count_cached(**filters)
 
         # Convert to response format
         items = []
@@ -415,8 +449,11 @@ async def get_usage_records(
             page=page,
             page_size=page_size,
             total_pages=total_pages,
+            next_cursor=next_cursor,
         )
 
+    except PaginationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching usage records: {str(e)}")
         raise HTTPException(
@@ -443,6 +480,38 @@ async def get_usage_stats(
         )
 
 
+@router.get("/response-cache-stats", response_model=ResponseCacheStatsResponse)
+async def get_response_cache_stats(current_user: str = Depends(require_auth)):
+    """Get hit/miss statistics of the prompt optimization response cache"""
+    try:
+        stats = await get_response_cache_manager().get_stats()
+        return ResponseCacheStatsResponse(**stats)
+
+    except Exception as e:
+        logger.error(f"Error fetching response cache stats: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error fetching response cache stats: {str(e)}"
+        )
+
+
+@router.get("/upstream-stats")
+async def get_upstream_stats(current_user: str = Depends(require_auth)):
+    """Get routing, concurrency and queue wait state of the upstream endpoints (this worker only)"""
+    return get_upstream_pool().stats()
+
+
+@router.get("/record-writer-stats")
+async def get_record_writer_stats(current_user: str = Depends(require_auth)):
+    """Get queue depth and write/spill counters of the record writer (this worker only)"""
+    return get_record_writer().stats()
+
+
+@router.get("/usage-accounting-stats")
+async def get_usage_accounting_stats(current_user: str = Depends(require_auth)):
+    """Get queue depth and job counters of the usage accounting pool (this worker only)"""
+    return get_usage_accounting().stats()
+
+
 @router.get("/api-key-usage", response_model=List[ApiKeyUsageResponse])
 async def get_api_key_usage(
     days: int = Query(30, ge=1, le=365, description="Number of days to analyze"),
@@ -451,36 +520,30 @@ async def get_api_key_usage(
 ):
     """Get usage statistics for top API keys"""
     try:
-        # Get all API keys with usage in the period
-        start_date = datetime.now() - timedelta(days=days)
-        records = await UsageRecord.filter(timestamp__gte=start_date).all()
-        api_keys = list(set(record.api_key for record in records))
+        # Per-key statistics from the hourly rollups, ranked in SQL
+        top_keys = await UsageHourlyRollup.get_top_api_keys(days=days, limit=limit)
 
-        results = []
-        for api_key in api_keys[:limit]:
-            # Get stats for this API key
-            stats = await UsageRecord.get_usage_stats(api_key=api_key, days=days)
-
-            # Get recent activity
-            recent_records = await UsageRecord.get_multi(
-                api_key=api_key, skip=0, limit=5, order_by="-timestamp"
-            )
+        # Recent activity of all of those keys in one query
+        recent_by_key = await UsageRecord.get_recent_by_api_keys(
+            [top_key["api_key"] for top_key in top_keys], limit=5
+        )
 
+        results = []
+        for top_key in top_keys:
+            api_key = top_key["api_key"]
             recent_activity = [
-                UsageRecordResponse.from_orm(record) for record in recent_records
+                UsageRecordResponse.from_orm(record)
+                for record in recent_by_key[api_key]
             ]
 
             results.append(
                 ApiKeyUsageResponse(
                     api_key=api_key[:10] + "..." if len(api_key) > 10 else api_key,
-                    usage_stats=UsageStatsResponse(**stats),
+                    usage_stats=UsageStatsResponse(**top_key["usage_stats"]),
                     recent_activity=recent_activity,
                 )
             )
 
-        # Sort by total requests
-        results.sort(key=lambda x: x.usage_stats.total_requests, reverse=True)
-
         return results
 
     except Exception as e:
@@ -497,70 +560,39 @@ async def get_dashboard_stats(
 ):
     """Get comprehensive dashboard statistics"""
     try:
+        # Everything below reads the hourly rollups, not usage_records
         # Overall stats
-        overall_stats = await UsageRecord.get_usage_stats(days=days)
+        overall_stats = await UsageHourlyRollup.get_usage_stats(days=days)
 
         # Top API keys by usage
-        start_date = datetime.now() - timedelta(days=days)
-        records = await UsageRecord.filter(timestamp__gte=start_date).all()
-
-        # Group by API key
-        api_key_usage = {}
-        for record in records:
-            key = (
-                record.api_key[:10] + "..."
-                if len(record.api_key) > 10
-                else record.api_key
-            )
-            if key not in api_key_usage:
-                api_key_usage[key] = {"count": 0, "tokens": 0}
-            api_key_usage[key]["count"] += 1
-            api_key_usage[key]["tokens"] += record.total_tokens or 0
-
         top_api_keys = [
-            {"api_key": k, "requests": v["count"], "tokens": v["tokens"]}
-            for k, v in sorted(
-                api_key_usage.items(), key=lambda x: x[1]["count"], reverse=True
-            )[:10]
+            {
+                "api_key": row["api_key"][:10] + "..."
+                if len(row["api_key"]) > 10
+                else row["api_key"],
+                "requests": int(row["requests"]),
+                "tokens": int(row["tokens"]),
+            }
+            for row in await UsageHourlyRollup.count_by("api_key", days=days, limit=10)
         ]
 
         # Hourly activity (last 24 hours)
-        last_24h = datetime.now() - timedelta(hours=24)
-        hourly_records = await UsageRecord.filter(timestamp__gte=last_24h).all()
-
-        hourly_activity = {}
-        for record in hourly_records:
-            hour = record.timestamp.strftime("%H:00")
-            hourly_activity[hour] = hourly_activity.get(hour, 0) + 1
-
-        hourly_activity_list = [
-            {"hour": hour, "requests": count}
-            for hour, count in sorted(hourly_activity.items())
-        ]
+        hourly_activity_list = await UsageHourlyRollup.get_hourly_activity(hours=24)
 
         # Model usage
-        model_usage = {}
-        for record in records:
-            model_usage[record.model] = model_usage.get(record.model, 0) + 1
-
         model_usage_list = [
-            {"model": model, "requests": count}
-            for model, count in sorted(
-                model_usage.items(), key=lambda x: x[1], reverse=True
-            )
+            {"model": row["model"], "requests": int(row["requests"])}
+            for row in await UsageHourlyRollup.count_by("model", days=days)
         ]
 
         # Error breakdown
-        error_records = [r for r in records if r.status != RequestStatus.SUCCESS]
-        error_breakdown = {}
-        for record in error_records:
-            status = record.status.value
-            error_breakdown[status] = error_breakdown.get(status, 0) + 1
-
         error_breakdown_list = [
-            {"status": status, "count": count}
-            for status, count in sorted(
-                error_breakdown.items(), key=lambda x: x[1], reverse=True
+            {
+                "status": RequestStatus(row["status"]).value,
+                "count": int(row["requests"]),
+            }
+            for row in await UsageHourlyRollup.count_by(
+                "status", days=days, status__not=RequestStatus.SUCCESS
             )
         ]
 
@@ -726,3 +758,4 @@ async def delete_usage_record(
         raise HTTPException(
             status_code=500, detail=f"Error deleting usage record: {str(e)}"
         )
+
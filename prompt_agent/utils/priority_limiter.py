@@ -0,0 +1,102 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Dict, List
+
+
+class QueueFullError(Exception):
+    """Raised when a limiter's wait queue is full; maps to 503 + Retry-After"""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PriorityLimiter:
+    """
+    Concurrency limiter with a bounded priority wait queue.
+
+    At most ``max_in_flight`` holders at a time (0 means unlimited). Callers
+    beyond that wait in a heap ordered by (priority, arrival), lower priority
+    values first; when ``max_queue`` callers are already waiting, ``acquire``
+    fails fast with QueueFullError instead of queueing. A released slot is
+    handed directly to the next waiter, so a newcomer can't overtake the queue.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, retry_after: int = 1):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.queued = 0
+        self._waiters: List[list] = []
+        self._counter = itertools.count()
+
+        self.total_waited = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.total_rejected = 0
+
+    def try_acquire(self) -> bool:
+        if self.max_in_flight <= 0 or (
+            self.in_flight < self.max_in_flight and not self.queued
+        ):
+            self.in_flight += 1
+            return True
+        return False
+
+    async def acquire(self, priority: int = 0) -> float:
+        """Wait for a slot; returns the time spent queueing in seconds"""
+        if self.try_acquire():
+            return 0.0
+        if self.queued >= self.max_queue:
+            self.total_rejected += 1
+            raise QueueFullError("Upstream queue is full", self.retry_after)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._counter), future])
+        self.queued += 1
+        started_at = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                # still queued: the stale heap entry is skipped by release()
+                self.queued -= 1
+            else:
+                # the slot was handed over right before the cancellation
+                self.release()
+            raise
+
+        waited_ms = (time.perf_counter() - started_at) * 1000
+        self.total_waited += 1
+        self.total_wait_ms += waited_ms
+        self.max_wait_ms = max(self.max_wait_ms, waited_ms)
+        return waited_ms / 1000
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # hand the slot over; in_flight stays the same
+                self.queued -= 1
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "total_waited": self.total_waited,
+            "avg_queue_wait_ms": (
+                self.total_wait_ms / self.total_waited if self.total_waited else 0.0
+            ),
+            "max_queue_wait_ms": self.max_wait_ms,
+            "total_rejected": self.total_rejected,
+        }
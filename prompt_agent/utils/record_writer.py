@@ -0,0 +1,281 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from loguru import logger
+from tortoise import Model, timezone
+from tortoise.transactions import in_transaction
+
+from prompt_agent.configs import (RECORD_WRITER_BATCH_SIZE,
+                                  RECORD_WRITER_FLUSH_INTERVAL_MS,
+                                  RECORD_WRITER_QUEUE_SIZE,
+                                  RECORD_WRITER_SPILL_ENABLED,
+                                  RECORD_WRITER_SPILL_PATH)
+from prompt_agent.models.chat_message import ChatMessage, UsageRecord
+from prompt_agent.utils.usage_rollup import add_to_rollups
+
+# Models the writer accepts, keyed by the name stored in the spill file
+RECORD_MODELS: Dict[str, Type[Model]] = {
+    model.__name__: model for model in (UsageRecord, ChatMessage)
+}
+
+_STOP = object()
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode_object(obj: Dict[str, Any]) -> Any:
+    if obj.keys() == {"$datetime"}:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+class RecordWriter:
+    """
+    Batched writer for usage and chat message records.
+
+    Producers call ``submit`` which only enqueues, so a request never waits
+    for the database. A single task drains the bounded queue and writes each
+    batch with one ``bulk_create`` per model once ``batch_size`` records are
+    collected or ``flush_interval_ms`` passed since the first one. When the
+    queue is full (the database can't keep up) or a batch fails to write, the
+    records are appended to a JSONL spill file that is replayed on the next
+    start, instead of piling up in memory. Usage records are added to the
+    hourly rollups in the same transaction as their insert.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = RECORD_WRITER_BATCH_SIZE,
+        flush_interval_ms: int = RECORD_WRITER_FLUSH_INTERVAL_MS,
+        queue_size: int = RECORD_WRITER_QUEUE_SIZE,
+        spill_path: Optional[Path] = (
+            RECORD_WRITER_SPILL_PATH if RECORD_WRITER_SPILL_ENABLED else None
+        ),
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.queue_size = queue_size
+        self.spill_path = Path(spill_path) if spill_path else None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._spill_lock = threading.Lock()
+        self._direct_writes: set = set()
+
+        self.written = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.failed_batches = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        await self.replay_spill()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run())
+        logger.info("Record writer started")
+
+    async def stop(self):
+        """Stop accepting records, flush everything queued and wait for it"""
+        if not self.running:
+            return
+        task, self._task = self._task, None
+        # Producers see the writer as stopped from here on; the sentinel goes
+        # in behind every queued record, so they are all flushed first
+        await self._queue.put(_STOP)
+        await task
+        self._queue = None
+        logger.info(
+            f"Record writer stopped: {self.written} written, {self.spilled} spilled, "
+            f"{self.dropped} dropped"
+        )
+
+    def submit(self, model: Type[Model], fields: Dict[str, Any]) -> bool:
+        """
+        Queue one record without waiting. Returns False if it could not be
+        queued and went to the spill file (or was dropped) instead.
+        """
+        fields = dict(fields)
+        if "timestamp" in model._meta.fields_map:
+            # Stamp at submit time, not at flush time
+            fields.setdefault("timestamp", timezone.localtime())
+
+        if not self.running:
+            # Not started (scripts, tests): write it directly
+            task = asyncio.create_task(self._flush([(model, fields)]))
+            self._direct_writes.add(task)
+            task.add_done_callback(self._direct_writes.discard)
+            return True
+        try:
+            self._queue.put_nowait((model, fields))
+            return True
+        except asyncio.QueueFull:
+            logger.warning("Record writer queue is full, spilling record to disk")
+            self._spill([(model, fields)])
+            return False
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(
+        self, batch: List[Tuple[Type[Model], Dict[str, Any]]], replayed: bool = False
+    ):
+        grouped: Dict[Type[Model], List[Dict[str, Any]]] = defaultdict(list)
+        for model, fields in batch:
+            grouped[model].append(fields)
+        for model, rows in grouped.items():
+            try:
+                async with in_transaction("default") as connection:
+                    new_rows = rows
+                    if replayed and model is UsageRecord:
+                        new_rows = await self._unwritten(rows, connection)
+                    # ignore_conflicts: records replayed from the spill file may
+                    # already have been written before a crash
+                    await model.bulk_create(
+                        [model(**fields) for fields in rows],
+                        ignore_conflicts=True,
+                        using_db=connection,
+                    )
+                    if model is UsageRecord:
+                        # Same transaction, so a failed batch leaves no partial
+                        # sums behind when it is spilled
+                        await add_to_rollups(new_rows, connection)
+                self.written += len(rows)
+            except Exception as e:
+                self.failed_batches += 1
+                logger.error(
+                    f"Failed to write {len(rows)} {model.__name__} records: {str(e)}"
+                )
+                await asyncio.to_thread(
+                    self._spill, [(model, fields) for fields in rows]
+                )
+
+    @staticmethod
+    async def _unwritten(
+        rows: List[Dict[str, Any]], connection
+    ) -> List[Dict[str, Any]]:
+        """
+        Replayed usage records that are not in the database yet, so only the
+        rows the insert keeps are added to the rollups (once per request_id)
+        """
+        written = set(
+            await UsageRecord.filter(request_id__in=[row["request_id"] for row in rows])
+            .using_db(connection)
+            .values_list("request_id", flat=True)
+        )
+        unwritten = []
+        for row in rows:
+            if row["request_id"] not in written:
+                written.add(row["request_id"])
+                unwritten.append(row)
+        return unwritten
+
+    def _spill(self, batch: List[Tuple[Type[Model], Dict[str, Any]]]):
+        if self.spill_path is None:
+            self.dropped += len(batch)
+            return
+        lines = "".join(
+            json.dumps(
+                {"model": model.__name__, "fields": fields},
+                ensure_ascii=False,
+                default=_encode_value,
+            )
+            + "\n"
+            for model, fields in batch
+        )
+        try:
+            with self._spill_lock, open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+            self.spilled += len(batch)
+        except OSError as e:
+            self.dropped += len(batch)
+            logger.error(f"Failed to spill {len(batch)} records: {str(e)}")
+
+    async def replay_spill(self) -> int:
+        """Write records left in the spill file back to the database"""
+        if self.spill_path is None or not self.spill_path.exists():
+            return 0
+        replaying = self.spill_path.with_suffix(".replaying")
+        with self._spill_lock:
+            # New spills go to a fresh file while this one is replayed
+            self.spill_path.replace(replaying)
+
+        batch = []
+        with open(replaying, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line, object_hook=_decode_object)
+                model = RECORD_MODELS.get(record["model"])
+                if model is None:
+                    logger.warning(f"Unknown model in spill file: {record['model']}")
+                    continue
+                batch.append((model, record["fields"]))
+
+        spilled_before = self.spilled
+        for start in range(0, len(batch), self.batch_size):
+            # Batches that fail again are re-spilled by _flush
+            await self._flush(batch[start : start + self.batch_size], replayed=True)
+        replaying.unlink()
+        logger.info(
+            f"Replayed {len(batch)} spilled records, "
+            f"{self.spilled - spilled_before} spilled again"
+        )
+        return len(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.queue_size,
+            "written": self.written,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+            "failed_batches": self.failed_batches,
+        }
+
+
+@lru_cache()
+def get_record_writer() -> RecordWriter:
+    return RecordWriter()
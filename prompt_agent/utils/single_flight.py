@@ -0,0 +1,174 @@
+import asyncio
+from collections import deque
+from contextlib import aclosing
+from functools import lru_cache
+from typing import (AsyncGenerator, Callable, Deque, Dict, Hashable, List,
+                    Optional)
+
+from loguru import logger
+
+from prompt_agent.configs import (SINGLE_FLIGHT_BUFFER_CHUNKS,
+                                  SINGLE_FLIGHT_LAG_SECONDS)
+
+
+class _Subscriber:
+    def __init__(self, chunks: List[str]):
+        # bounded by the flight's buffer_size; the producer waits while it is full
+        self.chunks: Deque[str] = deque(chunks)
+        self.readable = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.detached = False
+
+
+class _Flight:
+    def __init__(self):
+        # chunks so far, replayed to late subscribers; None once it outgrew the
+        # buffer size, after which the flight takes no new subscribers
+        self.history: Optional[List[str]] = []
+        self.subscribers: List[_Subscriber] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.metadata: Dict = {}
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical streams (per process).
+
+    The first caller for a key starts one producer task; later callers attach
+    to it while it is in flight. The producer pushes every chunk into each
+    subscriber's own buffer of at most ``buffer_size`` chunks. A full buffer
+    makes the producer wait (backpressure up to the upstream stream, as if
+    the client were reading it directly). With other subscribers attached it
+    waits at most ``lag_seconds``, then detaches the slow one, which gets an
+    error after its buffered chunks, so one slow client can't stall the rest.
+    Late subscribers are replayed the chunks so far, which are kept only up
+    to ``buffer_size``; a longer flight takes no new subscribers and an
+    identical request starts a flight of its own. When the last subscriber
+    leaves early the producer is cancelled, which closes the upstream stream.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = SINGLE_FLIGHT_BUFFER_CHUNKS,
+        lag_seconds: float = SINGLE_FLIGHT_LAG_SECONDS,
+    ):
+        self.buffer_size = buffer_size
+        self.lag_seconds = lag_seconds
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.detached = 0
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def stream(
+        self,
+        key: Hashable,
+        factory: Callable[[Dict], AsyncGenerator[str, None]],
+        metadata: Optional[Dict] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        factory(metadata) creates the producing generator; the metadata it
+        fills in is copied into each subscriber's ``metadata`` at the end.
+        """
+        if metadata is None:
+            metadata = {}
+        flight = self._flights.get(key)
+        leader = flight is None or flight.history is None
+        if leader:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._produce(key, flight, factory))
+        subscriber = _Subscriber(flight.history)
+        flight.subscribers.append(subscriber)
+
+        try:
+            while True:
+                if subscriber.chunks:
+                    chunk = subscriber.chunks.popleft()
+                    subscriber.writable.set()
+                    yield chunk
+                    continue
+                if subscriber.detached:
+                    raise ConnectionAbortedError(
+                        "Client fell behind the shared upstream stream"
+                    )
+                if flight.done:
+                    break
+                subscriber.readable.clear()
+                await subscriber.readable.wait()
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            if subscriber in flight.subscribers:
+                flight.subscribers.remove(subscriber)
+            # 生产者可能正在等这个订阅者的缓冲区
+            subscriber.writable.set()
+            metadata.update(flight.metadata)
+            metadata["single_flight"] = (
+                "detached" if subscriber.detached else "leader" if leader else "follower"
+            )
+            if not flight.subscribers and not flight.done:
+                flight.task.cancel()
+
+    async def _deliver(self, flight: _Flight, chunk: str):
+        for subscriber in list(flight.subscribers):
+            while len(subscriber.chunks) >= self.buffer_size:
+                subscriber.writable.clear()
+                try:
+                    await asyncio.wait_for(
+                        subscriber.writable.wait(), self.lag_seconds
+                    )
+                except asyncio.TimeoutError:
+                    # 只剩它一个订阅者时继续等待, 与直接转发上游流一样
+                    if flight.subscribers == [subscriber]:
+                        continue
+                    self._detach(flight, subscriber)
+                if subscriber not in flight.subscribers:
+                    break
+            if subscriber in flight.subscribers:
+                subscriber.chunks.append(chunk)
+                subscriber.readable.set()
+
+    def _detach(self, flight: _Flight, subscriber: _Subscriber):
+        flight.subscribers.remove(subscriber)
+        subscriber.detached = True
+        subscriber.readable.set()
+        self.detached += 1
+        logger.warning("Detached a single-flight subscriber that fell behind")
+
+    async def _produce(
+        self,
+        key: Hashable,
+        flight: _Flight,
+        factory: Callable[[Dict], AsyncGenerator[str, None]],
+    ):
+        try:
+            async with aclosing(factory(flight.metadata)) as generator:
+                async for chunk in generator:
+                    if flight.history is not None:
+                        if len(flight.history) < self.buffer_size:
+                            flight.history.append(chunk)
+                        else:
+                            flight.history = None
+                    await self._deliver(flight, chunk)
+        except asyncio.CancelledError:
+            flight.error = ConnectionAbortedError(
+                "Shared upstream stream was cancelled"
+            )
+        except Exception as e:
+            logger.error(f"Single-flight producer failed: {str(e)}")
+            flight.error = e
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.done = True
+            for subscriber in flight.subscribers:
+                subscriber.readable.set()
+
+
+@lru_cache()
+def get_single_flight():
+    return SingleFlight()
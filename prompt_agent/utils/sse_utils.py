@@ -1,4 +1,8 @@
 import json
+import time
+from typing import Optional
+
+SSE_DONE = "data: [DONE]\n\n"
 
 
 def build_sse_data(message: str, id: str = ""):
@@ -6,3 +10,41 @@ def build_sse_data(message: str, id: str = ""):
     data = {"message": message, "id": id}
     sse_data = f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
     return sse_data
+
+
+class ChatCompletionChunkEncoder:
+    """
+    Encode OpenAI ``chat.completion.chunk`` SSE frames for one response.
+
+    Everything except the content delta is constant within a response, so the
+    frame is split into a precomputed prefix/suffix around the JSON-encoded
+    delta instead of building and dumping a dict per chunk.
+    """
+
+    def __init__(
+        self, model: str, completion_id: str, created: Optional[int] = None
+    ):
+        created = int(time.time()) if created is None else created
+        head = (
+            f'data: {{"id":{json.dumps(completion_id)},"object":"chat.completion.chunk",'
+            f'"created":{created},"model":{json.dumps(model)},"choices":[{{"index":0,'
+        )
+        self._first_prefix = head + '"delta":{"role":"assistant","content":'
+        self._prefix = head + '"delta":{"content":'
+        self._suffix = '},"logprobs":null,"finish_reason":null}]}\n\n'
+        self._head = head
+        self._first = True
+
+    def encode(self, delta: str) -> str:
+        if self._first:
+            # 只在第一个chunk添加role
+            self._first = False
+            return self._first_prefix + json.dumps(delta) + self._suffix
+        return self._prefix + json.dumps(delta) + self._suffix
+
+    def finish(self, finish_reason: str = "stop") -> str:
+        return (
+            f'{self._head}"delta":{{}},"logprobs":null,'
+            f'"finish_reason":{json.dumps(finish_reason)}}}]}}\n\n'
+        )
+
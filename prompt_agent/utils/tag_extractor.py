@@ -0,0 +1,153 @@
+"""
+Incremental extraction of tagged blocks (e.g. ``<prompt>...</prompt>``) from a
+stream of text chunks.
+
+Only a tail shorter than the longest tag is carried between chunks. Each chunk
+is searched with ``str.find`` (carry + chunk, so every character is looked at a
+bounded number of times), and the carried tail is the longest suffix that is
+still a prefix of a tag, computed with the KMP failure function of that tag.
+"""
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from prompt_agent.configs import OUTPUT_PROMPT_END_TAG, OUTPUT_PROMPT_START_TAG
+
+
+class TaggedText(NamedTuple):
+    index: int  # index of the tag pair the text belongs to
+    text: str
+
+
+def _failure_table(pattern: str) -> List[int]:
+    failure = [0] * len(pattern)
+    k = 0
+    for i in range(1, len(pattern)):
+        while k and pattern[i] != pattern[k]:
+            k = failure[k - 1]
+        if pattern[i] == pattern[k]:
+            k += 1
+        failure[i] = k
+    return failure
+
+
+def _partial_match_length(text: str, pattern: str, failure: List[int]) -> int:
+    """Longest suffix of ``text`` that is a proper prefix of ``pattern``."""
+    state = 0
+    # a proper prefix is shorter than the pattern, so older characters can't matter
+    for ch in text[-(len(pattern) - 1) :] if len(pattern) > 1 else "":
+        while state and ch != pattern[state]:
+            state = failure[state - 1]
+        if ch == pattern[state]:
+            state += 1
+    return state
+
+
+class StreamingTagExtractor:
+    """
+    Feed text chunks and get back the text between the start and end tags.
+
+    ``tag_pairs`` is a sequence of ``(start_tag, end_tag)``; outside a block the
+    earliest start tag of any pair opens a block that is closed by that pair's
+    end tag. With ``max_blocks`` set the extractor is ``finished`` after that
+    many closed blocks and ignores further input.
+    """
+
+    def __init__(
+        self,
+        tag_pairs: Sequence[Tuple[str, str]] = (
+            (OUTPUT_PROMPT_START_TAG, OUTPUT_PROMPT_END_TAG),
+        ),
+        max_blocks: Optional[int] = None,
+    ):
+        if not tag_pairs or not all(start and end for start, end in tag_pairs):
+            raise ValueError("tag_pairs must contain non-empty (start, end) tags")
+        self.tag_pairs = list(tag_pairs)
+        self.max_blocks = max_blocks
+        self._start_failures = [_failure_table(start) for start, _ in self.tag_pairs]
+        self._end_failures = [_failure_table(end) for _, end in self.tag_pairs]
+        self._carry = ""
+        self.active: Optional[int] = None  # pair index of the open block
+        self.closed_blocks = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.max_blocks is not None and self.closed_blocks >= self.max_blocks
+
+    def feed(self, text: str) -> List[TaggedText]:
+        """Consume a chunk and return the block content that is safe to emit."""
+        output: List[TaggedText] = []
+        if not text or self.finished:
+            return output
+
+        buffer = self._carry + text
+        pos = 0
+        while not self.finished:
+            if self.active is None:
+                pos = self._open_block(buffer, pos)
+                if self.active is None:
+                    return output
+            else:
+                index = self.active
+                end_tag = self.tag_pairs[index][1]
+                end = buffer.find(end_tag, pos)
+                if end < 0:
+                    keep = _partial_match_length(
+                        buffer, end_tag, self._end_failures[index]
+                    )
+                    # never hold back more than this chunk's unread part
+                    keep = min(keep, len(buffer) - pos)
+                    if len(buffer) - keep > pos:
+                        output.append(
+                            TaggedText(index, buffer[pos : len(buffer) - keep])
+                        )
+                    self._carry = buffer[len(buffer) - keep :]
+                    return output
+                if end > pos:
+                    output.append(TaggedText(index, buffer[pos:end]))
+                pos = end + len(end_tag)
+                self.active = None
+                self.closed_blocks += 1
+
+        self._carry = ""
+        return output
+
+    def _open_block(self, buffer: str, pos: int) -> int:
+        """Look for the earliest start tag; returns the position after it."""
+        best = None
+        for index, (start_tag, _) in enumerate(self.tag_pairs):
+            found = buffer.find(start_tag, pos)
+            if found >= 0 and (
+                best is None
+                or found < best[0]
+                or (
+                    found == best[0]
+                    and len(start_tag) > len(self.tag_pairs[best[1]][0])
+                )
+            ):
+                best = (found, index)
+
+        if best is None:
+            unread = buffer[pos:]
+            keep = max(
+                _partial_match_length(unread, start_tag, failure)
+                for (start_tag, _), failure in zip(
+                    self.tag_pairs, self._start_failures
+                )
+            )
+            self._carry = unread[len(unread) - keep :] if keep else ""
+            return len(buffer)
+
+        found, index = best
+        self.active = index
+        return found + len(self.tag_pairs[index][0])
+
+    def flush(self) -> List[TaggedText]:
+        """
+        End of stream: text held back as a possible end tag prefix belongs to
+        the unterminated block and is released.
+        """
+        output = []
+        if self.active is not None and self._carry:
+            output.append(TaggedText(self.active, self._carry))
+        self._carry = ""
+        return output
+
@@ -1,9 +1,20 @@
+import hashlib
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
 from functools import lru_cache
+from itertools import accumulate
 from typing import Dict, List
 
 import tiktoken
 from loguru import logger
-from revgrokapi.configs import DEFAULT_TOKENIZER
+
+from prompt_agent.configs import DEFAULT_TOKENIZER, MESSAGE_TOKEN_CACHE_SIZE
+from prompt_agent.utils.async_task_utils import submit_task2event_loop
+
+# content digest -> token count; shared by the event loop and executor threads
+_message_token_cache: "OrderedDict[bytes, int]" = OrderedDict()
+_message_token_cache_lock = threading.Lock()
 
 
 @lru_cache
@@ -15,47 +26,91 @@ def get_token_length(prompt: str) -> int:
     return len(get_tokenizer().encode(prompt))
 
 
+def get_messages_token_length(messages: List[Dict]) -> int:
+    """Token count of the message contents, as billed for token quotas."""
+    encoder = get_tokenizer()
+    return sum(len(encoder.encode(str(message["content"]))) for message in messages)
+
+
+async def async_get_token_length(prompt: str) -> int:
+    """Tokenize in the default executor so long texts don't block the event loop."""
+    if not prompt:
+        return 0
+    return await submit_task2event_loop(get_token_length, prompt)
+
+
+async def async_get_messages_token_length(messages: List[Dict]) -> int:
+    if not messages:
+        return 0
+    return await submit_task2event_loop(get_messages_token_length, messages)
+
+
+def _format_message(message: Dict) -> str:
+    return f"{message['role']}: {message['content']}"
+
+
+def get_message_token_length(message: Dict) -> int:
+    """
+    Tokens of one ``role: content`` line plus its newline separator, cached by
+    content hash so a multi-turn history is tokenized once per message.
+    """
+    text = _format_message(message)
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    with _message_token_cache_lock:
+        count = _message_token_cache.get(digest)
+        if count is not None:
+            _message_token_cache.move_to_end(digest)
+            return count
+
+    count = get_token_length(text) + 1
+    with _message_token_cache_lock:
+        _message_token_cache[digest] = count
+        while len(_message_token_cache) > MESSAGE_TOKEN_CACHE_SIZE:
+            _message_token_cache.popitem(last=False)
+    return count
+
+
 def shorten_message_given_prompt_length(
     messages: List[Dict], token_limits: int
 ) -> List[Dict]:
-    messages_str = "\n".join(
-        [f"{message['role']}: {message['content']}" for message in messages]
-    )
-    token_length = get_token_length(messages_str)
+    """
+    Drop the oldest non-system messages until the conversation fits in
+    ``token_limits``. System messages and the final message are always kept.
+
+    Every message is tokenized once; the number of messages to drop is found
+    by a binary search over the prefix sums of the droppable message counts.
+    """
+    counts = [get_message_token_length(message) for message in messages]
+    token_length = sum(counts)
     # logger.debug(f"Token length: {token_length}")
     # logger.debug(f"Token limits: {token_limits}")
     if token_length <= token_limits:
         return messages
 
-    shortened_messages = messages.copy()
-
-    # Keep removing non-system messages from the beginning until under token limit
-    while len(shortened_messages) > 1:  # Keep at least one message
-        # Find first non-system message
-        remove_index = None
-        for i, msg in enumerate(shortened_messages):
-            if msg["role"] != "system":
-                remove_index = i
-                break
-
-        if remove_index is None:
-            break
-
-        # Remove the message
-        shortened_messages.pop(remove_index)
-
-        # Check if we're now under the limit
-        messages_str = "\n".join(
-            [
-                f"{message['role']}: {message['content']}"
-                for message in shortened_messages
-            ]
+    droppable = [
+        i for i, message in enumerate(messages[:-1]) if message["role"] != "system"
+    ]
+    excess = token_length - token_limits
+
+    # dropped[k] = tokens removed by dropping the first k droppable messages
+    dropped = list(accumulate((counts[i] for i in droppable), initial=0))
+    drop_count = min(bisect_left(dropped, excess), len(droppable))
+    if dropped[drop_count] < excess:
+        logger.warning(
+            f"Prompt still exceeds {token_limits} tokens after dropping "
+            f"{drop_count} messages"
         )
-        token_length = get_token_length(messages_str)
-        if token_length <= token_limits:
-            break
 
-    return shortened_messages
+    removed = set(droppable[:drop_count])
+    return [message for i, message in enumerate(messages) if i not in removed]
+
+
+async def async_shorten_message_given_prompt_length(
+    messages: List[Dict], token_limits: int
+) -> List[Dict]:
+    return await submit_task2event_loop(
+        shorten_message_given_prompt_length, messages, token_limits
+    )
 
 
 if __name__ == "__main__":
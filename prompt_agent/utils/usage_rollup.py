@@ -0,0 +1,191 @@
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Tuple
+
+from loguru import logger
+from redis.exceptions import LockError
+from tortoise import timezone
+from tortoise.expressions import Q
+from tortoise.functions import Coalesce, Count, Sum
+from tortoise.transactions import in_transaction
+
+from prompt_agent.configs import (USAGE_ROLLUP_RECONCILE_HOURS,
+                                  USAGE_ROLLUP_RECONCILE_INTERVAL_MINUTES,
+                                  USAGE_ROLLUP_SETTLE_SECONDS)
+from prompt_agent.db import format_placeholders
+from prompt_agent.models.chat_message import RequestStatus, UsageRecord
+from prompt_agent.models.usage_rollup import (LATENCY_BUCKETS_MS,
+                                              LATENCY_COLUMNS,
+                                              ROLLUP_SUM_COLUMNS,
+                                              UsageHourlyRollup, floor_hour)
+from prompt_agent.redis_manager.base_redis_manager import BaseRedisManager
+
+HOUR = timedelta(hours=1)
+# 每个 worker 都会调度对账任务, 通过 Redis 锁保证同一时间只有一个在跑;
+# 成功后不释放锁, 让它自然过期, 一个间隔内最多对账一次
+RECONCILE_LOCK_KEY = "usage_rollup:reconcile_lock"
+RECONCILE_LOCK_SECONDS = USAGE_ROLLUP_RECONCILE_INTERVAL_MINUTES * 60
+# 历史回填完成的标记, 不设过期
+BACKFILL_DONE_KEY = "usage_rollup:backfilled_at"
+RollupKey = Tuple[datetime, str, str, RequestStatus]
+
+
+def rollup_deltas(rows: Iterable[Dict[str, Any]]) -> Dict[RollupKey, Dict[str, int]]:
+    """Sum usage record fields (as queued by the record writer) per rollup row"""
+    deltas: Dict[RollupKey, Dict[str, int]] = defaultdict(
+        lambda: dict.fromkeys(ROLLUP_SUM_COLUMNS, 0)
+    )
+    for fields in rows:
+        key = (
+            floor_hour(fields["timestamp"]),
+            fields["api_key"],
+            fields["model"],
+            RequestStatus(fields.get("status", RequestStatus.SUCCESS)),
+        )
+        delta = deltas[key]
+        delta["request_count"] += 1
+        for column in ("input_tokens", "output_tokens", "total_tokens"):
+            delta[column] += fields.get(column) or 0
+        response_time_ms = fields.get("response_time_ms")
+        if response_time_ms is not None:
+            delta["response_time_sum_ms"] += response_time_ms
+            delta["response_time_count"] += 1
+            bucket = bisect_left(LATENCY_BUCKETS_MS, response_time_ms)
+            delta[LATENCY_COLUMNS[bucket]] += 1
+    return deltas
+
+
+async def add_to_rollups(rows: Iterable[Dict[str, Any]], connection):
+    """
+    Add a batch of usage records to the hourly rollups with one upsert per row
+    (INSERT ... ON CONFLICT DO UPDATE, supported by SQLite and Postgres). Run it
+    in the transaction that inserts the records.
+    """
+    deltas = rollup_deltas(rows)
+    if not deltas:
+        return
+    table = UsageHourlyRollup._meta.db_table
+    columns = ["bucket_hour", "api_key", "model", "status", *ROLLUP_SUM_COLUMNS]
+    updates = ", ".join(
+        f"{column} = {table}.{column} + excluded.{column}"
+        for column in ROLLUP_SUM_COLUMNS
+    )
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}, created_at, updated_at) "
+        f"VALUES ({', '.join('?' * (len(columns) + 2))}) "
+        f"ON CONFLICT (bucket_hour, api_key, model, status) "
+        f"DO UPDATE SET {updates}, updated_at = excluded.updated_at"
+    )
+    now = timezone.now()
+    values = [
+        [hour, api_key, model, status.value]
+        + [delta[column] for column in ROLLUP_SUM_COLUMNS]
+        + [now, now]
+        for (hour, api_key, model, status), delta in deltas.items()
+    ]
+    await connection.execute_many(format_placeholders(connection, sql), values)
+
+
+def _record_annotations() -> Dict[str, Any]:
+    # Same sums as rollup_deltas, computed by the database
+    annotations = {
+        "request_count": Count("id"),
+        "input_tokens": Coalesce(Sum("input_tokens"), 0),
+        "output_tokens": Coalesce(Sum("output_tokens"), 0),
+        "total_tokens": Coalesce(Sum("total_tokens"), 0),
+        "response_time_sum_ms": Coalesce(Sum("response_time_ms"), 0),
+        "response_time_count": Count("response_time_ms"),
+    }
+    lower = None
+    for column, upper in zip(LATENCY_COLUMNS, [*LATENCY_BUCKETS_MS, None]):
+        bucket = Q()
+        if lower is not None:
+            bucket &= Q(response_time_ms__gt=lower)
+        if upper is not None:
+            bucket &= Q(response_time_ms__lte=upper)
+        annotations[column] = Count("response_time_ms", _filter=bucket)
+        lower = upper
+    # Prefixed, annotations can't reuse UsageRecord's own field names
+    return {f"rollup_{name}": value for name, value in annotations.items()}
+
+
+async def rebuild_hour(hour: datetime) -> int:
+    """Replace the rollups of one hour with sums over its usage records"""
+    annotations = _record_annotations()
+    async with in_transaction("default") as connection:
+        rows = (
+            await UsageRecord.filter(timestamp__gte=hour, timestamp__lt=hour + HOUR)
+            .using_db(connection)
+            .annotate(**annotations)
+            .group_by("api_key", "model", "status")
+            .values("api_key", "model", "status", *annotations)
+        )
+        await UsageHourlyRollup.filter(bucket_hour=hour).using_db(connection).delete()
+        await UsageHourlyRollup.bulk_create(
+            [
+                UsageHourlyRollup(
+                    bucket_hour=hour,
+                    api_key=row["api_key"],
+                    model=row["model"],
+                    status=row["status"],
+                    **{
+                        column: int(row[f"rollup_{column}"])
+                        for column in ROLLUP_SUM_COLUMNS
+                    },
+                )
+                for row in rows
+            ],
+            using_db=connection,
+        )
+    return len(rows)
+
+
+async def reconcile_usage_rollups(hours: int = USAGE_ROLLUP_RECONCILE_HOURS):
+    """
+    Rebuild the last ``hours`` settled hours from usage_records, correcting
+    any drift of the incremental sums. Until a backfill has been recorded as
+    done in Redis, every hour since the oldest usage record is rebuilt
+    instead. The current hour is only maintained by the record writer.
+
+    Every worker schedules this job; a Redis lock lets one of them run it and
+    the others skip it for the rest of the interval.
+    """
+    redis_client = await BaseRedisManager().get_aioredis()
+    lock = redis_client.lock(RECONCILE_LOCK_KEY, timeout=RECONCILE_LOCK_SECONDS)
+    if not await lock.acquire(blocking=False):
+        logger.debug("Usage rollups are reconciled by another worker, skipping")
+        return
+
+    try:
+        now = timezone.now()
+        settled_until = floor_hour(
+            now - timedelta(seconds=USAGE_ROLLUP_SETTLE_SECONDS)
+        )
+        start = settled_until - hours * HOUR
+        backfill = not await redis_client.exists(BACKFILL_DONE_KEY)
+        if backfill:
+            oldest = await UsageRecord.all().order_by("timestamp").first()
+            if oldest is not None:
+                start = min(start, floor_hour(oldest.timestamp))
+
+        hour, rebuilt = start, 0
+        while hour < settled_until:
+            rebuilt += await rebuild_hour(hour)
+            hour += HOUR
+            # 回填可能很久, 逐小时续期, 不让锁在执行中过期
+            await lock.reacquire()
+    except Exception:
+        # 失败时立即释放, 下一次调度 (任意 worker) 可以重试
+        try:
+            await lock.release()
+        except LockError:
+            pass
+        raise
+
+    if backfill:
+        await redis_client.set(BACKFILL_DONE_KEY, now.isoformat())
+    logger.info(
+        f"Usage rollups {'backfilled' if backfill else 'reconciled'} from "
+        f"{start.isoformat()} to {settled_until.isoformat()}: {rebuilt} rows"
+    )
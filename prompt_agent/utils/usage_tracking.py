@@ -2,13 +2,19 @@ import asyncio
 import time
 import uuid
 from datetime import datetime
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 from fastapi import Request
 from loguru import logger
 
+from prompt_agent.configs import (USAGE_ACCOUNTING_QUEUE_SIZE,
+                                  USAGE_ACCOUNTING_WORKERS)
 from prompt_agent.models.chat_message import (ChatMessage, RequestStatus,
                                               RequestType, UsageRecord)
+from prompt_agent.utils.record_writer import get_record_writer
+
+_STOP = object()
 
 
 async def _safe_background_task(coro, task_name: str):
@@ -24,6 +30,104 @@ def create_background_task(coro, task_name: str = "background_task"):
     return asyncio.create_task(_safe_background_task(coro, task_name))
 
 
+class UsageAccounting:
+    """
+    Bounded pool for the accounting done after a response is sent: counting
+    output tokens, debiting token quotas and queueing the usage record.
+
+    A fixed number of workers drain a bounded queue, so a burst of finished
+    requests no longer spawns one task each. When the queue is full the job
+    runs in the caller's own task instead, which pushes back on the requests
+    producing the load rather than piling up work in memory.
+    """
+
+    def __init__(
+        self,
+        workers: int = USAGE_ACCOUNTING_WORKERS,
+        queue_size: int = USAGE_ACCOUNTING_QUEUE_SIZE,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+        self.completed = 0
+        self.ran_inline = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        logger.info(f"Usage accounting started with {self.workers} workers")
+
+    async def stop(self):
+        """Stop accepting jobs and wait for the queued ones to finish"""
+        if not self.running:
+            return
+        queue, tasks = self._queue, self._tasks
+        self._queue, self._tasks = None, []
+        for _ in tasks:
+            await queue.put(_STOP)
+        await asyncio.gather(*tasks)
+        logger.info(
+            f"Usage accounting stopped: {self.completed} completed, "
+            f"{self.ran_inline} ran inline, {self.failed} failed"
+        )
+
+    async def submit(self, fn: Callable[..., Awaitable[Any]], *args, name: str = ""):
+        """
+        Queue ``fn(*args)``. Returns at once unless the queue is full or the
+        pool is not started (scripts, tests); then the job runs here.
+        """
+        if self._queue is not None:
+            try:
+                self._queue.put_nowait((fn, args, name))
+                return
+            except asyncio.QueueFull:
+                logger.warning("Usage accounting queue is full, running job inline")
+        self.ran_inline += 1
+        await self._execute(fn, args, name)
+
+    async def _run(self):
+        # 停止时 _queue 已被置空, 使用启动时的队列
+        queue = self._queue
+        while True:
+            item = await queue.get()
+            if item is _STOP:
+                return
+            await self._execute(*item)
+
+    async def _execute(self, fn, args, name: str):
+        try:
+            await fn(*args)
+            self.completed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Usage accounting job '{name}' failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.queue_size,
+            "workers": self.workers,
+            "completed": self.completed,
+            "ran_inline": self.ran_inline,
+            "failed": self.failed,
+        }
+
+
+@lru_cache()
+def get_usage_accounting() -> UsageAccounting:
+    return UsageAccounting()
+
+
 def estimate_tokens(text: str) -> int:
     """
     Simple token estimation for text.
@@ -53,7 +157,7 @@ def get_user_agent(request: Request) -> Optional[str]:
     return request.headers.get("User-Agent")
 
 
-async def create_usage_record(
+def create_usage_record(
     request_id: str,
     api_key: str,
     request_type: RequestType,
@@ -69,9 +173,9 @@ async def create_usage_record(
     client_ip: Optional[str] = None,
     user_agent: Optional[str] = None,
     metadata: Optional[Dict] = None,
-) -> UsageRecord:
+) -> bool:
     """
-    Create a usage record in the database
+    Queue a usage record for the batched database writer
     """
     try:
         # Calculate response time
@@ -110,40 +214,43 @@ async def create_usage_record(
             # Example: $0.002 per 1K tokens (adjust based on your actual pricing)
             estimated_cost_usd = (total_tokens / 1000) * 0.002
 
-        usage_record = await UsageRecord.create_item(
-            request_id=request_id,
-            api_key=api_key,
-            request_type=request_type,
-            model=model,
-            status=status,
-            request_start_time=request_start_time,
-            request_end_time=request_end_time,
-            response_time_ms=response_time_ms,
-            input_tokens=input_tokens,
-            output_tokens=output_tokens,
-            total_tokens=total_tokens,
-            estimated_cost_usd=estimated_cost_usd,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            stream=stream,
-            enable_retrieval=enable_retrieval,
-            collection_name=collection_name,
-            error_message=error_message,
-            error_code=error_code,
-            ip_address=client_ip,
-            user_agent=user_agent,
-            metadata=metadata or {},
+        queued = get_record_writer().submit(
+            UsageRecord,
+            dict(
+                request_id=request_id,
+                api_key=api_key,
+                request_type=request_type,
+                model=model,
+                status=status,
+                request_start_time=request_start_time,
+                request_end_time=request_end_time,
+                response_time_ms=response_time_ms,
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                total_tokens=total_tokens,
+                estimated_cost_usd=estimated_cost_usd,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=stream,
+                enable_retrieval=enable_retrieval,
+                collection_name=collection_name,
+                error_message=error_message,
+                error_code=error_code,
+                ip_address=client_ip,
+                user_agent=user_agent,
+                metadata=metadata or {},
+            ),
         )
 
-        logger.info(f"Usage record created: {request_id} for API key {api_key[:10]}...")
-        return usage_record
+        logger.info(f"Usage record queued: {request_id} for API key {api_key[:10]}...")
+        return queued
 
     except Exception as e:
-        logger.error(f"Failed to create usage record for {request_id}: {str(e)}")
+        logger.error(f"Failed to queue usage record for {request_id}: {str(e)}")
         raise
 
 
-async def create_chat_message_record(
+def create_chat_message_record(
     request_id: str,
     api_key: str,
     model: str,
@@ -153,9 +260,9 @@ async def create_chat_message_record(
     request_params: Optional[Dict] = None,
     client_ip: Optional[str] = None,
     user_agent: Optional[str] = None,
-) -> ChatMessage:
+) -> bool:
     """
-    Create a chat message record in the database
+    Queue a chat message record for the batched database writer
     """
     try:
         # Extract request parameters
@@ -172,29 +279,32 @@ async def create_chat_message_record(
             enable_retrieval = request_params.get("enable_retrieval", False)
             collection_name = request_params.get("collection_name")
 
-        chat_message = await ChatMessage.create_item(
-            request_id=request_id,
-            api_key=api_key,
-            model=model,
-            user_prompt=user_prompt,
-            optimized_prompt=optimized_prompt,
-            assistant_response=assistant_response,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            stream=stream,
-            enable_retrieval=enable_retrieval,
-            collection_name=collection_name,
-            ip_address=client_ip,
-            user_agent=user_agent,
+        queued = get_record_writer().submit(
+            ChatMessage,
+            dict(
+                request_id=request_id,
+                api_key=api_key,
+                model=model,
+                user_prompt=user_prompt,
+                optimized_prompt=optimized_prompt,
+                assistant_response=assistant_response,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=stream,
+                enable_retrieval=enable_retrieval,
+                collection_name=collection_name,
+                ip_address=client_ip,
+                user_agent=user_agent,
+            ),
         )
 
         logger.info(
-            f"Chat message record created: {request_id} for API key {api_key[:10]}..."
+            f"Chat message record queued: {request_id} for API key {api_key[:10]}..."
         )
-        return chat_message
+        return queued
 
     except Exception as e:
-        logger.error(f"Failed to create chat message record for {request_id}: {str(e)}")
+        logger.error(f"Failed to queue chat message record for {request_id}: {str(e)}")
         raise
 
 
@@ -250,14 +360,14 @@ class UsageTracker:
             if hasattr(exc_val, "status_code"):
                 self.error_code = str(exc_val.status_code)
 
-        # Record usage as background task (non-blocking)
-        create_background_task(self.record_usage(), "usage_record")
+        # Queue the usage record (non-blocking)
+        self.record_usage()
 
-    async def record_usage(self):
-        """Record the usage in the database"""
+    def record_usage(self):
+        """Queue the usage record for the database writer"""
         try:
             # Record usage statistics
-            await create_usage_record(
+            create_usage_record(
                 request_id=self.request_id,
                 api_key=self.api_key,
                 request_type=self.request_type,
@@ -277,7 +387,7 @@ class UsageTracker:
 
             # # Record chat message if we have the conversation details
             # if self.user_prompt and self.assistant_response:
-            #     await create_chat_message_record(
+            #     create_chat_message_record(
             #         request_id=self.request_id,
             #         api_key=self.api_key,
             #         model=self.model,
@@ -0,0 +1,6 @@
+import os
+
+# prompt_agent.configs 要求这几项配置存在, 测试不会真正请求上游
+os.environ.setdefault("API_KEY", "test")
+os.environ.setdefault("BASE_URL", "http://localhost")
+os.environ.setdefault("DEFAULT_MODEL", "test-model")
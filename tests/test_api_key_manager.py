@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+import fakeredis
+import pytest
+
+from prompt_agent.redis_manager import api_key_manager as module
+from prompt_agent.redis_manager.api_key_manager import APIKeyManager
+
+
+@pytest.fixture
+def manager():
+    manager = APIKeyManager(host="fakeredis", port=0, db=0)
+    manager.aioredis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    manager._admit_script = manager._debit_script = None
+    manager._validity_cache.clear()
+    yield manager
+    APIKeyManager._instances.pop(("APIKeyManager", "fakeredis", 0, 0), None)
+
+
+def test_expired_key_is_invalid_while_cached(manager, monkeypatch):
+    async def scenario():
+        api_key = await manager.create_api_key(expiration_seconds=10)
+        admission = await manager.admit_api_key(api_key)
+        assert admission["success"]
+        assert await manager.is_api_key_valid(api_key)
+
+        # 准入结果已写入本地缓存, 过期后命中缓存也必须判定为无效
+        expired_at = time.time() + 13
+        monkeypatch.setattr(module.time, "time", lambda: expired_at)
+        assert manager._validity_cache.get(api_key) is not None
+        assert not await manager.is_api_key_valid(api_key)
+
+        manager._validity_cache.clear()
+        assert not await manager.is_api_key_valid(api_key)
+
+    asyncio.run(scenario())
+
+
+def test_scan_returns_partial_page_after_max_batches(manager):
+    async def scenario():
+        # 全部是未激活的 key, 按 ACTIVE 过滤时每批 SCAN 都不会命中
+        await manager.create_api_keys(count=50, expiration_seconds=60)
+
+        page = await manager.scan_api_keys(
+            page_size=5, status=module.APIKeyStatus.ACTIVE, max_batches=2
+        )
+        assert page["api_keys"] == []
+        assert page["next_cursor"] != 0
+
+        cursor, pages = page["next_cursor"], 1
+        while cursor != 0:
+            page = await manager.scan_api_keys(
+                cursor=cursor, page_size=5, status=module.APIKeyStatus.ACTIVE,
+                max_batches=2,
+            )
+            assert page["api_keys"] == []
+            cursor, pages = page["next_cursor"], pages + 1
+        assert pages > 1
+
+        assert len(await manager.list_api_keys()) == 50
+
+    asyncio.run(scenario())
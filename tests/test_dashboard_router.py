@@ -0,0 +1,76 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+from tortoise import timezone
+from tortoise.backends.sqlite.client import SqliteClient
+
+from benchmarks.seeding import (insert_rows, temporary_database,
+                                usage_record_rows)
+from prompt_agent.models.usage_rollup import floor_hour
+from prompt_agent.routers.dashboard.router import get_api_key_usage
+from prompt_agent.utils.usage_rollup import HOUR, rebuild_hour
+
+ROWS, KEYS, DAYS = 20_000, 500, 7
+
+
+@pytest.fixture
+def seeded_db():
+    """最近几天内 500 个 key 的用量记录 (分布不均) 及其小时汇总, 在同一个事件循环中使用"""
+    with asyncio.Runner() as runner:
+        database = temporary_database()
+        runner.run(database.__aenter__())
+        try:
+
+            async def seed():
+                await insert_rows(
+                    "usage_records",
+                    usage_record_rows(0, ROWS, keys=KEYS, seconds=DAYS * 86400, seed=0),
+                )
+                hour = floor_hour(timezone.now() - timedelta(days=DAYS))
+                while hour <= timezone.now():
+                    await rebuild_hour(hour)
+                    hour += HOUR
+
+            runner.run(seed())
+            yield runner
+        finally:
+            runner.run(database.__aexit__(None, None, None))
+
+
+@pytest.fixture
+def query_log(monkeypatch):
+    queries = []
+    for name in ("execute_query", "execute_query_dict"):
+        method = getattr(SqliteClient, name)
+
+        async def counted(self, query, values=None, _method=method):
+            queries.append(query)
+            return await _method(self, query, values)
+
+        monkeypatch.setattr(SqliteClient, name, counted)
+    return queries
+
+
+def test_api_key_usage_query_count_and_latency(seeded_db, query_log):
+    async def scenario():
+        # 预热: 建立读连接等一次性开销不计入
+        await get_api_key_usage(days=DAYS, limit=50, current_user="test")
+
+        query_log.clear()
+        started_at = time.perf_counter()
+        results = await get_api_key_usage(days=DAYS, limit=50, current_user="test")
+        elapsed = time.perf_counter() - started_at
+        return results, elapsed
+
+    results, elapsed = seeded_db.run(scenario())
+
+    assert len(results) == 50
+    requests = [result.usage_stats.total_requests for result in results]
+    assert requests == sorted(requests, reverse=True)
+    assert sum(requests) <= ROWS
+    assert all(1 <= len(result.recent_activity) <= 5 for result in results)
+    # 排名一次, 最近记录一次 UNION ALL 取 id 再按 id 取一次, 与 key 的数量无关
+    assert len(query_log) == 3, query_log
+    assert elapsed < 1.0
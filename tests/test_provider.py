@@ -0,0 +1,234 @@
+import asyncio
+import json
+from collections import Counter
+
+import httpx
+import openai
+import pytest
+
+from prompt_agent import provider as module
+from prompt_agent.provider import (UpstreamAttempt, UpstreamPool,
+                                   load_endpoints)
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def completion(content: str = "ok") -> dict:
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "m",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+    }
+
+
+def sse_chunk(content: str) -> bytes:
+    chunk = {
+        "id": "chatcmpl-test",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "m",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n".encode()
+
+
+class Upstream:
+    """One mocked upstream host: fixed delay before the first token, optional failure"""
+
+    def __init__(self, delay: float = 0.0, status: int = 200):
+        self.delay = delay
+        self.status = status
+        self.requests = 0
+        self.streams_closed_early = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.status != 200:
+            return httpx.Response(self.status, json={"error": {"message": "boom"}})
+        if not json.loads(request.content).get("stream"):
+            await asyncio.sleep(self.delay)
+            return httpx.Response(200, json=completion())
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            content=self._stream(),
+        )
+
+    async def _stream(self):
+        finished = False
+        try:
+            await asyncio.sleep(self.delay)
+            yield sse_chunk("hello")
+            yield b"data: [DONE]\n\n"
+            finished = True
+        finally:
+            if not finished:
+                self.streams_closed_early += 1
+
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    """Configure UPSTREAM_ENDPOINTS and route each endpoint's host to an Upstream"""
+    hosts = {}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return await hosts[request.url.host].handle(request)
+
+    monkeypatch.setattr(
+        module,
+        "build_http_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+    def configure(**endpoints):
+        configs = []
+        for name, (upstream, weight) in endpoints.items():
+            hosts[name] = upstream
+            configs.append(
+                {"name": name, "base_url": f"http://{name}/v1", "weight": weight}
+            )
+        monkeypatch.setattr(module, "UPSTREAM_ENDPOINTS", json.dumps(configs))
+        endpoints = load_endpoints()
+        for endpoint in endpoints:
+            # 测试中不需要 openai SDK 自带的重试与退避
+            endpoint.client = endpoint.client.with_options(max_retries=0)
+        return {endpoint.name: endpoint for endpoint in endpoints}
+
+    return configure
+
+
+def test_load_endpoints_from_config(upstreams):
+    endpoints = upstreams(a=(Upstream(), 3), b=(Upstream(), 1))
+    assert [(e.name, e.base_url, e.weight) for e in endpoints.values()] == [
+        ("a", "http://a/v1", 3.0),
+        ("b", "http://b/v1", 1.0),
+    ]
+
+
+def test_weighted_least_outstanding(upstreams):
+    a, b = Upstream(), Upstream()
+    endpoints = upstreams(a=(a, 3), b=(b, 1))
+    pool = UpstreamPool(list(endpoints.values()), routing="least_outstanding")
+
+    async def scenario():
+        # 请求结束前一直计入 outstanding, 选择按 (outstanding + 1) / weight
+        attempts = []
+        for _ in range(8):
+            attempts.append(
+                await pool.open_hedged(MESSAGES, False, "m", {}, deadline=0)
+            )
+        counts = Counter(attempt.endpoint.name for attempt in attempts)
+        assert counts == {"a": 6, "b": 2}
+        assert (endpoints["a"].outstanding, endpoints["b"].outstanding) == (6, 2)
+        assert (a.requests, b.requests) == (6, 2)
+
+        for attempt in attempts:
+            await attempt.close()
+        assert endpoints["a"].outstanding == endpoints["b"].outstanding == 0
+        assert endpoints["a"].limiter.in_flight == endpoints["b"].limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_ewma_prefers_faster_endpoint(upstreams):
+    endpoints = upstreams(fast=(Upstream(delay=0.0), 1), slow=(Upstream(delay=0.05), 1))
+    pool = UpstreamPool(list(endpoints.values()), routing="ewma")
+
+    async def scenario():
+        # 两个上游各取得一个延迟样本
+        for endpoint in endpoints.values():
+            attempt = await UpstreamAttempt(endpoint, "m", False).open(MESSAGES)
+            await attempt.close()
+        assert endpoints["fast"].ewma_latency_ms < endpoints["slow"].ewma_latency_ms
+
+        chosen = []
+        for _ in range(10):
+            attempt = await pool.open_hedged(MESSAGES, False, "m", {}, deadline=0)
+            chosen.append(attempt.endpoint.name)
+            await attempt.close()
+        assert set(chosen) == {"fast"}
+
+    asyncio.run(scenario())
+
+
+def test_failing_endpoint_is_ejected_and_readmitted(upstreams, monkeypatch):
+    monkeypatch.setattr(module, "UPSTREAM_EJECTION_FAILURES", 2)
+    monkeypatch.setattr(module, "UPSTREAM_EJECTION_SECONDS", 0.2)
+    bad = Upstream(status=500)
+    endpoints = upstreams(good=(Upstream(), 1), bad=(bad, 1))
+    pool = UpstreamPool(list(endpoints.values()))
+
+    async def fail_once():
+        with pytest.raises(openai.InternalServerError):
+            await UpstreamAttempt(endpoints["bad"], "m", False).open(MESSAGES)
+
+    def selected():
+        return {pool.select().name for _ in range(50)}
+
+    async def scenario():
+        assert selected() == {"good", "bad"}
+        await fail_once()
+        assert selected() == {"good", "bad"}
+        await fail_once()
+        assert selected() == {"good"}
+        assert endpoints["bad"].stats()["ejected"]
+
+        # 摘除时间过后重新参与路由, 处于半开状态: 再失败一次立即重新摘除
+        await asyncio.sleep(0.25)
+        assert selected() == {"good", "bad"}
+        await fail_once()
+        assert selected() == {"good"}
+
+        # 恢复正常后成功一次即清零失败计数
+        await asyncio.sleep(0.25)
+        bad.status = 200
+        attempt = await UpstreamAttempt(endpoints["bad"], "m", False).open(MESSAGES)
+        await attempt.close()
+        assert endpoints["bad"].consecutive_failures == 0
+        assert selected() == {"good", "bad"}
+        assert endpoints["bad"].total_failures == 3
+        assert endpoints["bad"].outstanding == endpoints["bad"].limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_hedge_fires_after_ttft_deadline_and_cancels_loser(upstreams):
+    slow, fast = Upstream(delay=1.0), Upstream(delay=0.0)
+    # 权重较高的慢上游先被选为 primary
+    endpoints = upstreams(slow=(slow, 2), fast=(fast, 1))
+    pool = UpstreamPool(list(endpoints.values()))
+
+    async def scenario():
+        metadata = {}
+        winner = await pool.open_hedged(MESSAGES, True, "m", metadata, deadline=0.05)
+        try:
+            assert metadata["hedge"] == "fired"
+            assert metadata["hedge_endpoint"] == "fast"
+            assert metadata["hedge_winner"] == "hedge"
+            assert metadata["upstream_endpoint"] == "fast"
+            assert metadata["upstream_ttft_ms"] < 1000
+            contents = [
+                chunk.choices[0].delta.content
+                async for chunk in winner.chunks()
+                if chunk.choices
+            ]
+            assert contents == ["hello"]
+        finally:
+            await winner.close()
+
+        # 输掉的 primary 已被取消: 上游流被提前关闭, 并发名额归还
+        assert (slow.requests, fast.requests) == (1, 1)
+        assert slow.streams_closed_early == 1
+        for endpoint in endpoints.values():
+            assert endpoint.outstanding == 0
+            assert endpoint.limiter.in_flight == 0
+
+    asyncio.run(scenario())
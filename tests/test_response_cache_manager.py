@@ -0,0 +1,85 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from prompt_agent.redis_manager import response_cache_manager as module
+from prompt_agent.redis_manager.response_cache_manager import ResponseCacheManager
+
+
+class FakeCollection:
+    """只实现语义缓存用到的 upsert/query/delete 与 where 过滤, 任意文本都视为相似"""
+
+    def __init__(self):
+        self.entries = {}
+
+    @staticmethod
+    def _matches(metadata, where):
+        if "$and" in where:
+            return all(FakeCollection._matches(metadata, part) for part in where["$and"])
+        (field, condition), = where.items()
+        if not isinstance(condition, dict):
+            return metadata[field] == condition
+        (op, value), = condition.items()
+        return {"$gt": metadata[field] > value, "$lte": metadata[field] <= value}[op]
+
+    def upsert(self, ids, documents, metadatas):
+        for id, document, metadata in zip(ids, documents, metadatas):
+            self.entries[id] = (document, metadata)
+
+    def query(self, query_texts, n_results, where):
+        ids = [
+            id for id, (document, metadata) in self.entries.items()
+            if self._matches(metadata, where)
+        ][:n_results]
+        return {"ids": [ids], "distances": [[0.0] * len(ids)]}
+
+    def delete(self, ids=None, where=None):
+        for id, (_, metadata) in list(self.entries.items()):
+            if (ids is not None and id in ids) or (
+                where is not None and self._matches(metadata, where)
+            ):
+                del self.entries[id]
+
+
+@pytest.fixture
+def manager():
+    manager = ResponseCacheManager(host="fakeredis", port=0, db=0)
+    manager.aioredis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    manager.semantic_enabled = True
+    manager.ttl_seconds = 100
+    manager._memory_cache.clear()
+    manager._semantic_collection = FakeCollection()
+    yield manager
+    ResponseCacheManager._instances.pop(("ResponseCacheManager", "fakeredis", 0, 0), None)
+
+
+def test_semantic_entries_expire_with_redis_ttl(manager, monkeypatch):
+    messages = [{"role": "user", "content": "improve this prompt"}]
+    similar = [{"role": "user", "content": "please improve this prompt"}]
+    collection = manager._semantic_collection
+
+    async def scenario():
+        key = manager.build_key(messages, "m")
+        await manager.store(key, "result", messages, "m")
+        assert collection.entries[key][1]["expires_at"] == int(module.time.time()) + 100
+
+        _, content, level = await manager.lookup(similar, "m")
+        assert (content, level) == ("result", "semantic")
+
+        # 条目在 Redis 中已失效: 语义命中后把它从 Chroma 删除
+        manager._memory_cache.clear()
+        await manager.aioredis.delete(manager._cache_key(key))
+        _, content, level = await manager.lookup(similar, "m")
+        assert (content, level) == (None, None)
+        assert key not in collection.entries
+
+        # 过期的条目查询时被过滤, 并由定时任务清理
+        await manager.store(key, "result", messages, "m")
+        now = module.time.time() + 101
+        monkeypatch.setattr(module.time, "time", lambda: now)
+        assert await manager._semantic_lookup(similar, "m", "", False) is None
+        await manager.prune_semantic_cache()
+        assert collection.entries == {}
+
+    asyncio.run(scenario())
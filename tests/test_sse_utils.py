@@ -0,0 +1,53 @@
+import json
+
+from prompt_agent.utils.sse_utils import SSE_DONE, ChatCompletionChunkEncoder
+
+
+def legacy_chunk(data: str, first_chunk: bool) -> dict:
+    """The dict the streaming response used to build for every delta."""
+    return {
+        "object": "chat.completion.chunk",
+        "model": "gpt-test",
+        "choices": [
+            {
+                "delta": {
+                    "content": f"{data}",
+                    **({"role": "assistant"} if first_chunk else {}),
+                }
+            }
+        ],
+    }
+
+
+def parse(frame: str) -> dict:
+    assert frame.startswith("data: ") and frame.endswith("\n\n")
+    return json.loads(frame[len("data: ") :])
+
+
+def test_frames_match_legacy_chunk_shape():
+    deltas = ["Hello", ' "quoted"\n', "", "中文 \\ </prompt>"]
+    encoder = ChatCompletionChunkEncoder("gpt-test", "chatcmpl-abc", created=1700000000)
+    frames = [parse(encoder.encode(delta)) for delta in deltas]
+
+    for i, (delta, chunk) in enumerate(zip(deltas, frames)):
+        expected = legacy_chunk(delta, first_chunk=i == 0)
+        assert chunk["object"] == expected["object"]
+        assert chunk["model"] == expected["model"]
+        assert chunk["id"] == "chatcmpl-abc"
+        assert chunk["created"] == 1700000000
+        assert chunk["choices"][0]["delta"] == expected["choices"][0]["delta"]
+        assert chunk["choices"][0]["index"] == 0
+        assert chunk["choices"][0]["finish_reason"] is None
+    # role 只出现在第一个 delta 中
+    assert [("role" in chunk["choices"][0]["delta"]) for chunk in frames] == [
+        True, False, False, False
+    ]
+
+    last = parse(encoder.finish("length"))
+    assert last["id"] == "chatcmpl-abc"
+    assert last["object"] == "chat.completion.chunk"
+    assert last["choices"] == [
+        {"index": 0, "delta": {}, "logprobs": None, "finish_reason": "length"}
+    ]
+    assert parse(encoder.finish())["choices"][0]["finish_reason"] == "stop"
+    assert SSE_DONE == "data: [DONE]\n\n"
@@ -0,0 +1,103 @@
+import random
+from typing import List, Optional, Sequence, Tuple
+
+import pytest
+
+from prompt_agent.utils.tag_extractor import StreamingTagExtractor
+
+# 标签之间互不为前缀, 且自身有重叠的前后缀, 用来覆盖跨 chunk 的部分匹配
+TAG_PAIRS = [("<prompt>", "</prompt>"), ("[ab[", "]ab]ab")]
+ALPHABET = "ab[]<>/prompt "
+
+
+def reference_extract(
+    text: str, tag_pairs: Sequence[Tuple[str, str]], max_blocks: Optional[int]
+) -> List[Tuple[int, str]]:
+    """Extraction over the whole text at once."""
+    blocks = []
+    pos = 0
+    while max_blocks is None or len(blocks) < max_blocks:
+        # 最早出现的开始标签, 位置相同时取较长的
+        found = [
+            (text.find(start, pos), -len(start), index)
+            for index, (start, _) in enumerate(tag_pairs)
+        ]
+        found = [candidate for candidate in found if candidate[0] >= 0]
+        if not found:
+            break
+        start_pos, neg_len, index = min(found)
+        body_start = start_pos - neg_len
+        end = text.find(tag_pairs[index][1], body_start)
+        if end < 0:
+            blocks.append((index, text[body_start:]))
+            break
+        blocks.append((index, text[body_start:end]))
+        pos = end + len(tag_pairs[index][1])
+    return [block for block in blocks if block[1]]
+
+
+def stream_extract(
+    chunks: List[str], tag_pairs: Sequence[Tuple[str, str]], max_blocks: Optional[int]
+) -> List[Tuple[int, str]]:
+    extractor = StreamingTagExtractor(tag_pairs, max_blocks=max_blocks)
+    segments = []
+    for chunk in chunks:
+        segments.extend(extractor.feed(chunk))
+    segments.extend(extractor.flush())
+    for segment in segments:
+        assert segment.text
+    return _joined([(segment.index, segment.text) for segment in segments])
+
+
+def _joined(blocks: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    # 一个块的内容会分多段输出; 紧邻的同一对标签的块也合并, 两边按同样方式比较
+    joined = []
+    for index, text in blocks:
+        if joined and joined[-1][0] == index:
+            joined[-1] = (index, joined[-1][1] + text)
+        else:
+            joined.append((index, text))
+    return joined
+
+
+def random_text(rng: random.Random) -> str:
+    parts = []
+    for _ in range(rng.randint(0, 12)):
+        if rng.random() < 0.3:
+            start, end = rng.choice(TAG_PAIRS)
+            tag = rng.choice((start, end))
+            # 有时只放标签的一部分
+            parts.append(tag if rng.random() < 0.7 else tag[: rng.randint(1, len(tag))])
+        else:
+            parts.append("".join(rng.choices(ALPHABET, k=rng.randint(0, 8))))
+    return "".join(parts)
+
+
+def random_chunks(rng: random.Random, text: str) -> List[str]:
+    chunks = []
+    pos = 0
+    while pos < len(text):
+        size = rng.choice((0, 1, 1, 2, 3, 5, 8, 13))
+        chunks.append(text[pos : pos + size])
+        pos += size
+    return chunks
+
+
+@pytest.mark.parametrize("max_blocks", [None, 1, 2])
+def test_random_chunkings_match_reference(max_blocks):
+    rng = random.Random(20240607)
+    for _ in range(3000):
+        text = random_text(rng)
+        expected = reference_extract(text, TAG_PAIRS, max_blocks)
+        for _ in range(3):
+            chunks = random_chunks(rng, text)
+            actual = stream_extract(chunks, TAG_PAIRS, max_blocks)
+            assert actual == _joined(expected), (text, chunks)
+
+
+def test_single_characters_around_tags():
+    text = "reasoning <prom<prompt>keep </prompt </prompt>tail <prompt>x"
+    chunks = list(text)
+    assert stream_extract(chunks, [TAG_PAIRS[0]], max_blocks=1) == [
+        (0, "keep </prompt ")
+    ]